@@ -0,0 +1,192 @@
+"""Local stand-in for momondo's flight-search pages, for exercising the scraper offline.
+
+python -m benchmarks.fixture_server --port 8765 --latency-ms 300 --progress-ms 2000 --error-rate 0.05 --block-rate 0.02
+python -m benchmarks.fixture_server --pages-dir recorded/   # serve saved result pages instead of synthetic ones
+"""
+
+import argparse
+import contextlib
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic import momondo_card
+
+SEARCH_PATH = re.compile(r'^/flight-search/(?P<departure>[A-Z]{3})-(?P<arrival>[A-Z]{3})/(?P<date>\d{4}-\d{2}-\d{2})/\d+adults')
+
+# Cards stay in a template until the fake search "completes", then the progressbar is hidden like on the real site
+RESULT_PAGE = """<html><head><title>{departure}-{arrival} {date}</title></head><body>
+<div role="progressbar" aria-hidden="false"></div>
+<div class="results"></div>
+<template id="cards">{cards}</template>
+<script>
+setTimeout(() => {{
+	document.querySelector('.results').appendChild(document.getElementById('cards').content.cloneNode(true));
+	document.querySelector('div[role="progressbar"]').setAttribute('aria-hidden', 'true');
+}}, {progress_ms});
+</script>
+</body></html>"""
+
+BLOCK_PAGE = """<html><head><title>momondo</title></head><body>
+<div role="progressbar" aria-hidden="true"></div>
+<h1>Are you a person or a robot?</h1><div class="captcha"></div>
+</body></html>"""
+
+
+@dataclass(frozen=True)
+class FixtureConfig:
+	latency_ms: float = 200.0
+	latency_jitter_ms: float = 100.0
+	progress_ms: float = 1500.0
+	error_rate: float = 0.0
+	block_rate: float = 0.0
+	cards_per_page: int = 15
+	pages_dir: str | None = None
+	seed: int | None = None
+
+
+class FixtureServer:
+	"""Threaded HTTP server answering /flight-search/ URLs the way Scraper.get_flights builds them"""
+
+	def __init__(self, config: FixtureConfig, host: str = '127.0.0.1', port: int = 0) -> None:
+		self.config = config
+		self._host = host
+		self._rng = random.Random(config.seed)
+		self._rng_lock = threading.Lock()
+		self._recorded = itertools.cycle(self._load_recorded(config.pages_dir)) if config.pages_dir else None
+		self.requests = 0
+		self._httpd = ThreadingHTTPServer((host, port), self._handler())
+		self._httpd.daemon_threads = True
+		self._thread: threading.Thread | None = None
+
+	@property
+	def url(self) -> str:
+		return f'http://{self._host}:{self._httpd.server_port}'
+
+	@staticmethod
+	def _load_recorded(pages_dir: str) -> list[str]:
+		pages = []
+		for name in sorted(os.listdir(pages_dir)):
+			if name.endswith('.html'):
+				with open(os.path.join(pages_dir, name), encoding='utf-8') as page:
+					pages.append(page.read())
+		if not pages:
+			raise ValueError(f'No .html pages found in {pages_dir}')
+		return pages
+
+	def _roll(self) -> tuple[float, float]:
+		with self._rng_lock:
+			self.requests += 1
+			return self._rng.random(), self._rng.uniform(-1, 1)
+
+	def _result_page(self, departure: str, arrival: str, day: datetime) -> str:
+		if self._recorded is not None:
+			with self._rng_lock:
+				return next(self._recorded)
+
+		with self._rng_lock:
+			cards = ''.join(momondo_card(self._rng, day) for _ in range(self.config.cards_per_page))
+		return RESULT_PAGE.format(departure=departure, arrival=arrival, date=f'{day:%Y-%m-%d}', cards=cards, progress_ms=int(self.config.progress_ms))
+
+	def _handler(self) -> type[BaseHTTPRequestHandler]:
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self) -> None:
+				config = server.config
+				roll, jitter = server._roll()
+				time.sleep(max(0.0, config.latency_ms + jitter * config.latency_jitter_ms) / 1000)
+
+				match = SEARCH_PATH.match(self.path)
+				if not match:
+					self._reply(404, '<html><body>Not found</body></html>')
+				elif roll < config.error_rate:
+					self._reply(503, '<html><body>Service unavailable</body></html>')
+				elif roll < config.error_rate + config.block_rate:
+					self._reply(200, BLOCK_PAGE)
+				else:
+					day = datetime.strptime(match['date'], '%Y-%m-%d')
+					self._reply(200, server._result_page(match['departure'], match['arrival'], day))
+
+			def _reply(self, status: int, body: str) -> None:
+				payload = body.encode('utf-8')
+				self.send_response(status)
+				self.send_header('Content-Type', 'text/html; charset=utf-8')
+				self.send_header('Content-Length', str(len(payload)))
+				self.end_headers()
+				self.wfile.write(payload)
+
+			def log_message(self, format: str, *args) -> None:
+				pass
+
+		return Handler
+
+	def serve_forever(self) -> None:
+		try:
+			self._httpd.serve_forever()
+		finally:
+			self._httpd.server_close()
+
+	def start(self) -> 'FixtureServer':
+		self._thread = threading.Thread(target=self._httpd.serve_forever, name='fixture-server', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		self._httpd.shutdown()
+		self._httpd.server_close()
+		if self._thread:
+			self._thread.join()
+
+	def __enter__(self) -> 'FixtureServer':
+		return self.start()
+
+	def __exit__(self, *exc_info) -> None:
+		self.stop()
+
+
+def add_fixture_arguments(parser: argparse.ArgumentParser) -> None:
+	parser.add_argument('--latency-ms', type=float, default=FixtureConfig.latency_ms, help='Server response delay')
+	parser.add_argument('--latency-jitter-ms', type=float, default=FixtureConfig.latency_jitter_ms, help='Uniform +/- jitter on the response delay')
+	parser.add_argument('--progress-ms', type=float, default=FixtureConfig.progress_ms, help='Delay before the progressbar completes and cards appear')
+	parser.add_argument('--error-rate', type=float, default=FixtureConfig.error_rate, help='Fraction of searches answered with HTTP 503')
+	parser.add_argument('--block-rate', type=float, default=FixtureConfig.block_rate, help='Fraction of searches answered with a bot-check page')
+	parser.add_argument('--cards-per-page', type=int, default=FixtureConfig.cards_per_page, help='Synthetic cards per result page')
+	parser.add_argument('--pages-dir', help='Directory of recorded .html result pages to serve round-robin')
+	parser.add_argument('--seed', type=int)
+
+
+def fixture_config(args: argparse.Namespace) -> FixtureConfig:
+	return FixtureConfig(
+		latency_ms=args.latency_ms,
+		latency_jitter_ms=args.latency_jitter_ms,
+		progress_ms=args.progress_ms,
+		error_rate=args.error_rate,
+		block_rate=args.block_rate,
+		cards_per_page=args.cards_per_page,
+		pages_dir=args.pages_dir,
+		seed=args.seed,
+	)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8765)
+	add_fixture_arguments(parser)
+	args = parser.parse_args()
+
+	server = FixtureServer(fixture_config(args), host=args.host, port=args.port)
+	print(f'Serving momondo fixtures on {server.url} (Ctrl+C to stop)')
+	with contextlib.suppress(KeyboardInterrupt):
+		server.serve_forever()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,118 @@
+"""Offline scraper load test: Scraper.get_flights against the local momondo stand-in, reported as queries per minute.
+
+	python -m benchmarks.load_test --queries 40 --concurrency 4 --progress-ms 1500
+	python -m benchmarks.load_test --queries 40 --concurrency 1 --humanize --compare benchmarks/results/load-baseline.json
+
+Needs the Playwright browser (playwright install chromium).
+"""
+
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from benchmarks.fixture_server import FixtureServer, add_fixture_arguments, fixture_config
+from benchmarks.run import RESULTS_DIR, git_commit
+from benchmarks.synthetic import SyntheticTrip
+from src.scraper.play import Scraper
+from src.scraper.readiness import ReadinessConfig
+from src.scraper.session import SessionConfig
+from src.scraper.stats import PHASES, QueryStats, classify_exception
+from src.utils.logger import percentile
+
+
+def run_query(scraper: Scraper, departure: str, arrival: str, day: datetime) -> QueryStats:
+	stats = QueryStats()
+	try:
+		scraper.get_flights(departure=departure, arrival=arrival, date=day.strftime('%Y-%m-%d'), stats=stats)
+	except Exception as e:
+		stats.outcome = classify_exception(e)
+		stats.error = str(e)
+	return stats
+
+
+def summarize(all_stats: list[QueryStats], seconds: float) -> dict:
+	phases = {}
+	for phase in (*PHASES, 'total'):
+		values = sorted(stats.total_ms if phase == 'total' else stats.phases[phase] for stats in all_stats if phase == 'total' or phase in stats.phases)
+		if values:
+			phases[phase] = {'p50_ms': round(percentile(values, 0.5), 1), 'p95_ms': round(percentile(values, 0.95), 1), 'mean_ms': round(statistics.fmean(values), 1)}
+
+	return {
+		'queries': len(all_stats),
+		'seconds': round(seconds, 3),
+		'queries_per_minute': round(len(all_stats) / seconds * 60, 2) if seconds else 0.0,
+		'outcomes': dict(Counter(stats.outcome for stats in all_stats)),
+		'flights': sum(stats.flight_count for stats in all_stats),
+		'phases': phases,
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--queries', type=int, default=20, help='Searches to run')
+	parser.add_argument('--concurrency', type=int, default=1, help='Searches in flight at once, one browser each')
+	parser.add_argument('--humanize', action='store_true', help='Keep the mouse/scroll interaction of a real scrape while pages load')
+	parser.add_argument('--settle-ms', type=int, default=ReadinessConfig.settle_ms, help='How long the card count must hold still before a page counts as loaded')
+	parser.add_argument('--interaction-budget-ms', type=int, default=ReadinessConfig.interaction_budget_ms)
+	parser.add_argument('--browser-state', metavar='DIR', help='Reuse cookies and the disk cache across queries from this directory')
+	parser.add_argument('--headed', action='store_true', help='Show the browser windows')
+	parser.add_argument('--output', help='Result file, defaults to benchmarks/results/load-<timestamp>.json')
+	parser.add_argument('--compare', metavar='BASELINE', help='Earlier load test result to compare queries per minute against')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed drop in queries per minute before it counts as a regression')
+	add_fixture_arguments(parser)
+	args = parser.parse_args()
+
+	trip = SyntheticTrip()
+	outbound, _ = trip.query_keys(1)
+	searches = [(departure, arrival, day + timedelta(days=index // len(outbound))) for index, (departure, arrival, day) in zip(range(args.queries), itertools.cycle(outbound))]
+
+	config = fixture_config(args)
+	with FixtureServer(config) as server:
+		scraper = Scraper(
+			base_url=server.url,
+			headless=not args.headed,
+			humanize=args.humanize,
+			readiness=ReadinessConfig(settle_ms=args.settle_ms, interaction_budget_ms=args.interaction_budget_ms),
+			session=SessionConfig(directory=args.browser_state) if args.browser_state else None,
+		)
+		start = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+			all_stats = list(pool.map(lambda search: run_query(scraper, *search), searches))
+		seconds = time.perf_counter() - start
+
+	summary = summarize(all_stats, seconds)
+	results = {
+		'created_at': datetime.now().isoformat(timespec='seconds'),
+		'git_commit': git_commit(),
+		'params': {'queries': args.queries, 'concurrency': args.concurrency, 'humanize': args.humanize, 'fixture': vars(config)},
+		**summary,
+	}
+
+	print(f'{summary["queries"]} queries in {summary["seconds"]:.1f}s: {summary["queries_per_minute"]:.1f} queries/min, outcomes {summary["outcomes"]}')
+	for phase, timing in summary['phases'].items():
+		print(f'  {phase:<11} p50 {timing["p50_ms"]:>9.1f} ms  p95 {timing["p95_ms"]:>9.1f} ms')
+
+	output = args.output or os.path.join(RESULTS_DIR, f'load-{datetime.now():%Y%m%d-%H%M%S}.json')
+	os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+	with open(output, 'w') as result_file:
+		json.dump(results, result_file, indent=2)
+	print(f'Results written to {output}')
+
+	if args.compare:
+		with open(args.compare) as baseline_file:
+			baseline = json.load(baseline_file)
+		ratio = summary['queries_per_minute'] / baseline['queries_per_minute'] if baseline['queries_per_minute'] else 0.0
+		print(f'vs {args.compare} ({baseline.get("git_commit")}): {ratio:.2f}x queries per minute')
+		if ratio < 1 - args.tolerance:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
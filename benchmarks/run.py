@@ -0,0 +1,229 @@
+"""End-to-end benchmark of the scrape → store → combine → view pipeline on synthetic data.
+
+python -m benchmarks.run --scale small
+python -m benchmarks.run --legs 200000 --stages persist cache_lookup
+python -m benchmarks.run --scale medium --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+
+from benchmarks.synthetic import QueryKey, SyntheticTrip, momondo_pages, synthetic_flights
+from src.models.records import FlightRecord, combination_row
+from src.scraper.play import Scraper
+from src.services.aggregates import BestDeals
+from src.services.database_service import DatabaseService
+from src.services.outputs import OUTPUTS_DIR
+from src.services.trip_agency_service import TripAgencyService
+
+SCALES = {'small': 2_000, 'medium': 50_000, 'large': 1_000_000}
+STAGES = ('parse', 'persist', 'cache_lookup', 'combine', 'write_outputs', 'viewer_load')
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+
+FilePair = tuple[QueryKey, datetime, list[FlightRecord], list[FlightRecord]]
+
+
+@dataclass
+class StageResult:
+	seconds: float
+	items: int
+	items_per_second: float
+
+
+@contextlib.contextmanager
+def working_directory(path: str) -> Iterator[None]:
+	previous = os.getcwd()
+	os.chdir(path)
+	try:
+		yield
+	finally:
+		os.chdir(previous)
+
+
+def timed(items: Callable[[], int]) -> StageResult:
+	"""Time only the measured part of a stage, leaving its setup out of the result"""
+	start = time.perf_counter()
+	count = items()
+	seconds = time.perf_counter() - start
+	return StageResult(seconds=round(seconds, 4), items=count, items_per_second=round(count / seconds, 1) if seconds else 0.0)
+
+
+def pairs(
+	outbound: dict[QueryKey, list[FlightRecord]], inbound: dict[QueryKey, list[FlightRecord]], stay_days: tuple[int, ...]
+) -> Iterator[tuple[QueryKey, datetime, list[FlightRecord], list[FlightRecord]]]:
+	"""Outbound/return flight lists per combinations file, in the order TripAgencyService pairs them"""
+	for key, dep_flights in outbound.items():
+		dep_air, arr_air, dep_dt = key
+		for stay in stay_days:
+			arr_date = dep_dt + timedelta(days=stay)
+			arr_flights = inbound.get((arr_air, dep_air, arr_date))
+			if dep_flights and arr_flights:
+				yield key, arr_date, dep_flights, arr_flights
+
+
+class Benchmark:
+	def __init__(self, trip: SyntheticTrip, legs: int, pages: int, cards_per_page: int, workdir: str) -> None:
+		self.trip = trip
+		self.legs = legs
+		self.pages = pages
+		self.cards_per_page = cards_per_page
+		self.workdir = workdir
+		self.search_date = date.today()
+		self.outbound, self.inbound = synthetic_flights(trip, legs, self.search_date)
+		self._database: DatabaseService | None = None
+		self._persisted = False
+
+	@property
+	def database(self) -> DatabaseService:
+		if self._database is None:
+			self._database = DatabaseService(database_url=f'sqlite:///{os.path.join(self.workdir, "bench.db")}', echo=False)
+		return self._database
+
+	def close(self) -> None:
+		if self._database is not None:
+			self._database.close()
+
+	def parse(self) -> StageResult:
+		scraper = Scraper()
+		pages = list(momondo_pages(self.trip, self.pages, self.cards_per_page))
+		return timed(lambda: sum(len(scraper.parse_momondo_flights(html, key[0], key[1], key[2].strftime('%Y-%m-%d'))) for key, html in pages))
+
+	def persist(self) -> StageResult:
+		database = self.database
+		self._persisted = True
+		return timed(lambda: sum(self._save(database, flights) for flights in [*self.outbound.values(), *self.inbound.values()]))
+
+	@staticmethod
+	def _save(database: DatabaseService, flights: list[FlightRecord]) -> int:
+		database.save_unique_flights(flights)
+		return len(flights)
+
+	def cache_lookup(self) -> StageResult:
+		if not self._persisted:
+			self.persist()
+		database = self.database
+		keys = [*self.outbound, *self.inbound]
+		return timed(lambda: sum(bool(database.get_flight_from_to_date(dep_air, arr_air, day, self.search_date)) for dep_air, arr_air, day in keys))
+
+	def combine(self) -> StageResult:
+		def build() -> int:
+			rows = 0
+			for _, _, dep_flights, arr_flights in pairs(self.outbound, self.inbound, self.trip.stay_days):
+				dep_cells = [(flight, flight.csv_cells()) for flight in dep_flights]
+				arr_cells = [(flight, flight.csv_cells()) for flight in arr_flights]
+				for dep, dep_row in dep_cells:
+					for arr, arr_row in arr_cells:
+						combination_row(dep, arr, dep_row, arr_row)
+						rows += 1
+			return rows
+
+		return timed(build)
+
+	def write_outputs(self) -> StageResult:
+		service = TripAgencyService(scraper=Scraper())
+
+		def write() -> int:
+			best_deals = BestDeals()
+			files = 0
+			for (dep_air, arr_air, dep_dt), arr_date, dep_flights, arr_flights in pairs(self.outbound, self.inbound, self.trip.stay_days):
+				service._write_combinations(dep_air, arr_air, dep_dt, arr_date, dep_flights, arr_flights, best_deals)
+				files += 1
+			best_deals.write()
+			return files
+
+		with working_directory(self.workdir):
+			return timed(write)
+
+	def viewer_load(self) -> StageResult:
+		# Imported here so the other stages run without streamlit's import cost
+		from flight_viewer import LiveFlightFrame
+
+		outputs_dir = os.path.join(self.workdir, OUTPUTS_DIR)
+		if not os.path.isdir(outputs_dir):
+			self.write_outputs()
+		return timed(lambda: len(LiveFlightFrame(outputs_dir).refresh()[0]))
+
+
+def git_commit() -> str | None:
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> bool:
+	"""Print per-stage speed ratios against a baseline; False when any stage regressed beyond the tolerance"""
+	with open(baseline_path) as baseline_file:
+		baseline = json.load(baseline_file)
+
+	ok = True
+	print(f'\nvs {baseline_path} ({baseline.get("git_commit")}, {baseline["params"]["legs"]} legs)')
+	for stage, result in results['stages'].items():
+		previous = baseline['stages'].get(stage)
+		if not previous or not previous['items_per_second'] or not result['items_per_second']:
+			continue
+		ratio = previous['items_per_second'] / result['items_per_second']
+		regressed = ratio > 1 + tolerance
+		ok &= not regressed
+		print(f'  {stage:<14} {ratio:6.2f}x time per item{"  REGRESSION" if regressed else ""}')
+	return ok
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--scale', choices=SCALES, default='small', help='Preset number of legs')
+	parser.add_argument('--legs', type=int, help='Number of synthetic legs, overrides --scale')
+	parser.add_argument('--legs-per-query', type=int, default=10, help='Legs returned per (route, date) search')
+	parser.add_argument('--pages', type=int, default=200, help='Result pages to parse')
+	parser.add_argument('--cards-per-page', type=int, default=15, help='Flight cards on each page')
+	parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--output', help='Result file, defaults to benchmarks/results/<scale>-<timestamp>.json')
+	parser.add_argument('--compare', metavar='BASELINE', help='Earlier result file to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown per item before a stage counts as a regression')
+	args = parser.parse_args()
+
+	legs = args.legs or SCALES[args.scale]
+	trip = SyntheticTrip(legs_per_query=args.legs_per_query, seed=args.seed)
+
+	results: dict = {
+		'created_at': datetime.now().isoformat(timespec='seconds'),
+		'git_commit': git_commit(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'params': {'legs': legs, 'legs_per_query': args.legs_per_query, 'pages': args.pages, 'cards_per_page': args.cards_per_page, 'seed': args.seed},
+		'stages': {},
+	}
+
+	with tempfile.TemporaryDirectory(prefix='flights-bench-') as workdir:
+		benchmark = Benchmark(trip, legs, args.pages, args.cards_per_page, workdir)
+		for stage in STAGES:
+			if stage not in args.stages:
+				continue
+			result = getattr(benchmark, stage)()
+			results['stages'][stage] = asdict(result)
+			print(f'{stage:<14} {result.seconds:10.3f}s {result.items:>10} items {result.items_per_second:>12.1f}/s')
+		benchmark.close()
+
+	output = args.output or os.path.join(RESULTS_DIR, f'{args.scale if not args.legs else legs}-{datetime.now():%Y%m%d-%H%M%S}.json')
+	os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+	with open(output, 'w') as result_file:
+		json.dump(results, result_file, indent=2)
+	print(f'Results written to {output}')
+
+	if args.compare and not compare(results, args.compare, args.tolerance):
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+"""Startup cost of the entry point and of each subsystem import, measured in fresh interpreters.
+
+python -m benchmarks.startup
+python -m benchmarks.startup --repeat 20 --compare benchmarks/results/startup-baseline.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.run import RESULTS_DIR, git_commit
+
+COMMANDS = {
+	'main --help': ['main.py', '--help'],
+	'scrape --help': ['main.py', 'scrape', '--help'],
+	'replay --help': ['main.py', 'replay', '--help'],
+	'combine --help': ['main.py', 'combine', '--help'],
+	'export --help': ['main.py', 'export', '--help'],
+	'compact --help': ['main.py', 'compact', '--help'],
+}
+
+MODULES = [
+	'src.utils.logger',
+	'src.models.database',
+	'src.services.database_service',
+	'src.services.trip_agency_service',
+	'src.scraper.play',
+	'playwright.sync_api',
+	'playwright_stealth',
+]
+
+
+def wall_ms(command: list[str], repeat: int) -> list[float]:
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, *command], capture_output=True, check=True)
+		timings.append((time.perf_counter() - start) * 1000)
+	return timings
+
+
+def summary(timings: list[float]) -> dict:
+	return {'median_ms': round(statistics.median(timings), 1), 'min_ms': round(min(timings), 1), 'max_ms': round(max(timings), 1)}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--repeat', type=int, default=10)
+	parser.add_argument('--output', help='Result file, defaults to benchmarks/results/startup-<timestamp>.json')
+	parser.add_argument('--compare', metavar='BASELINE', help='Earlier startup result to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown of a median before it counts as a regression')
+	args = parser.parse_args()
+
+	baseline_ms = wall_ms(['-c', 'pass'], args.repeat)
+	results: dict = {
+		'created_at': datetime.now().isoformat(timespec='seconds'),
+		'git_commit': git_commit(),
+		'python': sys.version.split()[0],
+		'repeat': args.repeat,
+		'interpreter': summary(baseline_ms),
+		'commands': {},
+		'imports': {},
+	}
+
+	for name, command in COMMANDS.items():
+		results['commands'][name] = summary(wall_ms(command, args.repeat))
+		print(f'{name:<36} {results["commands"][name]["median_ms"]:>8.1f} ms')
+
+	# Import cost on top of a bare interpreter start
+	interpreter_ms = results['interpreter']['median_ms']
+	for module in MODULES:
+		timing = summary(wall_ms(['-c', f'import {module}'], args.repeat))
+		timing['import_ms'] = round(timing['median_ms'] - interpreter_ms, 1)
+		results['imports'][module] = timing
+		print(f'import {module:<29} {timing["import_ms"]:>8.1f} ms')
+
+	output = args.output or os.path.join(RESULTS_DIR, f'startup-{datetime.now():%Y%m%d-%H%M%S}.json')
+	os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+	with open(output, 'w') as result_file:
+		json.dump(results, result_file, indent=2)
+	print(f'Results written to {output}')
+
+	if args.compare:
+		with open(args.compare) as baseline_file:
+			baseline = json.load(baseline_file)
+		regressed = False
+		for name, timing in results['commands'].items():
+			previous = baseline['commands'].get(name)
+			if previous:
+				ratio = timing['median_ms'] / previous['median_ms']
+				regressed |= ratio > 1 + args.tolerance
+				print(f'  {name:<34} {ratio:6.2f}x{"  REGRESSION" if ratio > 1 + args.tolerance else ""}')
+		if regressed:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,113 @@
+import itertools
+import random
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+from src.models.records import FlightRecord
+
+AIRLINES = ['TAP Air Portugal', 'Lufthansa', 'Air France', 'KLM', 'Emirates', 'Qatar Airways', 'Turkish Airlines', 'Finnair', 'Japan Airlines', 'ANA', 'Iberia', 'Swiss']
+CONNECTIONS = ['direto', '1 escala', '2 escalas', '1 escala, transbordo']
+
+QueryKey = tuple[str, str, datetime]
+
+
+@dataclass(frozen=True)
+class SyntheticTrip:
+	"""Shape of a generated search: every (origin, destination) pair is queried in both directions on each day"""
+
+	origins: tuple[str, ...] = ('OPO', 'LIS', 'MAD')
+	destinations: tuple[str, ...] = ('NRT', 'HND')
+	legs_per_query: int = 10
+	stay_days: tuple[int, ...] = (9, 10, 11)
+	first_day: datetime = datetime(2026, 8, 1)
+	seed: int = 1
+
+	def days_for(self, legs: int) -> int:
+		"""Number of consecutive search days needed to generate about `legs` legs"""
+		per_day = len(self.origins) * len(self.destinations) * 2 * self.legs_per_query
+		return max(1, -(-legs // per_day))
+
+	def dates(self, legs: int) -> list[datetime]:
+		return [self.first_day + timedelta(days=day) for day in range(self.days_for(legs))]
+
+	def query_keys(self, legs: int) -> tuple[list[QueryKey], list[QueryKey]]:
+		"""Outbound and return (departure, arrival, date) keys, as TripAgencyService builds its flight dicts"""
+		dates = self.dates(legs)
+		outbound = [(origin, destination, day) for origin in self.origins for destination in self.destinations for day in dates]
+		inbound = [(destination, origin, day) for origin in self.origins for destination in self.destinations for day in dates]
+		return outbound, inbound
+
+
+def synthetic_legs(rng: random.Random, key: QueryKey, count: int, search_date: date) -> list[FlightRecord]:
+	"""Plausible long-haul legs for one query: prices, durations and airlines vary, a few are self-transfers"""
+	departure_airport, arrival_airport, day = key
+	legs = []
+	for _ in range(count):
+		departure_at = day.replace(hour=rng.randrange(24), minute=rng.choice((0, 15, 30, 45)))
+		duration_minutes = rng.randrange(14 * 60, 36 * 60, 5)
+		stops = rng.choices((0, 1, 2), weights=(1, 6, 3))[0]
+		legs.append(
+			FlightRecord(
+				id=None,
+				search_date=search_date,
+				departure_airport=departure_airport,
+				arrival_airport=arrival_airport,
+				departure_at=departure_at,
+				arrival_at=departure_at + timedelta(minutes=duration_minutes),
+				price=float(rng.randrange(350, 2200)),
+				duration_minutes=duration_minutes,
+				stops=stops,
+				self_transfer=stops > 0 and rng.random() < 0.1,
+				companies=tuple(rng.sample(AIRLINES, k=max(1, stops))),
+			)
+		)
+	return legs
+
+
+def synthetic_flights(trip: SyntheticTrip, legs: int, search_date: date) -> tuple[dict[QueryKey, list[FlightRecord]], dict[QueryKey, list[FlightRecord]]]:
+	"""Outbound and return flight dicts holding about `legs` legs in total"""
+	rng = random.Random(trip.seed)
+	outbound_keys, inbound_keys = trip.query_keys(legs)
+	outbound = {key: synthetic_legs(rng, key, trip.legs_per_query, search_date) for key in outbound_keys}
+	inbound = {key: synthetic_legs(rng, key, trip.legs_per_query, search_date) for key in inbound_keys}
+	return outbound, inbound
+
+
+def _duration_text(minutes: int) -> str:
+	return f'{minutes // 60}h {minutes % 60:02d}m'
+
+
+def momondo_card(rng: random.Random, day: datetime) -> str:
+	"""One result card with the markup parse_momondo_flights reads"""
+	departure_at = day.replace(hour=rng.randrange(24), minute=rng.choice((0, 15, 30, 45)))
+	duration_minutes = rng.randrange(14 * 60, 36 * 60, 5)
+	arrival_at = departure_at + timedelta(minutes=duration_minutes)
+	extra_days = (arrival_at.date() - departure_at.date()).days
+	arrival_text = arrival_at.strftime('%H:%M') + (f'+{extra_days}' if extra_days else '')
+	companies = ' • '.join(rng.sample(AIRLINES, k=rng.randint(1, 2)))
+	price = rng.randrange(350, 2200)
+
+	# momondo.pt prints prices as "1.234 €"
+	price_text = f'{price:,}'.replace(',', '.')
+
+	return (
+		'<div class="nrc6-inner"><div class="nrc6-content-section">'
+		f'<div class="vmXl"><span>{departure_at:%H:%M}</span><span>–</span><span>{arrival_text}</span></div>'
+		f'<div class="vmXl"><span>{rng.choice(CONNECTIONS)}</span></div>'
+		f'<div class="xdW8 xdW8-mod-full-airport">{_duration_text(duration_minutes)}</div>'
+		f'<div class="J0g6-operator-text">{companies}</div>'
+		'</div><div class="nrc6-price-section">'
+		f'<div class="e2GB-price-text">{price_text} €</div>'
+		'</div></div>'
+	)
+
+
+def momondo_pages(trip: SyntheticTrip, pages: int, cards_per_page: int) -> Iterator[tuple[QueryKey, str]]:
+	"""Result pages padded with the kind of markup that surrounds the cards on the real site"""
+	rng = random.Random(trip.seed)
+	outbound_keys, _ = trip.query_keys(1)
+	for key in itertools.islice(itertools.cycle(outbound_keys), pages):
+		cards = ''.join(momondo_card(rng, key[2]) for _ in range(cards_per_page))
+		filler = '<div class="sidebar">' + '<div class="filter"><span>option</span></div>' * 200 + '</div>'
+		yield key, f'<html><head><title>{key[0]}-{key[1]}</title></head><body>{filler}<div class="results">{cards}</div></body></html>'
@@ -4,8 +4,10 @@ Simple flight data viewer for CSV files in outputs directory - IMPROVED VERSION
 """
 
 import os
+import threading
 from pathlib import Path
 
+import altair as alt
 import pandas as pd
 import streamlit as st
 
@@ -83,32 +85,360 @@ def create_friendly_name(filename):
 		return filename
 
 
-def load_csv_files(outputs_dir='outputs'):
-	"""Load all CSV files from the outputs directory"""
-	csv_files = {}
+def clean_combinations(df):
+	"""Drop self-transfer legs and the id/search date columns the viewer never shows"""
+	if 'dep_connections' in df.columns:
+		df = df[~df['dep_connections'].str.contains('transbordo', case=False, na=False)]
+	if 'arr_connections' in df.columns:
+		df = df[~df['arr_connections'].str.contains('transbordo', case=False, na=False)]
 
+	columns_to_remove = [col for col in df.columns if col.endswith('_id') or 'search_date' in col.lower()]
+	return df.drop(columns=columns_to_remove, errors='ignore')
+
+
+def list_csv_files(outputs_dir='outputs'):
+	"""Cheap directory signature: (path, mtime_ns, size) per CSV, sorted so it can key caches"""
 	if not os.path.exists(outputs_dir):
-		st.error(f"Directory '{outputs_dir}' not found!")
-		return csv_files
+		return ()
+
+	entries = []
+	with os.scandir(outputs_dir) as it:
+		for entry in it:
+			if entry.is_file() and entry.name.endswith('.csv'):
+				stat = entry.stat()
+				entries.append((entry.path, stat.st_mtime_ns, stat.st_size))
+	return tuple(sorted(entries))
+
+
+def build_airline_index(df):
+	"""Exploded (row, leg, airline) table over both legs, so airline filters become set lookups instead of per-row string scans"""
+	parts = []
+	for leg in ('dep', 'arr'):
+		column = f'{leg}_companies'
+		if column not in df.columns:
+			continue
+		exploded = df[column].dropna().astype(str).str.split(',').explode().str.strip()
+		exploded = exploded[exploded != '']
+		parts.append(pd.DataFrame({'row': exploded.index, 'leg': leg, 'airline': exploded.to_numpy()}))
+
+	if not parts:
+		return pd.DataFrame({'row': pd.Series(dtype='int64'), 'leg': pd.Series(dtype='category'), 'airline': pd.Series(dtype='category')})
+
+	index = pd.concat(parts, ignore_index=True)
+	index['leg'] = index['leg'].astype('category')
+	index['airline'] = index['airline'].astype('category')
+	return index
+
+
+def airline_rows(airline_index, airlines, legs=('dep', 'arr')):
+	"""Row labels of combinations where any of the given airlines operates one of the given legs"""
+	matches = airline_index['airline'].isin(airlines) & airline_index['leg'].isin(legs)
+	return airline_index.loc[matches, 'row'].unique()
+
 
-	csv_paths = list(Path(outputs_dir).glob('*.csv'))
+def read_combination_file(path):
+	"""Read and preprocess one combinations CSV"""
+	stem = Path(path).stem
+	df = clean_combinations(pd.read_csv(path))
 
-	if not csv_paths:
-		st.warning(f"No CSV files found in '{outputs_dir}' directory!")
-		return csv_files
+	dep_from, dep_to = extract_airports_from_filename(stem)
+	df['dep_from_airport'] = dep_from
+	df['dep_to_airport'] = dep_to
+	df['source_file'] = create_friendly_name(stem)
+	df['original_filename'] = stem
+	return df
 
-	for csv_path in csv_paths:
+
+def outputs_marker(outputs_dir='outputs'):
+	"""Cheap change marker for live refresh: the manifest the writer appends to, else the directory signature"""
+	from src.services.outputs import MANIFEST_FILE
+
+	try:
+		stat = os.stat(os.path.join(outputs_dir, MANIFEST_FILE))
+	except OSError:
+		return list_csv_files(outputs_dir)
+	return stat.st_mtime_ns, stat.st_size
+
+
+class LiveFlightFrame:
+	"""Combined frame over every CSV in a directory, updated by reading only the files added or rewritten since the last refresh"""
+
+	CATEGORY_COLUMNS = ('dep_from_airport', 'dep_to_airport', 'source_file', 'original_filename')
+
+	def __init__(self, outputs_dir):
+		self.outputs_dir = outputs_dir
+		self._lock = threading.Lock()
+		self._files = {}
+		self._errors = {}
+		self._next_row = 0
+		self._state = (pd.DataFrame(), build_airline_index(pd.DataFrame()), [], ())
+
+	def refresh(self):
+		"""Apply new, rewritten and removed files, then return (frame, airline_index, errors, signature)"""
+		with self._lock:
+			signature = list_csv_files(self.outputs_dir)
+			frame, airline_index, _, previous = self._state
+			if signature == previous:
+				return self._state
+
+			current = {path: (mtime_ns, size) for path, mtime_ns, size in signature}
+			stale = {Path(path).stem for path, version in self._files.items() if current.get(path) != version}
+
+			frames = []
+			for path, version in current.items():
+				if self._files.get(path) == version:
+					continue
+				self._errors.pop(path, None)
+				try:
+					df = read_combination_file(path)
+				except Exception as e:
+					self._errors[path] = f'Error loading {Path(path).name}: {e}'
+					continue
+				if not df.empty and df['dep_from_airport'].iloc[0]:
+					# Row labels keep growing so the airline index of untouched files stays valid
+					df.index = pd.RangeIndex(self._next_row, self._next_row + len(df))
+					self._next_row += len(df)
+					frames.append(df)
+
+			if stale and not frame.empty:
+				dropped = frame['original_filename'].isin(stale)
+				airline_index = airline_index[~airline_index['row'].isin(frame.index[dropped])]
+				frame = frame[~dropped]
+
+			if frames:
+				added = pd.concat(frames)
+				frame = pd.concat([frame, added]) if not frame.empty else added
+				added_index = build_airline_index(added)
+				airline_index = pd.concat([airline_index, added_index], ignore_index=True) if not airline_index.empty else added_index
+				for column in self.CATEGORY_COLUMNS:
+					frame[column] = frame[column].astype('category')
+				for column in ('leg', 'airline'):
+					airline_index[column] = airline_index[column].astype('category')
+
+			for path in set(self._errors) - set(current):
+				del self._errors[path]
+			self._files = current
+			self._state = (frame, airline_index, list(self._errors.values()), signature)
+			return self._state
+
+
+@st.cache_resource(show_spinner=False)
+def get_live_flight_frame(outputs_dir):
+	"""One LiveFlightFrame per directory, shared by all sessions"""
+	return LiveFlightFrame(outputs_dir)
+
+
+def poll_for_changes(marker_fn, *args):
+	"""Fragment body: rerun the whole app only when the data source's change marker moves"""
+	marker = marker_fn(*args)
+	if st.session_state.setdefault('live_marker', marker) != marker:
+		st.session_state['live_marker'] = marker
+		st.rerun()
+
+
+@st.cache_resource(show_spinner=False)
+def get_database_service(database_url):
+	"""One DatabaseService (and engine) per database URL, shared across sessions"""
+	from src.services.database_service import DatabaseService
+
+	return DatabaseService(database_url=database_url, echo=False)
+
+
+def database_version(database_url):
+	"""Changes whenever the SQLite file (or its WAL) is written, so it can key cached query results"""
+	db_path = database_url.replace('sqlite:///', '')
+	version = []
+	for path in (db_path, f'{db_path}-wal'):
 		try:
-			df = pd.read_csv(csv_path)
-			# Use filename without extension as key
-			original_filename = csv_path.stem
-			friendly_name = create_friendly_name(original_filename)
-			csv_files[friendly_name] = df
+			stat = os.stat(path)
+			version.append((stat.st_mtime_ns, stat.st_size))
+		except OSError:
+			version.append(None)
+	return tuple(version)
+
+
+@st.cache_data(max_entries=64, show_spinner='Querying flight database...')
+def query_flight_frame(database_url, db_version, query):
+	"""Run a trip query with every filter pushed into SQL and shape the result like the CSV frames"""
+	from src.models.records import COMBINATION_CSV_HEADERS, combination_row
+
+	pairs = get_database_service(database_url).get_trip_combinations(query)
+	if not pairs:
+		return pd.DataFrame(), build_airline_index(pd.DataFrame())
+
+	df = pd.DataFrame([combination_row(dep, arr) for dep, arr in pairs], columns=COMBINATION_CSV_HEADERS)
+
+	stems = [
+		f'dep_{dep.departure_airport}_{dep.arrival_airport}_{dep.departure_at:%Y-%m-%d}__arr_{arr.departure_airport}_{arr.arrival_airport}_{arr.departure_at:%Y-%m-%d}'
+		for dep, arr in pairs
+	]
+	df['dep_from_airport'] = pd.Categorical([dep.departure_airport for dep, _ in pairs])
+	df['dep_to_airport'] = pd.Categorical([dep.arrival_airport for dep, _ in pairs])
+	df['original_filename'] = pd.Categorical(stems)
+	df['source_file'] = df['original_filename'].map(create_friendly_name)
+	df = clean_combinations(df)
+	return df, build_airline_index(df)
+
+
+def compute_best_deals(df):
+	"""Cheapest combination per (route, departure date, stay), the same rows best_deals.csv holds"""
+	if df.empty:
+		return pd.DataFrame()
+
+	deals = pd.DataFrame({
+		'departure_airport': df['dep_from_airport'].astype(str),
+		'arrival_airport': df['dep_to_airport'].astype(str),
+		'departure_date': pd.to_datetime(df['dep_departure_date']),
+		'return_date': pd.to_datetime(df['arr_departure_date']),
+		'total_price': df['total_price'],
+		'dep_price': df['dep_price'],
+		'arr_price': df['arr_price'],
+		'trip_duration_days': df['trip_duration_days'],
+		'source_file': df['original_filename'].astype(str) + '.csv',
+	})
+	deals['stay_days'] = (deals['return_date'] - deals['departure_date']).dt.days
+
+	cheapest = deals.groupby(['departure_airport', 'arrival_airport', 'departure_date', 'stay_days'], sort=False)['total_price'].idxmin()
+	return deals.loc[cheapest.to_numpy()].reset_index(drop=True)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def read_best_deals(path, mtime_ns, size):
+	"""best_deals.csv as written by the combination step; mtime and size are only part of the cache key"""
+	return pd.read_csv(path, parse_dates=['departure_date', 'return_date'])
+
+
+def load_best_deals(signature, combined_df, departure_airport, arrival_airport):
+	"""Precomputed best deals when they are at least as new as every combinations CSV, else computed from the loaded frame"""
+	from src.services.aggregates import AGGREGATES_DIR, BEST_DEALS_FILE
+
+	path = os.path.join(AGGREGATES_DIR, BEST_DEALS_FILE)
+	try:
+		stat = os.stat(path)
+	except OSError:
+		stat = None
+
+	if stat is None or not signature or stat.st_mtime_ns < max(mtime_ns for _, mtime_ns, _ in signature):
+		return compute_best_deals(combined_df)
+
+	deals = read_best_deals(path, stat.st_mtime_ns, stat.st_size)
+	route_mask = pd.Series(True, index=deals.index)
+	if departure_airport != "ALL":
+		route_mask &= deals['departure_airport'] == departure_airport
+	if arrival_airport != "ALL":
+		route_mask &= deals['arrival_airport'] == arrival_airport
+	return deals[route_mask]
+
+
+def render_best_deals(deals):
+	"""Cheapest trip per stay length and a departure date x stay length price heatmap"""
+	st.subheader("💰 Best Deals by Trip Duration")
+
+	if deals.empty:
+		st.warning("No flights found to compare.")
+		return
+
+	available_stays = sorted(int(stay) for stay in deals['stay_days'].unique())
+	default_stays = [stay for stay in (9, 10, 11) if stay in available_stays] or available_stays
+	stays = st.multiselect("Stay length (days)", options=available_stays, default=default_stays, key='best_deal_stays')
+	deals = deals[deals['stay_days'].isin(stays)]
+
+	if deals.empty:
+		st.warning("No flights found for the selected stay lengths.")
+		return
+
+	best = deals.loc[deals.groupby('stay_days')['total_price'].idxmin()].sort_values('stay_days')
+	summary_df = pd.DataFrame({
+		'Duration': [f"{int(stay)} days" for stay in best['stay_days']],
+		'Price': [f"€{price:.0f}" for price in best['total_price']],
+		'Outbound': [f"{dep} → {arr}" for dep, arr in zip(best['departure_airport'], best['arrival_airport'])],
+		'Return': [f"{arr} → {dep}" for dep, arr in zip(best['departure_airport'], best['arrival_airport'])],
+		'Dep Date': best['departure_date'].dt.strftime('%b %d'),
+		'Ret Date': best['return_date'].dt.strftime('%b %d'),
+		'Out €': [f"€{price:.0f}" if pd.notna(price) else 'N/A' for price in best['dep_price']],
+		'Back €': [f"€{price:.0f}" if pd.notna(price) else 'N/A' for price in best['arr_price']],
+	})
+
+	st.dataframe(
+		summary_df,
+		use_container_width=True,
+		hide_index=True,
+		column_config={
+			"Duration": st.column_config.TextColumn("🗓️ Duration", width="small"),
+			"Price": st.column_config.TextColumn("💰 Total", width="small"),
+			"Outbound": st.column_config.TextColumn("🛫 Outbound Route", width="medium"),
+			"Return": st.column_config.TextColumn("🛬 Return Route", width="medium"),
+			"Dep Date": st.column_config.TextColumn("📅 Dep", width="small"),
+			"Ret Date": st.column_config.TextColumn("📅 Ret", width="small"),
+			"Out €": st.column_config.TextColumn("✈️ Out", width="small"),
+			"Back €": st.column_config.TextColumn("✈️ Back", width="small")
+		}
+	)
+
+	col1, col2, col3 = st.columns(3)
+	cheapest = best.loc[best['total_price'].idxmin()]
+	min_price = best['total_price'].min()
+	max_price = best['total_price'].max()
+	with col1:
+		st.metric("🏆 Best Deal", f"€{min_price:.0f}", f"{int(cheapest['stay_days'])} days")
+	with col2:
+		st.metric("💸 Most Expensive", f"€{max_price:.0f}")
+	with col3:
+		st.metric("📈 Price Difference", f"€{max_price - min_price:.0f}")
+
+	# Cheapest total over the selected routes for every departure date and stay length
+	calendar = deals.groupby(['departure_date', 'stay_days'], as_index=False)['total_price'].min()
+	heatmap = alt.Chart(calendar).mark_rect().encode(
+		x=alt.X('yearmonthdate(departure_date):O', title='Departure date'),
+		y=alt.Y('stay_days:O', title='Stay (days)'),
+		color=alt.Color('total_price:Q', title='Total (€)', scale=alt.Scale(scheme='redyellowgreen', reverse=True)),
+		tooltip=[alt.Tooltip('departure_date:T', title='Departure'), alt.Tooltip('stay_days:O', title='Stay'), alt.Tooltip('total_price:Q', title='Total (€)', format='.0f')],
+	)
+	st.altair_chart(heatmap, use_container_width=True)
 
-		except Exception as e:
-			st.error(f'Error loading {csv_path.name}: {e}')
 
-	return csv_files
+def database_filters(database_url, departure_airport, arrival_airport):
+	"""Sidebar widgets for the database source, returned as a TripQuery evaluated in SQL"""
+	from src.services.database_service import TripQuery
+
+	service = get_database_service(database_url)
+
+	st.sidebar.subheader('🔍 Query filters')
+	stay_days = st.sidebar.multiselect('Stay length (days)', options=list(range(3, 22)), default=[9, 10, 11])
+	if not stay_days:
+		st.warning('Select at least one stay length.')
+		st.stop()
+
+	route_query = TripQuery(
+		departure_airport=None if departure_airport == 'ALL' else departure_airport,
+		arrival_airport=None if arrival_airport == 'ALL' else arrival_airport,
+		stay_days=tuple(sorted(stay_days)),
+		limit=None,
+	)
+	bounds = service.get_trip_bounds(route_query)
+	if bounds is None:
+		st.warning('No flights found for the selected criteria')
+		st.stop()
+
+	min_price, max_price, min_days, max_days = bounds
+	price_range = (min_price, max_price)
+	if min_price < max_price:
+		price_range = st.sidebar.slider('Total price (€)', min_value=min_price, max_value=max_price, value=(min_price, max_price))
+	days_range = (min_days, max_days)
+	if min_days < max_days:
+		days_range = st.sidebar.slider('Trip duration (days)', min_value=min_days, max_value=max_days, value=(min_days, max_days))
+	airlines = st.sidebar.multiselect('Airlines (either leg)', options=service.get_airline_names())
+
+	return TripQuery(
+		departure_airport=route_query.departure_airport,
+		arrival_airport=route_query.arrival_airport,
+		stay_days=route_query.stay_days,
+		min_total_price=price_range[0],
+		max_total_price=price_range[1],
+		min_trip_days=days_range[0],
+		max_trip_days=days_range[1],
+		airlines=tuple(airlines),
+	)
 
 
 def format_currency(value):
@@ -137,367 +467,149 @@ def format_duration(value):
 		return str(value) if value else 'N/A'
 
 
-def main():
-	st.set_page_config(page_title='Flight Data Viewer', page_icon='✈️', layout='wide')
+def render_pair_detail(filename, df, airline_index, key_prefix):
+	"""Filters, sorting, the current page of cards and an on-demand download for one date pair"""
+	st.header(f'📊 {filename}')
 
-	st.title('✈️ Flight Data Viewer')
-	st.markdown('View and analyze flight search results with beautiful cards')
+	if df.empty:
+		st.warning('This file contains no data.')
+		return
 
-	# Load CSV files
-	csv_files = load_csv_files()
+	# Display basic info
+	col1, col2, col3 = st.columns(3)
+	with col1:
+		st.metric('Total Combinations', len(df))
+
+	if 'total_price' in df.columns:
+		with col2:
+			min_price = df['total_price'].min()
+			st.metric('Cheapest', f'€{min_price:.2f}')
+		with col3:
+			avg_price = df['total_price'].mean()
+			st.metric('Average Price', f'€{avg_price:.2f}')
+
+	# Filtering options
+	st.subheader('🔍 Filters')
+
+	filter_col1, filter_col2, filter_col3 = st.columns(3)
+
+	# Initialize filter ranges
+	price_range = None
+	duration_range = None
+	selected_companies = []
+
+	# Price filter
+	if 'total_price' in df.columns:
+		with filter_col1:
+			min_price = float(df['total_price'].min())
+			max_price = float(df['total_price'].max())
+
+			# Handle case where min equals max
+			if min_price == max_price:
+				st.write(f'Price: €{min_price:.2f}')
+				price_range = (min_price, max_price)
+			else:
+				price_range = st.slider('Price Range (€)', min_value=min_price, max_value=max_price, value=(min_price, max_price), key=f'price_{key_prefix}')
+
+	# Duration filter
+	if 'trip_duration_days' in df.columns:
+		with filter_col2:
+			min_duration = int(df['trip_duration_days'].min())
+			max_duration = int(df['trip_duration_days'].max())
+
+			# Handle case where min equals max
+			if min_duration == max_duration:
+				st.write(f'Trip Duration: {min_duration} days')
+				duration_range = (min_duration, max_duration)
+			else:
+				duration_range = st.slider('Trip Duration (days)', min_value=min_duration, max_value=max_duration, value=(min_duration, max_duration), key=f'duration_{key_prefix}')
 
-	if not csv_files:
-		st.stop()
+	# Company filter, answered from the pre-tokenized airline index
+	pair_airlines = airline_index[airline_index['row'].isin(df.index)]
+	if not pair_airlines.empty:
+		with filter_col3:
+			selected_companies = st.multiselect('Airlines', options=sorted(pair_airlines['airline'].unique()), key=f'companies_{key_prefix}')
+			airline_legs = st.radio('Operating', options=['Either leg', 'Outbound', 'Return'], horizontal=True, key=f'companies_leg_{key_prefix}')
 
-	# Filter and clean data
-	for filename, df in csv_files.items():
-		# Filter out flights with transfers/layovers (transbordo)
-		if 'dep_connections' in df.columns:
-			df = df[~df['dep_connections'].str.contains('transbordo', case=False, na=False)]
-		if 'arr_connections' in df.columns:
-			df = df[~df['arr_connections'].str.contains('transbordo', case=False, na=False)]
+	# Apply filters
+	filtered_df = df.copy()
 
-		# Remove ID and search date columns
-		columns_to_remove = [col for col in df.columns if col.endswith('_id') or 'search_date' in col.lower() or col.startswith('dep_id') or col.startswith('arr_id')]
+	if 'total_price' in df.columns and price_range is not None:
+		filtered_df = filtered_df[(filtered_df['total_price'] >= price_range[0]) & (filtered_df['total_price'] <= price_range[1])]
 
-		df = df.drop(columns=columns_to_remove, errors='ignore')
-		csv_files[filename] = df
+	if 'trip_duration_days' in df.columns and duration_range is not None:
+		filtered_df = filtered_df[(filtered_df['trip_duration_days'] >= duration_range[0]) & (filtered_df['trip_duration_days'] <= duration_range[1])]
 
-	# Add flight selection interface
-	st.markdown("---")
-	st.subheader("🎯 Select Your Flight Route")
-	
-	col1, col2, col3 = st.columns([1, 1, 2])
-	
-	with col1:
-		departure_airport = st.selectbox(
-			"✈️ Departure Airport",
-			options=["ALL", "OPO", "LIS", "MAD"],
-			index=0,
-			help="Select your departure airport or ALL for mixed combinations"
-		)
-	
-	with col2:
-		arrival_airport = st.selectbox(
-			"🛬 Tokyo Airport",
-			options=["ALL", "HND", "NRT"],
-			index=0,
-			help="Select your arrival airport in Tokyo or ALL for mixed combinations"
-		)
-	
-	with col3:
-		if departure_airport == "ALL" and arrival_airport == "ALL":
-			st.markdown("**Selected Route:** All Combinations")
-			st.markdown("**Including mixed routes:** OPO→NRT+HND→LIS, etc.")
-		elif departure_airport == "ALL":
-			st.markdown(f"**Selected Route:** Any → {arrival_airport}")
-			st.markdown(f"**From any city to:** {arrival_airport} ({'Haneda' if arrival_airport == 'HND' else 'Narita'})")
-		elif arrival_airport == "ALL":
-			st.markdown(f"**Selected Route:** {departure_airport} → Any")
-			st.markdown(f"**From:** {departure_airport} ({'Porto' if departure_airport == 'OPO' else 'Lisbon' if departure_airport == 'LIS' else 'Madrid'}) to any Tokyo airport")
-		else:
-			st.markdown(f"**Selected Route:** {departure_airport} → {arrival_airport}")
-			st.markdown(f"**Route Description:** {departure_airport} ({'Porto' if departure_airport == 'OPO' else 'Lisbon' if departure_airport == 'LIS' else 'Madrid'}) to {arrival_airport} ({'Haneda' if arrival_airport == 'HND' else 'Narita'})")
+	if selected_companies:
+		legs = {'Either leg': ('dep', 'arr'), 'Outbound': ('dep',), 'Return': ('arr',)}[airline_legs]
+		filtered_df = filtered_df[filtered_df.index.isin(airline_rows(pair_airlines, selected_companies, legs))]
 
-	# Get all available flight data for mixed combinations
-	all_flight_data = []
-	available_routes = set()
-	
-	# Load all CSV files and extract route information
-	outputs_dir = Path('outputs')
-	for csv_path in outputs_dir.glob('*.csv'):
-		try:
-			df = pd.read_csv(csv_path)
-			if df.empty:
-				continue
-				
-			# Clean the data
-			if 'dep_connections' in df.columns:
-				df = df[~df['dep_connections'].str.contains('transbordo', case=False, na=False)]
-			if 'arr_connections' in df.columns:
-				df = df[~df['arr_connections'].str.contains('transbordo', case=False, na=False)]
-			
-			# Remove ID and search date columns
-			columns_to_remove = [col for col in df.columns if col.endswith('_id') or 'search_date' in col.lower() or col.startswith('dep_id') or col.startswith('arr_id')]
-			df = df.drop(columns=columns_to_remove, errors='ignore')
-			
-			# Extract route information from filename
-			dep_from, dep_to = extract_airports_from_filename(csv_path.stem)
-			if dep_from and dep_to:
-				df['dep_from_airport'] = dep_from
-				df['dep_to_airport'] = dep_to
-				df['source_file'] = create_friendly_name(csv_path.stem)
-				df['original_filename'] = csv_path.stem
-				
-				# Filter based on selection
-				include_file = False
-				if departure_airport == "ALL" and arrival_airport == "ALL":
-					include_file = True
-				elif departure_airport == "ALL":
-					include_file = (dep_to == arrival_airport)
-				elif arrival_airport == "ALL":
-					include_file = (dep_from == departure_airport)
-				else:
-					include_file = (dep_from == departure_airport and dep_to == arrival_airport)
-				
-				if include_file:
-					available_routes.add(f"{dep_from} → {dep_to}")
-					all_flight_data.append(df)
-					
-		except Exception as e:
-			st.error(f"Error loading {csv_path.name}: {e}")
-	
-	if not all_flight_data:
-		st.warning(f"No flights found for the selected criteria")
-		st.stop()
+	# Display filtered count
+	if len(filtered_df) != len(df):
+		st.info(f'Showing {len(filtered_df)} of {len(df)} combinations after filtering')
 
-	# Combine all flight data
-	combined_df = pd.concat(all_flight_data, ignore_index=True)
-	
-	st.markdown("---")
-	st.info(f"Found data for routes: {', '.join(sorted(available_routes))}")
+	# Sort options
+	st.subheader('📈 Sorting')
+	sort_col1, sort_col2 = st.columns(2)
 
-	# Create summary table for cheapest flights by duration (9, 10, 11 days only)
-	st.subheader("💰 Best Deals by Trip Duration (9, 10, 11 days)")
-	
-	if 'trip_duration_days' in combined_df.columns and 'total_price' in combined_df.columns:
-		# Filter for only 9, 10, 11 day trips
-		duration_filter = combined_df['trip_duration_days'].isin([9, 10, 11])
-		filtered_duration_df = combined_df[duration_filter]
-		
-		if not filtered_duration_df.empty:
-			# Group by trip duration and find cheapest for each duration
-			summary_data = []
-			
-			for duration in [9, 10, 11]:
-				duration_df = filtered_duration_df[filtered_duration_df['trip_duration_days'] == duration]
-				if not duration_df.empty:
-					cheapest_idx = duration_df['total_price'].idxmin()
-					cheapest_row = duration_df.loc[cheapest_idx]
-					
-					# Get return route info from the data
-					return_from = cheapest_row.get('arr_departure_airport', 'N/A')
-					return_to = cheapest_row.get('arr_arrival_airport', 'N/A')
-					
-					summary_data.append({
-						'Duration': f"{int(duration)} days",
-						'Price': f"€{cheapest_row['total_price']:.0f}",
-						'Outbound': f"{cheapest_row['dep_from_airport']} → {cheapest_row['dep_to_airport']}",
-						'Return': f"{return_from} → {return_to}" if return_from != 'N/A' else f"{cheapest_row['dep_to_airport']} → {cheapest_row['dep_from_airport']}",
-						'Dep Date': pd.to_datetime(cheapest_row['dep_departure_date']).strftime('%b %d') if pd.notna(cheapest_row['dep_departure_date']) else 'N/A',
-						'Ret Date': pd.to_datetime(cheapest_row['arr_departure_date']).strftime('%b %d') if pd.notna(cheapest_row['arr_departure_date']) else 'N/A',
-						'Out €': f"€{cheapest_row['dep_price']:.0f}" if pd.notna(cheapest_row['dep_price']) else 'N/A',
-						'Back €': f"€{cheapest_row['arr_price']:.0f}" if pd.notna(cheapest_row['arr_price']) else 'N/A'
-					})
-			
-			if summary_data:
-				summary_df = pd.DataFrame(summary_data)
-				
-				# Display as a nice table
-				st.dataframe(
-					summary_df,
-					use_container_width=True,
-					hide_index=True,
-					column_config={
-						"Duration": st.column_config.TextColumn("🗓️ Duration", width="small"),
-						"Price": st.column_config.TextColumn("💰 Total", width="small"),
-						"Outbound": st.column_config.TextColumn("🛫 Outbound Route", width="medium"),
-						"Return": st.column_config.TextColumn("🛬 Return Route", width="medium"),
-						"Dep Date": st.column_config.TextColumn("📅 Dep", width="small"),
-						"Ret Date": st.column_config.TextColumn("📅 Ret", width="small"),
-						"Out €": st.column_config.TextColumn("✈️ Out", width="small"),
-						"Back €": st.column_config.TextColumn("✈️ Back", width="small")
-					}
-				)
-				
-				# Show some quick stats
-				col1, col2, col3 = st.columns(3)
-				with col1:
-					prices = [float(price.replace('€', '')) for price in summary_df['Price']]
-					min_price = min(prices)
-					best_duration = summary_df.loc[prices.index(min_price), 'Duration']
-					st.metric("🏆 Best Deal", f"€{min_price:.0f}", f"{best_duration}")
-				with col2:
-					max_price = max(prices)
-					st.metric("� Most Expensive", f"€{max_price:.0f}")
-				with col3:
-					price_diff = max_price - min_price
-					st.metric("📈 Price Difference", f"€{price_diff:.0f}")
-			else:
-				st.warning("No flights found for 9, 10, or 11 day durations.")
-		else:
-			st.warning("No flights found for 9, 10, or 11 day durations.")
-	else:
-		st.warning("Missing required columns for price analysis.")
-
-	# Now create filtered CSV files for tabs (keeping original logic for detailed view)
-	filtered_csv_files = {}
-	original_filenames = {}
-	
-	# For tabs, we'll group by original route combinations
-	for df in all_flight_data:
-		if not df.empty:
-			source_file = df['source_file'].iloc[0]
-			original_filename = df['original_filename'].iloc[0]
-			
-			# Remove the added columns for tab display
-			tab_df = df.drop(['dep_from_airport', 'dep_to_airport', 'source_file', 'original_filename'], axis=1, errors='ignore')
-			filtered_csv_files[source_file] = tab_df
-			original_filenames[source_file] = original_filename
-
-	# Sort tabs by departure date (ascending) - using already found original filenames
-	sorted_tab_names = sorted(filtered_csv_files.keys(), key=lambda name: extract_departure_date(original_filenames.get(name, name)))
-
-	# Create tabs for each file in sorted order
-	tab_names = sorted_tab_names
-	tabs = st.tabs(tab_names)
-
-	for i, filename in enumerate(sorted_tab_names):
-		df = filtered_csv_files[filename]
-		with tabs[i]:
-			st.header(f'📊 {filename}')
-
-			if df.empty:
-				st.warning('This file contains no data.')
-				continue
-
-			# Display basic info
-			col1, col2, col3 = st.columns(3)
-			with col1:
-				st.metric('Total Combinations', len(df))
-
-			if 'total_price' in df.columns:
-				with col2:
-					min_price = df['total_price'].min()
-					st.metric('Cheapest', f'€{min_price:.2f}')
-				with col3:
-					avg_price = df['total_price'].mean()
-					st.metric('Average Price', f'€{avg_price:.2f}')
-
-			# Filtering options
-			st.subheader('🔍 Filters')
-
-			filter_col1, filter_col2, filter_col3 = st.columns(3)
-
-			# Initialize filter ranges
-			price_range = None
-			duration_range = None
-			selected_companies = []
-
-			# Price filter
-			if 'total_price' in df.columns:
-				with filter_col1:
-					min_price = float(df['total_price'].min())
-					max_price = float(df['total_price'].max())
-
-					# Handle case where min equals max
-					if min_price == max_price:
-						st.write(f'Price: €{min_price:.2f}')
-						price_range = (min_price, max_price)
-					else:
-						price_range = st.slider('Price Range (€)', min_value=min_price, max_value=max_price, value=(min_price, max_price), key=f'price_{i}')
-
-			# Duration filter
-			if 'trip_duration_days' in df.columns:
-				with filter_col2:
-					min_duration = int(df['trip_duration_days'].min())
-					max_duration = int(df['trip_duration_days'].max())
-
-					# Handle case where min equals max
-					if min_duration == max_duration:
-						st.write(f'Trip Duration: {min_duration} days')
-						duration_range = (min_duration, max_duration)
-					else:
-						duration_range = st.slider('Trip Duration (days)', min_value=min_duration, max_value=max_duration, value=(min_duration, max_duration), key=f'duration_{i}')
-
-			# Company filter
-			if 'dep_companies' in df.columns:
-				with filter_col3:
-					all_companies = set()
-					for companies in df['dep_companies'].dropna():
-						all_companies.update([c.strip() for c in str(companies).split(',')])
-
-					selected_companies = st.multiselect('Airlines', options=sorted(all_companies), key=f'companies_{i}')
-
-			# Apply filters
-			filtered_df = df.copy()
-
-			if 'total_price' in df.columns and price_range is not None:
-				filtered_df = filtered_df[(filtered_df['total_price'] >= price_range[0]) & (filtered_df['total_price'] <= price_range[1])]
-
-			if 'trip_duration_days' in df.columns and duration_range is not None:
-				filtered_df = filtered_df[(filtered_df['trip_duration_days'] >= duration_range[0]) & (filtered_df['trip_duration_days'] <= duration_range[1])]
-
-			if 'dep_companies' in df.columns and selected_companies:
-				mask = filtered_df['dep_companies'].apply(lambda x: any(company in str(x) for company in selected_companies) if pd.notna(x) else False)
-				filtered_df = filtered_df[mask]
-
-			# Display filtered count
-			if len(filtered_df) != len(df):
-				st.info(f'Showing {len(filtered_df)} of {len(df)} combinations after filtering')
-
-			# Sort options
-			st.subheader('📈 Sorting')
-			sort_col1, sort_col2 = st.columns(2)
-
-			with sort_col1:
-				sort_column = st.selectbox(
-					'Sort by', options=filtered_df.columns.tolist(), index=0 if 'total_price' not in filtered_df.columns else filtered_df.columns.tolist().index('total_price'), key=f'sort_col_{i}'
-				)
+	with sort_col1:
+		sort_column = st.selectbox(
+			'Sort by', options=filtered_df.columns.tolist(), index=0 if 'total_price' not in filtered_df.columns else filtered_df.columns.tolist().index('total_price'), key=f'sort_col_{key_prefix}'
+		)
 
-			with sort_col2:
-				sort_order = st.selectbox('Order', options=['Ascending', 'Descending'], key=f'sort_order_{i}')
+	with sort_col2:
+		sort_order = st.selectbox('Order', options=['Ascending', 'Descending'], key=f'sort_order_{key_prefix}')
 
-			# Apply sorting
-			ascending = sort_order == 'Ascending'
-			display_df = filtered_df.sort_values(by=sort_column, ascending=ascending)
+	# Apply sorting
+	ascending = sort_order == 'Ascending'
+	display_df = filtered_df.sort_values(by=sort_column, ascending=ascending)
 
-			# Display flight combinations as cards
-			st.subheader('✈️ Flight Combinations')
+	# Display flight combinations as cards
+	st.subheader('✈️ Flight Combinations')
 
-			if len(display_df) == 0:
-				st.info('No flights match your filters.')
-			else:
-				# Add pagination for better performance
-				items_per_page = 5
-				total_items = len(display_df)
-				total_pages = (total_items - 1) // items_per_page + 1
-
-				if total_pages > 1:
-					page = st.selectbox(f'Page (showing {items_per_page} flights per page)', range(1, total_pages + 1), key=f'page_{i}')
-					start_idx = (page - 1) * items_per_page
-					end_idx = min(start_idx + items_per_page, total_items)
-					page_df = display_df.iloc[start_idx:end_idx]
-					st.info(f'Showing flights {start_idx + 1}-{end_idx} of {total_items}')
-				else:
-					page_df = display_df
-					st.info(f'Showing all {total_items} flights')
-
-				for _idx, row in page_df.iterrows():
-					# Format durations properly
-					dep_duration = format_duration(row.get('dep_total_hours', 0))
-					arr_duration = format_duration(row.get('arr_total_hours', 0))
-
-					# Format flight details
-					dep_date = pd.to_datetime(row.get('dep_departure_date', '')).strftime('%b %d') if pd.notna(row.get('dep_departure_date')) else 'N/A'
-					dep_time = f'{row.get("dep_departure_time", "N/A")} - {row.get("dep_arrival_time", "N/A")}'
-					dep_airline = row.get('dep_companies', 'N/A')
-					if len(str(dep_airline)) > 20:
-						dep_airline = str(dep_airline)[:20] + '...'
-					dep_price = row.get('dep_price', 0)
-
-					arr_date = pd.to_datetime(row.get('arr_departure_date', '')).strftime('%b %d') if pd.notna(row.get('arr_departure_date')) else 'N/A'
-					arr_time = f'{row.get("arr_departure_time", "N/A")} - {row.get("arr_arrival_time", "N/A")}'
-					arr_airline = row.get('arr_companies', 'N/A')
-					if len(str(arr_airline)) > 20:
-						arr_airline = str(arr_airline)[:20] + '...'
-					arr_price = row.get('arr_price', 0)
-
-					# Create a simple, clean flight card
-
-					# Start card container
-					st.markdown(
-						"""
+	if len(display_df) == 0:
+		st.info('No flights match your filters.')
+	else:
+		# Add pagination for better performance
+		items_per_page = 5
+		total_items = len(display_df)
+		total_pages = (total_items - 1) // items_per_page + 1
+
+		if total_pages > 1:
+			page = st.selectbox(f'Page (showing {items_per_page} flights per page)', range(1, total_pages + 1), key=f'page_{key_prefix}')
+			start_idx = (page - 1) * items_per_page
+			end_idx = min(start_idx + items_per_page, total_items)
+			page_df = display_df.iloc[start_idx:end_idx]
+			st.info(f'Showing flights {start_idx + 1}-{end_idx} of {total_items}')
+		else:
+			page_df = display_df
+			st.info(f'Showing all {total_items} flights')
+
+		for _idx, row in page_df.iterrows():
+			# Format durations properly
+			dep_duration = format_duration(row.get('dep_total_hours', 0))
+			arr_duration = format_duration(row.get('arr_total_hours', 0))
+
+			# Format flight details
+			dep_date = pd.to_datetime(row.get('dep_departure_date', '')).strftime('%b %d') if pd.notna(row.get('dep_departure_date')) else 'N/A'
+			dep_time = f'{row.get("dep_departure_time", "N/A")} - {row.get("dep_arrival_time", "N/A")}'
+			dep_airline = row.get('dep_companies', 'N/A')
+			if len(str(dep_airline)) > 20:
+				dep_airline = str(dep_airline)[:20] + '...'
+			dep_price = row.get('dep_price', 0)
+
+			arr_date = pd.to_datetime(row.get('arr_departure_date', '')).strftime('%b %d') if pd.notna(row.get('arr_departure_date')) else 'N/A'
+			arr_time = f'{row.get("arr_departure_time", "N/A")} - {row.get("arr_arrival_time", "N/A")}'
+			arr_airline = row.get('arr_companies', 'N/A')
+			if len(str(arr_airline)) > 20:
+				arr_airline = str(arr_airline)[:20] + '...'
+			arr_price = row.get('arr_price', 0)
+
+			# Create a simple, clean flight card
+
+			# Start card container
+			st.markdown(
+				"""
                     <div style="
                         border: 2px solid #ddd;
                         border-radius: 10px;
@@ -507,30 +619,30 @@ def main():
                         padding: 20px;
                     ">
                     """,
-						unsafe_allow_html=True,
-					)
+				unsafe_allow_html=True,
+			)
 
-					# Header section with route and price - simple layout
-					col_route, col_days, col_price = st.columns([2, 1, 1])
+			# Header section with route and price - simple layout
+			col_route, col_days, col_price = st.columns([2, 1, 1])
 
-					with col_route:
-						st.markdown(f'**✈️ {row.get("dep_departure_airport", "N/A")} → {row.get("dep_arrival_airport", "N/A")}**')
+			with col_route:
+				st.markdown(f'**✈️ {row.get("dep_departure_airport", "N/A")} → {row.get("dep_arrival_airport", "N/A")}**')
 
-					with col_days:
-						st.markdown(f'📅 **{row.get("trip_duration_days", "N/A")} days**')
+			with col_days:
+				st.markdown(f'📅 **{row.get("trip_duration_days", "N/A")} days**')
 
-					with col_price:
-						st.markdown(f"<div style='text-align: right; font-size: 24px; font-weight: bold; color: #2e7d32;'>€{row.get('total_price', 0):.0f}</div>", unsafe_allow_html=True)
+			with col_price:
+				st.markdown(f"<div style='text-align: right; font-size: 24px; font-weight: bold; color: #2e7d32;'>€{row.get('total_price', 0):.0f}</div>", unsafe_allow_html=True)
 
-					st.markdown('---')
+			st.markdown('---')
 
-					# Flight details using streamlit columns
-					col1, col2 = st.columns(2)
+			# Flight details using streamlit columns
+			col1, col2 = st.columns(2)
 
-					# Outbound flight
-					with col1:
-						st.markdown(
-							f"""
+			# Outbound flight
+			with col1:
+				st.markdown(
+					f"""
                         <div style="
                             background: #f5f5f5;
                             border: 1px solid #e0e0e0;
@@ -576,13 +688,13 @@ def main():
                             </div>
                         </div>
                         """,
-							unsafe_allow_html=True,
-						)
+					unsafe_allow_html=True,
+				)
 
-					# Return flight
-					with col2:
-						st.markdown(
-							f"""
+			# Return flight
+			with col2:
+				st.markdown(
+					f"""
                         <div style="
                             background: #f5f5f5;
                             border: 1px solid #e0e0e0;
@@ -628,16 +740,140 @@ def main():
                             </div>
                         </div>
                         """,
-							unsafe_allow_html=True,
-						)
+					unsafe_allow_html=True,
+				)
+
+			# Close card container
+			st.markdown('</div>', unsafe_allow_html=True)
+
+	# Download option, serialized only when asked for
+	safe_filename = filename.replace(' ', '_').replace('→', 'to').replace('(', '').replace(')', '').replace(' - ', '_')
+	if st.button('📄 Prepare filtered data for download', key=f'prepare_download_{key_prefix}'):
+		st.download_button(label='📥 Download filtered data', data=filtered_df.to_csv(index=False), file_name=f'filtered_{safe_filename}.csv', mime='text/csv', key=f'download_{key_prefix}')
+
 
-					# Close card container
-					st.markdown('</div>', unsafe_allow_html=True)
+def main():
+	st.set_page_config(page_title='Flight Data Viewer', page_icon='✈️', layout='wide')
+
+	st.title('✈️ Flight Data Viewer')
+	st.markdown('View and analyze flight search results with beautiful cards')
+
+	st.sidebar.header('📂 Data source')
+	data_source = st.sidebar.radio('Read flights from', options=['CSV files', 'SQLite database'], index=0)
+	database_url = None
+	if data_source == 'SQLite database':
+		database_url = st.sidebar.text_input('Database URL', value='sqlite:///flights.db')
+		if not os.path.exists(database_url.replace('sqlite:///', '')):
+			st.error(f"Database '{database_url}' not found!")
+			st.stop()
+
+	live_refresh = st.sidebar.toggle('🔴 Live refresh', value=False, help='Poll for newly written results while a scrape is running')
+	if live_refresh:
+		interval = st.sidebar.select_slider('Poll every (seconds)', options=[2, 5, 10, 30, 60], value=5)
+		if database_url:
+			st.fragment(poll_for_changes, run_every=interval)(database_version, database_url)
+		else:
+			st.fragment(poll_for_changes, run_every=interval)(outputs_marker, 'outputs')
+
+	# Add flight selection interface
+	st.markdown("---")
+	st.subheader("🎯 Select Your Flight Route")
+	
+	col1, col2, col3 = st.columns([1, 1, 2])
+	
+	with col1:
+		departure_airport = st.selectbox(
+			"✈️ Departure Airport",
+			options=["ALL", "OPO", "LIS", "MAD"],
+			index=0,
+			help="Select your departure airport or ALL for mixed combinations"
+		)
+	
+	with col2:
+		arrival_airport = st.selectbox(
+			"🛬 Tokyo Airport",
+			options=["ALL", "HND", "NRT"],
+			index=0,
+			help="Select your arrival airport in Tokyo or ALL for mixed combinations"
+		)
+	
+	with col3:
+		if departure_airport == "ALL" and arrival_airport == "ALL":
+			st.markdown("**Selected Route:** All Combinations")
+			st.markdown("**Including mixed routes:** OPO→NRT+HND→LIS, etc.")
+		elif departure_airport == "ALL":
+			st.markdown(f"**Selected Route:** Any → {arrival_airport}")
+			st.markdown(f"**From any city to:** {arrival_airport} ({'Haneda' if arrival_airport == 'HND' else 'Narita'})")
+		elif arrival_airport == "ALL":
+			st.markdown(f"**Selected Route:** {departure_airport} → Any")
+			st.markdown(f"**From:** {departure_airport} ({'Porto' if departure_airport == 'OPO' else 'Lisbon' if departure_airport == 'LIS' else 'Madrid'}) to any Tokyo airport")
+		else:
+			st.markdown(f"**Selected Route:** {departure_airport} → {arrival_airport}")
+			st.markdown(f"**Route Description:** {departure_airport} ({'Porto' if departure_airport == 'OPO' else 'Lisbon' if departure_airport == 'LIS' else 'Madrid'}) to {arrival_airport} ({'Haneda' if arrival_airport == 'HND' else 'Narita'})")
+
+	if database_url:
+		# Airports, stay lengths, price, duration and airlines are all SQL predicates here
+		query = database_filters(database_url, departure_airport, arrival_airport)
+		combined_df, airline_index = query_flight_frame(database_url, database_version(database_url), query)
+		if combined_df.empty:
+			st.warning("No flights found for the selected criteria")
+			st.stop()
+	else:
+		# Load CSV files (shared frame, only new or changed files are read and appended)
+		outputs_dir = 'outputs'
+		if not os.path.exists(outputs_dir):
+			st.error(f"Directory '{outputs_dir}' not found!")
+			st.stop()
+
+		with st.spinner('Loading flight data...'):
+			flight_frame, airline_index, load_errors, signature = get_live_flight_frame(outputs_dir).refresh()
+		if not signature:
+			st.warning(f"No CSV files found in '{outputs_dir}' directory!")
+			st.stop()
+
+		for error in load_errors:
+			st.error(error)
+
+		if flight_frame.empty:
+			st.stop()
+
+		# Select the matching routes from the shared frame
+		route_mask = pd.Series(True, index=flight_frame.index)
+		if departure_airport != "ALL":
+			route_mask &= flight_frame['dep_from_airport'] == departure_airport
+		if arrival_airport != "ALL":
+			route_mask &= flight_frame['dep_to_airport'] == arrival_airport
+
+		combined_df = flight_frame[route_mask]
+
+	available_routes = {f"{dep_from} → {dep_to}" for dep_from, dep_to in combined_df[['dep_from_airport', 'dep_to_airport']].drop_duplicates().itertuples(index=False)}
+	
+	if combined_df.empty:
+		st.warning(f"No flights found for the selected criteria")
+		st.stop()
+
+	st.markdown("---")
+	st.info(f"Found data for routes: {', '.join(sorted(available_routes))}")
+
+	# Best deals come from the aggregates written alongside the CSVs; database results are reduced in memory
+	if database_url:
+		best_deals = compute_best_deals(combined_df)
+	else:
+		best_deals = load_best_deals(signature, combined_df, departure_airport, arrival_airport)
+	render_best_deals(best_deals)
+
+	# Detail view: only the selected date pair is filtered, sorted and rendered
+	date_pairs = combined_df[['source_file', 'original_filename']].drop_duplicates()
+	original_filenames = dict(zip(date_pairs['source_file'], date_pairs['original_filename']))
+	sorted_pair_names = sorted(original_filenames, key=lambda name: extract_departure_date(original_filenames[name]))
+
+	st.markdown("---")
+	st.subheader("📊 Date Pair Details")
+	filename = st.selectbox(f'Date pair ({len(sorted_pair_names)} available)', options=sorted_pair_names, key='detail_pair')
+	original_filename = original_filenames[filename]
+	df = combined_df[combined_df['original_filename'] == original_filename].drop(['dep_from_airport', 'dep_to_airport', 'source_file', 'original_filename'], axis=1, errors='ignore')
 
-			# Download option
-			csv_data = filtered_df.to_csv(index=False)
-			safe_filename = filename.replace(' ', '_').replace('→', 'to').replace('(', '').replace(')', '').replace(' - ', '_')
-			st.download_button(label='📥 Download filtered data', data=csv_data, file_name=f'filtered_{safe_filename}.csv', mime='text/csv', key=f'download_{i}')
+	render_pair_detail(filename, df, airline_index, key_prefix=original_filename)
 
 
 if __name__ == '__main__':
@@ -1,44 +1,444 @@
-from datetime import datetime, timedelta
+"""Flight searcher entry point.
 
-from src.scraper.play import Scraper
-from src.services.trip_agency_service import TripAgencyService
+	python main.py scrape [--record DIR] [--database URL] [--alert-to SINK ...]
+	python main.py replay DIR [--database URL]
+	python main.py combine --database URL [--search-date YYYY-MM-DD]
+	python main.py export --database URL [--search-date YYYY-MM-DD] [--output FILE]
+	python main.py compact --database URL
+	python main.py enqueue --database URL [--plan NAME]
+	python main.py worker --database URL [--plan NAME] [--replay DIR]
+	python main.py refresh --database URL [--queries-per-hour N] [--once]
 
+Subsystems are imported inside the command that needs them, so maintenance commands never load Playwright.
+"""
 
-def run():
-	# database = DatabaseService(database_url='sqlite:///flights.db', echo=False)
-	scraper = Scraper()
+import argparse
+import contextlib
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta
 
+DEFAULT_DATABASE_URL = 'sqlite:///flights.db'
+
+logger = logging.getLogger(__name__)
+
+
+def trip_plan() -> dict:
+	"""The searched trip: where from, where to, how long and when"""
+	departure_airports = ['OPO', 'LIS', 'MAD']
+	arrival_airports = ['NRT', 'HND']
+	stay_time = [9, 10, 11]
+
+	possible_departure_dates = [datetime(year=2026, month=8, day=1) + timedelta(days=x) for x in range(24)]
+	last_possible_day = datetime(year=2026, month=8, day=31)
+
+	return {
+		'possible_trip_starting_points': departure_airports,
+		'possible_trip_destinations': arrival_airports,
+		'wanted_stay_time': stay_time,
+		'possible_start_trip_dates': possible_departure_dates,
+		'last_vacation_day': last_possible_day,
+	}
+
+
+def open_database(database_url: str | None):
+	if not database_url:
+		return None
+
+	from src.services.database_service import DatabaseService
+
+	return DatabaseService(database_url=database_url, echo=False)
+
+
+def freshness_policy(args: argparse.Namespace):
+	if not getattr(args, 'reuse_fresh', False):
+		return None
+
+	from src.services.freshness import FreshnessPolicy
+
+	return FreshnessPolicy()
+
+
+def price_alerts(args: argparse.Namespace):
+	"""Drop detector over the trip plan's round trips, when any sink was asked for"""
+	if not getattr(args, 'alert_to', None):
+		return None
+
+	from src.services.price_alerts import AlertPolicy, PriceDropDetector, sink_from_spec
+
+	plan = trip_plan()
+	return PriceDropDetector(
+		origins=plan['possible_trip_starting_points'],
+		stays=plan['wanted_stay_time'],
+		policy=AlertPolicy(min_drop_fraction=args.alert_drop, min_drop_amount=args.alert_drop_amount, target_price=args.alert_below),
+		sinks=[sink_from_spec(spec) for spec in args.alert_to],
+	)
+
+
+def run(scraper, database_url: str | None = None, search_date: date | None = None, freshness=None, alerts=None, constraints=None) -> None:
+	from src.services.trip_agency_service import TripAgencyService
+
+	database = open_database(database_url)
 	try:
-		# if not database.health_check():
-		# raise RuntimeError('Database not ready')
+		trip_agent = TripAgencyService(scraper=scraper, database_service=database, search_date=search_date, freshness=freshness, price_alerts=alerts, constraints=constraints)
+		trip_agent.find_daily_flight_combinations(**trip_plan())
+	finally:
+		if database:
+			database.close()
+
+
+def selection_policy(args: argparse.Namespace):
+	from src.scraper.selection import SelectionPolicy
+
+	return SelectionPolicy(price_epsilon=args.price_epsilon, duration_epsilon_minutes=args.duration_epsilon, max_legs=args.max_legs)
+
+
+def search_constraints(args: argparse.Namespace):
+	from src.scraper.constraints import SearchConstraints
 
-		departure_airports = ['OPO', 'LIS', 'MAD']
-		arrival_airports = ['NRT', 'HND']
-		stay_time = [9, 10, 11]
+	return SearchConstraints(
+		max_stops=args.max_stops,
+		airlines=tuple(args.airlines),
+		airline_codes=tuple(args.airline_codes),
+		departure_window=args.departure_window,
+		arrival_window=args.arrival_window,
+		max_duration_minutes=round(args.max_hours * 60) if args.max_hours is not None else None,
+		exclude_self_transfer=not args.self_transfer,
+	)
 
-		possible_departure_dates = [datetime(year=2026, month=8, day=1) + timedelta(days=x) for x in range(24)]
-		last_possible_day = datetime(year=2026, month=8, day=31)
 
-		trip_agent = TripAgencyService(scraper=scraper)
+def scraper_options(args: argparse.Namespace, browser: bool = True) -> dict:
+	from src.scraper.readiness import ReadinessConfig
+	from src.scraper.session import SessionConfig
 
-		trip_agent.find_daily_flight_combinations(
-			possible_trip_starting_points=departure_airports,
-			possible_trip_destinations=arrival_airports,
-			wanted_stay_time=stay_time,
-			possible_start_trip_dates=possible_departure_dates,
-			last_vacation_day=last_possible_day,
+	options = {
+		'selection': selection_policy(args),
+		'constraints': search_constraints(args),
+		'readiness': ReadinessConfig(settle_ms=args.settle_ms, interaction_budget_ms=args.interaction_budget_ms, timeout_ms=args.page_timeout_ms),
+	}
+	if browser and not args.fresh_browser:
+		options['session'] = SessionConfig(
+			directory=args.browser_state,
+			rotate_after_queries=args.rotate_after_queries or None,
+			rotate_after_seconds=args.rotate_after_hours * 3600 if args.rotate_after_hours else None,
 		)
+	return options
 
-	except Exception as e:
-		print(f'Unexpected error: {e}')
+
+def with_providers(scraper, args: argparse.Namespace):
+	"""The scraper alone, or fanned out together with the fixture-backed providers asked for"""
+	rates = dict(args.provider_rate)
+	names = [scraper.name, *(os.path.basename(os.path.normpath(directory)) for directory in args.fixture_provider)]
+	unknown = sorted(rates.keys() - set(names))
+	if unknown:
+		raise ValueError(f'--provider-rate names no provider of this run: {", ".join(unknown)} (providers: {", ".join(names)})')
+
+	scraper.queries_per_hour = rates.get(scraper.name, scraper.queries_per_hour)
+	if not args.fixture_provider:
+		return scraper
+
+	from src.scraper.fanout import FanOutScraper
+	from src.scraper.fixtures import FixtureProvider
+
+	providers = [scraper]
+	for directory, name in zip(args.fixture_provider, names[1:], strict=True):
+		providers.append(FixtureProvider(directory, name=name, selection=scraper.selection, constraints=scraper.constraints, queries_per_hour=rates.get(name)))
+	return FanOutScraper(providers, selection=scraper.selection)
+
+
+def scrape(args: argparse.Namespace) -> None:
+	from src.scraper.play import Scraper
+	from src.scraper.replay import RecordingScraper
+
+	options = scraper_options(args)
+	scraper = RecordingScraper(args.record, **options) if args.record else Scraper(**options)
+	with contextlib.closing(with_providers(scraper, args)) as source:
+		run(source, args.database, freshness=freshness_policy(args), alerts=price_alerts(args), constraints=options['constraints'])
+
+
+def replay(args: argparse.Namespace) -> None:
+	from src.scraper.replay import ReplayScraper
+
+	options = scraper_options(args, browser=False)
+	with contextlib.closing(with_providers(ReplayScraper(args.replay_dir, **options), args)) as source:
+		run(source, args.database, alerts=price_alerts(args), constraints=options['constraints'])
+
+
+def latest_search_date(database, requested: date | None) -> date:
+	search_date = requested or database.get_latest_search_date()
+	if search_date is None:
+		raise RuntimeError('The database holds no flights')
+	return search_date
+
+
+def combine(args: argparse.Namespace) -> None:
+	"""Rebuild the combination outputs from stored legs, without a browser"""
+	database = open_database(args.database)
+	try:
+		search_date = latest_search_date(database, args.search_date)
+	finally:
+		database.close()
+	logger.info('Combining legs seen on %s', search_date)
+	run(None, args.database, search_date, freshness_policy(args))
+
+
+def export(args: argparse.Namespace) -> None:
+	"""Write the legs seen on a search date as a flat CSV"""
+	import csv
+
+	from src.models.records import LEG_CSV_COLUMNS
+
+	database = open_database(args.database)
+	try:
+		search_date = latest_search_date(database, args.search_date)
+		flights = database.get_search_by_date(search_date)
+	finally:
+		database.close()
+
+	output = args.output or f'flights_{search_date:%Y-%m-%d}.csv'
+	with open(output, 'w', newline='') as off:
+		writer = csv.writer(off)
+		writer.writerow(LEG_CSV_COLUMNS)
+		writer.writerows(flight.csv_cells() for flight in flights)
+	logger.info('Exported %d legs seen on %s to %s', len(flights), search_date, output)
+
+
+def compact(args: argparse.Namespace) -> None:
+	from src.services.database_service import RetentionPolicy
+
+	database = open_database(args.database)
+	try:
+		result = database.compact_history(RetentionPolicy(past_travel_days=args.past_travel_days), vacuum=not args.no_vacuum)
+	finally:
+		database.close()
+	logger.info('Merged %d unchanged offers, expired %d legs and %d rollups', result.merged_rows, result.expired_rows, result.expired_rollups)
+
+
+def enqueue(args: argparse.Namespace) -> None:
+	"""Queue every search of the trip plan, for workers to share"""
+	from src.services.trip_agency_service import plan_searches
+
+	searches = [(dep, arr, day.date()) for dep, arr, day in plan_searches(**trip_plan())]
+	database = open_database(args.database)
+	try:
+		added = database.enqueue_scrape_tasks(args.plan, searches)
+		counts = database.get_scrape_task_counts(args.plan)
+	finally:
+		database.close()
+	logger.info('Queued %d new searches for plan %s (%s)', added, args.plan, ', '.join(f'{status} {task_count}' for status, task_count in counts.items()))
+
+
+def worker(args: argparse.Namespace) -> None:
+	"""Drain a queued plan together with any other workers on the same database, then combine with `main.py combine`"""
+	from src.scraper.play import Scraper
+	from src.scraper.replay import ReplayScraper
+	from src.services.scrape_worker import ScrapeWorker
+	from src.services.trip_agency_service import TripAgencyService
+
+	options = scraper_options(args, browser=not args.replay)
+	scraper = with_providers(ReplayScraper(args.replay, **options) if args.replay else Scraper(**options), args)
+
+	database = open_database(args.database)
+	try:
+		trip_agent = TripAgencyService(scraper=scraper, database_service=database, price_alerts=price_alerts(args), constraints=options['constraints'])
+		ScrapeWorker(
+			trip_agent,
+			database,
+			plan=args.plan,
+			worker_id=args.worker_id,
+			lease=timedelta(seconds=args.lease_seconds),
+			max_attempts=args.max_attempts,
+			poll_interval=args.poll_seconds,
+		).run(max_tasks=args.max_tasks)
 	finally:
-		# database.close()
-		pass
+		database.close()
+		scraper.close()
+
+
+def refresh(args: argparse.Namespace) -> None:
+	"""Keep the trip plan's searches fresh, spending the hourly query budget where prices move"""
+	from src.scraper.play import Scraper
+	from src.scraper.replay import ReplayScraper
+	from src.services.freshness import FreshnessPolicy
+	from src.services.refresh_daemon import RefreshDaemon
+	from src.services.trip_agency_service import TripAgencyService, plan_searches
+
+	options = scraper_options(args, browser=not args.replay)
+	scraper = with_providers(ReplayScraper(args.replay, **options) if args.replay else Scraper(**options), args)
+	searches = [(dep, arr, day.date()) for dep, arr, day in plan_searches(**trip_plan())]
+
+	database = open_database(args.database)
+	try:
+		daemon = RefreshDaemon(
+			TripAgencyService(scraper=scraper, database_service=database, price_alerts=price_alerts(args), constraints=options['constraints']),
+			database,
+			searches,
+			policy=FreshnessPolicy(reference_volatility=args.reference_volatility),
+			queries_per_hour=args.queries_per_hour,
+			replan_interval=timedelta(minutes=args.replan_minutes),
+		)
+		spent = daemon.run(max_queries=args.max_queries, once=args.once)
+	finally:
+		database.close()
+		scraper.close()
+	logger.info('Refresh spent %d queries', spent)
+
+
+def build_parser() -> argparse.ArgumentParser:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+	profiling = argparse.ArgumentParser(add_help=False)
+	group = profiling.add_argument_group('profiling')
+	group.add_argument('--profile', action='store_true', help='Run under cProfile and write profile.pstats/profile.txt to the run directory')
+	group.add_argument('--trace-memory', action='store_true', help='Trace allocations with tracemalloc and write the top allocators to memory.txt')
+	group.add_argument('--profile-stages', nargs='+', default=[], metavar='SPAN', help='Only profile inside these spans, e.g. parse combine persist')
+	group.add_argument('--run-dir', help='Where profiles are written, defaults to runs/<timestamp>')
+
+	search = argparse.ArgumentParser(add_help=False)
+	group = search.add_argument_group('leg selection', 'Each search keeps the legs no other leg beats on price, duration and stops together')
+	group.add_argument('--price-epsilon', type=float, default=0.0, metavar='FRACTION', help='Treat prices this close (0.05 = 5%%) as equal')
+	group.add_argument('--duration-epsilon', type=int, default=0, metavar='MINUTES', help='Treat durations this close as equal')
+	group.add_argument('--max-legs', type=int, help='Keep at most this many legs per search, spread over the price range')
+
+	def time_window(value: str):
+		from src.scraper.constraints import parse_time_window
 
+		try:
+			return parse_time_window(value)
+		except ValueError as e:
+			raise argparse.ArgumentTypeError(str(e)) from e
 
-def main() -> None:
-	run()
+	group = search.add_argument_group('search constraints', 'Sent to momondo as result filters and checked again on every parsed card; stored legs are only reused under the same constraints')
+	group.add_argument('--max-stops', type=int, help='Only legs with at most this many connections')
+	group.add_argument('--airlines', nargs='+', default=[], metavar='NAME', help='Only legs operated by one of these airlines, as named on the results page')
+	group.add_argument('--airline-codes', nargs='+', default=[], metavar='IATA', help="The same airlines as IATA codes, for momondo's own filter")
+	group.add_argument('--departure-window', type=time_window, metavar='HH:MM-HH:MM', help='Only legs taking off in this window')
+	group.add_argument('--arrival-window', type=time_window, metavar='HH:MM-HH:MM', help='Only legs landing in this window')
+	group.add_argument('--max-hours', type=float, help='Only legs taking at most this long')
+	group.add_argument('--self-transfer', action='store_true', help='Keep self-transfer legs, which the viewer and best deals leave out')
+
+	group = search.add_argument_group('page readiness', 'A result page is read once momondo hides its progressbar or the result cards stop changing')
+	group.add_argument('--settle-ms', type=int, default=1500, help='How long the card count must hold still')
+	group.add_argument('--interaction-budget-ms', type=int, default=3000, help='Mouse and scroll time allowed per page while it loads, 0 turns it off')
+	group.add_argument('--page-timeout-ms', type=int, default=60000)
+
+	group = search.add_argument_group('browser session', 'Consent cookies and the disk cache are kept between queries until the identity rotates')
+	group.add_argument('--browser-state', metavar='DIR', default='browser_state', help='Shared by every worker pointed at the same directory')
+	group.add_argument('--fresh-browser', action='store_true', help='Start every query from an empty browser, as before')
+	group.add_argument('--rotate-after-queries', type=int, default=50, metavar='N', help='New user agent, cookies and cache after N queries, 0 never')
+	group.add_argument('--rotate-after-hours', type=float, default=6, metavar='HOURS', help='... or after this long, 0 never')
+
+	alerts = argparse.ArgumentParser(add_help=False)
+	group = alerts.add_argument_group('price alerts', 'Scraped legs update the stored round-trip totals; drops are sent to the sinks (needs --database)')
+	group.add_argument('--alert-to', nargs='+', default=[], metavar='SINK', help='stdout, a file to append JSON lines to, or an http(s) webhook URL')
+	group.add_argument('--alert-drop', type=float, default=0.05, metavar='FRACTION', help='Smallest drop of a total worth an alert (0.05 = 5%%)')
+	group.add_argument('--alert-drop-amount', type=float, default=0.0, metavar='AMOUNT', help='... and in money')
+	group.add_argument('--alert-below', type=float, metavar='PRICE', help='Also alert when a total first reaches this price')
+
+	def provider_rate(value: str) -> tuple[str, float]:
+		name, _, rate = value.partition('=')
+		try:
+			return name, float(rate)
+		except ValueError as e:
+			raise argparse.ArgumentTypeError(f'Expected NAME=QUERIES_PER_HOUR, got {value}') from e
+
+	group = search.add_argument_group('providers', 'Sites queried side by side for every search, their legs merged and deduplicated')
+	group.add_argument('--fixture-provider', action='append', default=[], metavar='DIR', help='Also query a fake site serving JSON fixtures from DIR, named after it')
+	group.add_argument('--provider-rate', action='append', type=provider_rate, default=[], metavar='NAME=PER_HOUR', help='Query limit of one provider, e.g. momondo=120')
+
+	def search_date(value: str) -> date:
+		return datetime.strptime(value, '%Y-%m-%d').date()
+
+	command = commands.add_parser('scrape', parents=[profiling, search, alerts], help='Search momondo with a browser and write the combinations to outputs/')
+	command.add_argument('--record', metavar='DIR', help='Also save every fetched result page to DIR for later replays')
+	command.add_argument('--database', metavar='URL', help='Reuse and store legs in this database')
+	command.add_argument('--reuse-fresh', action='store_true', help='Also reuse legs of earlier days while they are fresh under the refresh policy')
+	command.set_defaults(handler=scrape)
+
+	command = commands.add_parser('replay', parents=[profiling, search, alerts], help='Parse recorded result pages instead of driving a browser')
+	command.add_argument('replay_dir', metavar='DIR')
+	command.add_argument('--database', metavar='URL', help='Reuse and store legs in this database')
+	command.set_defaults(handler=replay)
+
+	command = commands.add_parser('combine', parents=[profiling], help='Rebuild the combination outputs from stored legs')
+	command.add_argument('--database', metavar='URL', default=DEFAULT_DATABASE_URL)
+	command.add_argument('--search-date', type=search_date, help='Use legs seen on this day, defaults to the latest one')
+	command.add_argument('--reuse-fresh', action='store_true', help='Fill searches missing on that day with their latest still-fresh legs')
+	command.set_defaults(handler=combine)
+
+	command = commands.add_parser('export', help='Export the legs of a search date to CSV')
+	command.add_argument('--database', metavar='URL', default=DEFAULT_DATABASE_URL)
+	command.add_argument('--search-date', type=search_date, help='Defaults to the latest search date')
+	command.add_argument('--output', metavar='FILE', help='Defaults to flights_<search date>.csv')
+	command.set_defaults(handler=export)
+
+	command = commands.add_parser('compact', help='Merge unchanged offers, expire past travel dates and vacuum the database')
+	command.add_argument('--database', metavar='URL', default=DEFAULT_DATABASE_URL)
+	command.add_argument('--past-travel-days', type=int, default=30, help='Keep legs that departed at most this many days ago')
+	command.add_argument('--no-vacuum', action='store_true')
+	command.set_defaults(handler=compact)
+
+	default_plan = date.today().isoformat()
+
+	command = commands.add_parser('enqueue', help='Queue the searches of the trip plan in the database for workers')
+	command.add_argument('--database', metavar='URL', default=DEFAULT_DATABASE_URL)
+	command.add_argument('--plan', default=default_plan, help='Queue name, defaults to today so each day is scraped afresh')
+	command.set_defaults(handler=enqueue)
+
+	command = commands.add_parser('worker', parents=[profiling, search, alerts], help='Claim queued searches, scrape and store them until the plan is drained')
+	command.add_argument('--database', metavar='URL', default=DEFAULT_DATABASE_URL)
+	command.add_argument('--plan', default=default_plan)
+	command.add_argument('--replay', metavar='DIR', help='Serve recorded result pages instead of driving a browser')
+	command.add_argument('--worker-id', help='Lease owner name, defaults to <host>:<pid>')
+	command.add_argument('--lease-seconds', type=float, default=300, help='A task is handed to another worker when its heartbeat stops for this long')
+	command.add_argument('--max-attempts', type=int, default=3)
+	command.add_argument('--poll-seconds', type=float, default=5, help='How often an idle worker looks for expired leases')
+	command.add_argument('--max-tasks', type=int, help='Stop after claiming this many tasks')
+	command.set_defaults(handler=worker)
+
+	command = commands.add_parser('refresh', parents=[profiling, search, alerts], help='Keep the planned searches fresh within an hourly query budget')
+	command.add_argument('--database', metavar='URL', default=DEFAULT_DATABASE_URL)
+	command.add_argument('--replay', metavar='DIR', help='Serve recorded result pages instead of driving a browser')
+	command.add_argument('--queries-per-hour', type=float, default=60)
+	command.add_argument('--reference-volatility', type=float, default=0.05, help='Price movement between scrapes that keeps the base lifetime')
+	command.add_argument('--replan-minutes', type=float, default=15, help='How often stale searches are re-ranked')
+	command.add_argument('--max-queries', type=int, help='Stop after this many refreshes')
+	command.add_argument('--once', action='store_true', help='Refresh what is stale now, then exit (for cron)')
+	command.set_defaults(handler=refresh)
+
+	return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+	argv = sys.argv[1:] if argv is None else argv
+	# A bare `python main.py` keeps running the scrape
+	args = build_parser().parse_args(argv or ['scrape'])
+
+	from src.utils.logger import setup_logging
+
+	# FLIGHTS_LOG_FORMAT=json emits every span and the run summary as JSON lines, FLIGHTS_LOG_FILE also appends them to a file
+	setup_logging(
+		level=getattr(logging, os.environ.get('FLIGHTS_LOG_LEVEL', 'INFO').upper(), logging.INFO),
+		json_lines=os.environ.get('FLIGHTS_LOG_FORMAT') == 'json',
+		log_file=os.environ.get('FLIGHTS_LOG_FILE'),
+	)
+
+	profiler: contextlib.AbstractContextManager = contextlib.nullcontext()
+	if getattr(args, 'profile', False) or getattr(args, 'trace_memory', False):
+		from src.utils.profiling import RunProfiler, new_run_dir
+
+		profiler = RunProfiler(args.run_dir or new_run_dir(), cpu=args.profile, memory=args.trace_memory, stages=tuple(args.profile_stages))
+
+	try:
+		with profiler:
+			args.handler(args)
+	except Exception as e:
+		logger.exception('Unexpected error: %s', e)
+		return 1
+	return 0
 
 
 if __name__ == '__main__':
-	main()
+	sys.exit(main())
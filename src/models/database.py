@@ -1,85 +1,116 @@
-import json
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 
 import sqlalchemy as sa
-from sqlalchemy import DateTime, String, Text, TypeDecorator, UniqueConstraint
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import DateTime, ForeignKey, Index, String, UniqueConstraint
+from sqlalchemy.ext.orderinglist import ordering_list
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+
+from src.models.records import format_connections
 
 
 class Base(DeclarativeBase):
 	pass
 
 
-class JSONList(TypeDecorator):
-	"""Custom SQLAlchemy type for storing Python lists as JSON strings"""
+class Airport(Base):
+	__tablename__ = 'airport'
+
+	id: Mapped[int] = mapped_column(primary_key=True)
+	code: Mapped[str] = mapped_column(String(8), unique=True)
+
+
+class Airline(Base):
+	__tablename__ = 'airline'
 
-	impl = Text
-	cache_ok = True
+	id: Mapped[int] = mapped_column(primary_key=True)
+	name: Mapped[str] = mapped_column(String(100), unique=True)
+
+
+class FlightAirline(Base):
+	"""Ordered many-to-many link between a leg and the airlines operating it"""
 
-	def process_bind_param(self, value, dialect):
-		"""Convert Python list to JSON string when saving to database"""
-		if value is None:
-			return None
-		if isinstance(value, list):
-			return json.dumps(value)
-		return value
+	__tablename__ = 'flight_airline'
 
-	def process_result_value(self, value, dialect):
-		"""Convert JSON string back to Python list when reading from database"""
-		if value is None:
-			return None
-		if isinstance(value, str):
-			try:
-				return json.loads(value)
-			except (json.JSONDecodeError, TypeError):
-				# If it's not valid JSON, return as string (for backwards compatibility)
-				return value
-		return value
+	flight_id: Mapped[int] = mapped_column(ForeignKey('flight.id', ondelete='CASCADE'), primary_key=True)
+	position: Mapped[int] = mapped_column(sa.SmallInteger, primary_key=True)
+	airline_id: Mapped[int] = mapped_column(ForeignKey('airline.id'), index=True)
+
+	airline: Mapped[Airline] = relationship(lazy='joined')
 
 
 class Flight(Base):
 	__tablename__ = 'flight'
 
-	# Add unique constraint for the combination of fields
+	# A leg is identified by its fingerprint, so the unique index is two integers wide
 	__table_args__ = (
-		UniqueConstraint(
-			'search_date',
-			'arrival_airport',
-			'departure_airport',
-			'departure_date',
-			'arrival_date',
-			'departure_time',
-			'arrival_time',
-			'total_hours',
-			'companies',
-			'connections',
-			name='uq_flight_details',
-		),
+		UniqueConstraint('search_date', 'fingerprint', name='uq_flight_fingerprint'),
+		Index('ix_flight_route_departure', 'departure_airport_id', 'arrival_airport_id', 'departure_at'),
 	)
 
 	id: Mapped[int] = mapped_column(primary_key=True)
-	search_date: Mapped[datetime] = mapped_column(DateTime)
-	arrival_airport: Mapped[str] = mapped_column(String(20))
-	departure_airport: Mapped[str] = mapped_column(String(20))
-	departure_date: Mapped[datetime] = mapped_column(DateTime)
-	arrival_date: Mapped[datetime] = mapped_column(DateTime)
-	departure_time: Mapped[datetime] = mapped_column(DateTime)
-	arrival_time: Mapped[datetime] = mapped_column(DateTime)
-	price: Mapped[float] = mapped_column(sa.Float)
-	total_hours: Mapped[float] = mapped_column(sa.Float, nullable=True, default=0.0)
-	companies: Mapped[str] = mapped_column(JSONList, nullable=True)
-	connections: Mapped[str] = mapped_column(String(255), nullable=True)
+	search_date: Mapped[date] = mapped_column(sa.Date)
+	departure_airport_id: Mapped[int] = mapped_column(ForeignKey('airport.id'))
+	arrival_airport_id: Mapped[int] = mapped_column(ForeignKey('airport.id'))
+	departure_at: Mapped[datetime] = mapped_column(DateTime)
+	arrival_at: Mapped[datetime] = mapped_column(DateTime)
+	price: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	duration_minutes: Mapped[int | None] = mapped_column(sa.SmallInteger, nullable=True)
+	stops: Mapped[int] = mapped_column(sa.SmallInteger, default=0)
+	self_transfer: Mapped[bool] = mapped_column(sa.Boolean, default=False)
+	fingerprint: Mapped[int] = mapped_column(sa.BigInteger)
+	# search_date is when the offer was first seen; compaction extends last_seen instead of keeping daily copies
+	last_seen: Mapped[date] = mapped_column(sa.Date, default=lambda context: context.get_current_parameters()['search_date'])
+
+	departure: Mapped[Airport] = relationship(foreign_keys=[departure_airport_id], lazy='joined')
+	arrival: Mapped[Airport] = relationship(foreign_keys=[arrival_airport_id], lazy='joined')
+	airline_links: Mapped[list[FlightAirline]] = relationship(
+		order_by=FlightAirline.position,
+		collection_class=ordering_list('position'),
+		cascade='all, delete-orphan',
+		passive_deletes=True,
+		lazy='selectin',
+	)
+
+	@property
+	def departure_airport(self) -> str:
+		return self.departure.code
+
+	@departure_airport.setter
+	def departure_airport(self, code: str) -> None:
+		self.departure = Airport(code=code)
+
+	@property
+	def arrival_airport(self) -> str:
+		return self.arrival.code
+
+	@arrival_airport.setter
+	def arrival_airport(self, code: str) -> None:
+		self.arrival = Airport(code=code)
+
+	@property
+	def companies(self) -> list[str]:
+		return [link.airline.name for link in self.airline_links]
+
+	@companies.setter
+	def companies(self, names: list[str]) -> None:
+		self.airline_links = [FlightAirline(airline=Airline(name=name)) for name in names]
+
+	@property
+	def connections(self) -> str:
+		return format_connections(self.stops or 0, bool(self.self_transfer))
+
+	@property
+	def total_hours(self) -> float | None:
+		return self.duration_minutes / 60 if self.duration_minutes is not None else None
 
 	def _key(self):
 		return (
 			self.arrival_airport,
 			self.departure_airport,
-			self.departure_date,
-			self.departure_time,
-			self.arrival_date,
-			self.arrival_time,
+			self.departure_at,
+			self.arrival_at,
 			self.price,
-			self.total_hours,
+			self.duration_minutes,
 		)
 
 	def __hash__(self):
@@ -93,13 +124,116 @@ class Flight(Base):
 	@classmethod
 	def by_search_date(cls, search_date):
 		"""Helper method for querying by search date"""
-		from sqlalchemy import func
+		return cls.search_date == search_date
 
-		return func.date(cls.search_date) == search_date
+	@classmethod
+	def seen_on(cls, day):
+		"""Helper method for querying offers that were valid on a day, including compacted intervals"""
+		return sa.and_(cls.search_date <= day, cls.last_seen >= day)
 
 	@classmethod
 	def by_departure_date(cls, departure_date):
-		"""Helper method for querying by departure date"""
-		from sqlalchemy import func
+		"""Helper method for querying by departure date, as a range so the route index applies"""
+		start = datetime.combine(departure_date, time.min)
+		return sa.and_(cls.departure_at >= start, cls.departure_at < start + timedelta(days=1))
+
 
-		return func.date(cls.departure_date) == departure_date
+class FlightPriceRollup(Base):
+	"""Per-scrape price summary of a route on a travel date, maintained as legs are saved"""
+
+	__tablename__ = 'flight_price_rollup'
+
+	departure_airport_id: Mapped[int] = mapped_column(ForeignKey('airport.id'), primary_key=True)
+	arrival_airport_id: Mapped[int] = mapped_column(ForeignKey('airport.id'), primary_key=True)
+	travel_date: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+	search_date: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+	min_price: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	median_price: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	min_duration_minutes: Mapped[int | None] = mapped_column(sa.SmallInteger, nullable=True)
+	offer_count: Mapped[int] = mapped_column(sa.Integer, default=0)
+
+
+class TripPrice(Base):
+	"""Current cheapest round trip per route, departure date and stay, kept up to date as its legs are scraped"""
+
+	__tablename__ = 'trip_price'
+
+	departure_airport_id: Mapped[int] = mapped_column(ForeignKey('airport.id'), primary_key=True)
+	arrival_airport_id: Mapped[int] = mapped_column(ForeignKey('airport.id'), primary_key=True)
+	departure_date: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+	stay_days: Mapped[int] = mapped_column(sa.SmallInteger, primary_key=True)
+	# Cheapest outbound and return leg of their latest scrapes; the total is known once both legs were scraped
+	outbound_price: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	return_price: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	total_price: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	lowest_total_price: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	updated_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+class ScrapeRun(Base):
+	__tablename__ = 'scrape_runs'
+
+	id: Mapped[int] = mapped_column(primary_key=True)
+	started_at: Mapped[datetime] = mapped_column(DateTime)
+	finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+	status: Mapped[str] = mapped_column(String(16), default='running')
+	query_count: Mapped[int] = mapped_column(sa.Integer, default=0)
+
+
+class ScrapeQuery(Base):
+	"""Audit row per search query: phase timings in milliseconds, card counts and outcome class"""
+
+	__tablename__ = 'scrape_queries'
+	__table_args__ = (Index('ix_scrape_queries_route', 'departure_airport', 'arrival_airport', 'started_at'),)
+
+	id: Mapped[int] = mapped_column(primary_key=True)
+	run_id: Mapped[int] = mapped_column(ForeignKey('scrape_runs.id', ondelete='CASCADE'), index=True)
+	departure_airport: Mapped[str] = mapped_column(String(8))
+	arrival_airport: Mapped[str] = mapped_column(String(8))
+	travel_date: Mapped[date] = mapped_column(sa.Date)
+	started_at: Mapped[datetime] = mapped_column(DateTime)
+	launch_ms: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	navigation_ms: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	wait_ms: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	extract_ms: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	parse_ms: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	persist_ms: Mapped[float | None] = mapped_column(sa.Float, nullable=True)
+	total_ms: Mapped[float] = mapped_column(sa.Float, default=0.0)
+	card_count: Mapped[int] = mapped_column(sa.Integer, default=0)
+	flight_count: Mapped[int] = mapped_column(sa.Integer, default=0)
+	outcome: Mapped[str] = mapped_column(String(16))
+	error: Mapped[str | None] = mapped_column(sa.Text, nullable=True)
+	# SearchConstraints.cache_key of the search, so stored legs are only reused by searches under the same constraints
+	constraints: Mapped[str | None] = mapped_column(sa.Text, nullable=True)
+
+
+TASK_PENDING = 'pending'
+TASK_LEASED = 'leased'
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+
+
+class ScrapeTask(Base):
+	"""One (origin, destination, travel date) search of a plan, leased to a single worker at a time"""
+
+	__tablename__ = 'scrape_tasks'
+	__table_args__ = (
+		UniqueConstraint('plan', 'departure_airport', 'arrival_airport', 'travel_date', name='uq_scrape_task'),
+		Index('ix_scrape_tasks_claim', 'plan', 'status', 'travel_date'),
+	)
+
+	id: Mapped[int] = mapped_column(primary_key=True)
+	plan: Mapped[str] = mapped_column(String(64))
+	departure_airport: Mapped[str] = mapped_column(String(8))
+	arrival_airport: Mapped[str] = mapped_column(String(8))
+	travel_date: Mapped[date] = mapped_column(sa.Date)
+	status: Mapped[str] = mapped_column(String(16), default=TASK_PENDING)
+	attempts: Mapped[int] = mapped_column(sa.Integer, default=0)
+	# A leased task whose lease_expires_at has passed belongs to a dead worker and can be claimed again
+	lease_owner: Mapped[str | None] = mapped_column(String(128), nullable=True)
+	lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+	heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+	created_at: Mapped[datetime] = mapped_column(DateTime)
+	finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+	outcome: Mapped[str | None] = mapped_column(String(16), nullable=True)
+	error: Mapped[str | None] = mapped_column(sa.Text, nullable=True)
@@ -0,0 +1,155 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import Connection, Engine, MetaData, Table, insert, inspect, select
+
+from src.models.database import Airline, Airport, Base, Flight, FlightAirline
+from src.models.records import leg_fingerprint, parse_connections
+
+LEGACY_TABLE = 'flight_legacy'
+
+
+def _needs_legacy_migration(engine: Engine) -> bool:
+	inspector = inspect(engine)
+	if 'flight' not in inspector.get_table_names():
+		return False
+
+	columns = {column['name'] for column in inspector.get_columns('flight')}
+	return 'companies' in columns
+
+
+def _as_datetime(value) -> datetime:
+	if isinstance(value, datetime):
+		return value
+	return datetime.fromisoformat(str(value))
+
+
+def _load_companies(value) -> list[str]:
+	if not value:
+		return []
+	if isinstance(value, list):
+		return value
+	try:
+		companies = json.loads(value)
+	except (json.JSONDecodeError, TypeError):
+		return [company.strip() for company in str(value).split(',') if company.strip()]
+	return companies if isinstance(companies, list) else [str(companies)]
+
+
+def _intern(conn: Connection, model: type[Base], column: str, cache: dict[str, int], value: str) -> int:
+	if value not in cache:
+		result = conn.execute(insert(model).values({column: value}))
+		cache[value] = result.lastrowid
+	return cache[value]
+
+
+def add_flight_validity_interval(engine: Engine) -> bool:
+	"""Add last_seen to flight tables created before compaction existed, backfilled from search_date"""
+	inspector = inspect(engine)
+	if 'flight' not in inspector.get_table_names():
+		return False
+
+	columns = {column['name'] for column in inspector.get_columns('flight')}
+	if 'last_seen' in columns or 'companies' in columns:
+		return False
+
+	with engine.begin() as conn:
+		conn.exec_driver_sql('ALTER TABLE flight ADD COLUMN last_seen DATE')
+		conn.exec_driver_sql('UPDATE flight SET last_seen = search_date')
+
+	return True
+
+
+def add_scrape_query_constraints(engine: Engine) -> bool:
+	"""Add the constraints column to scrape_queries tables created before searches could be constrained"""
+	inspector = inspect(engine)
+	if 'scrape_queries' not in inspector.get_table_names():
+		return False
+
+	columns = {column['name'] for column in inspector.get_columns('scrape_queries')}
+	if 'constraints' in columns:
+		return False
+
+	with engine.begin() as conn:
+		conn.exec_driver_sql('ALTER TABLE scrape_queries ADD COLUMN constraints TEXT')
+
+	return True
+
+
+def migrate_legacy_flight_table(engine: Engine, batch_size: int = 5000) -> int:
+	"""Move rows of the old denormalized `flight` table into the compact schema, returning rows copied"""
+	if not _needs_legacy_migration(engine):
+		return 0
+
+	copied = 0
+
+	with engine.begin() as conn:
+		conn.exec_driver_sql(f'ALTER TABLE flight RENAME TO {LEGACY_TABLE}')
+		Base.metadata.create_all(conn)
+
+		legacy = Table(LEGACY_TABLE, MetaData(), autoload_with=conn)
+
+		airports: dict[str, int] = {}
+		airlines: dict[str, int] = {}
+		seen: set[tuple[object, int]] = set()
+
+		result = conn.execute(select(legacy).order_by(legacy.c.id)).mappings()
+		for rows in result.partitions(batch_size):
+			flight_rows = []
+			link_rows = []
+
+			for row in rows:
+				departure_at = _as_datetime(row['departure_time'] or row['departure_date'])
+				arrival_at = _as_datetime(row['arrival_time'] or row['arrival_date'])
+				search_date = _as_datetime(row['search_date']).date()
+				duration_minutes = round(row['total_hours'] * 60) if row['total_hours'] is not None else None
+				stops, self_transfer = parse_connections(row['connections'])
+				companies = _load_companies(row['companies'])
+
+				fingerprint = leg_fingerprint(
+					row['departure_airport'],
+					row['arrival_airport'],
+					departure_at,
+					arrival_at,
+					duration_minutes,
+					stops,
+					self_transfer,
+					companies,
+				)
+				if (search_date, fingerprint) in seen:
+					continue
+				seen.add((search_date, fingerprint))
+
+				flight_rows.append(
+					{
+						'id': row['id'],
+						'search_date': search_date,
+						'departure_airport_id': _intern(conn, Airport, 'code', airports, row['departure_airport']),
+						'arrival_airport_id': _intern(conn, Airport, 'code', airports, row['arrival_airport']),
+						'departure_at': departure_at,
+						'arrival_at': arrival_at,
+						'price': row['price'],
+						'duration_minutes': duration_minutes,
+						'stops': stops,
+						'self_transfer': self_transfer,
+						'fingerprint': fingerprint,
+					}
+				)
+				for position, name in enumerate(companies):
+					link_rows.append(
+						{
+							'flight_id': row['id'],
+							'position': position,
+							'airline_id': _intern(conn, Airline, 'name', airlines, name),
+						}
+					)
+
+			if flight_rows:
+				conn.execute(insert(Flight), flight_rows)
+			if link_rows:
+				conn.execute(insert(FlightAirline), link_rows)
+			copied += len(flight_rows)
+
+		legacy.drop(conn)
+
+	return copied
@@ -0,0 +1,142 @@
+import hashlib
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+
+# Kept free of SQLAlchemy: scrapers and worker processes handle legs as records and never need the ORM
+
+SELF_TRANSFER_LABEL = 'transbordo'
+
+
+def parse_connections(connections: str | None) -> tuple[int, bool]:
+	"""Turn momondo connection text like '2 escalas' into (stops, self_transfer)"""
+	if not connections:
+		return 0, False
+
+	text = connections.lower()
+	match = re.search(r'(\d+)', text)
+	stops = int(match.group(1)) if match else 0
+
+	return stops, SELF_TRANSFER_LABEL in text
+
+
+def format_connections(stops: int, self_transfer: bool = False) -> str:
+	"""Inverse of parse_connections, used when exporting legs as text"""
+	if stops == 0:
+		label = 'direto'
+	elif stops == 1:
+		label = '1 escala'
+	else:
+		label = f'{stops} escalas'
+
+	return f'{label}, {SELF_TRANSFER_LABEL}' if self_transfer else label
+
+
+def leg_fingerprint(
+	departure_airport: str,
+	arrival_airport: str,
+	departure_at: datetime,
+	arrival_at: datetime,
+	duration_minutes: int | None,
+	stops: int,
+	self_transfer: bool,
+	companies: list[str] | tuple[str, ...],
+) -> int:
+	"""Stable signed 64-bit identity of a leg, independent of price and search date"""
+	canonical = '|'.join(
+		[
+			departure_airport,
+			arrival_airport,
+			departure_at.strftime('%Y%m%d%H%M'),
+			arrival_at.strftime('%Y%m%d%H%M'),
+			str(duration_minutes if duration_minutes is not None else ''),
+			str(stops),
+			'1' if self_transfer else '0',
+			'\x1f'.join(companies),
+		]
+	)
+	digest = hashlib.blake2b(canonical.encode(), digest_size=8).digest()
+	return int.from_bytes(digest, 'big', signed=True)
+
+
+LEG_CSV_COLUMNS = [
+	'id',
+	'search_date',
+	'departure_airport',
+	'arrival_airport',
+	'departure_date',
+	'arrival_date',
+	'departure_time',
+	'arrival_time',
+	'price',
+	'total_hours',
+	'companies',
+	'connections',
+]
+
+COMBINATION_CSV_HEADERS = [f'dep_{column}' for column in LEG_CSV_COLUMNS] + [f'arr_{column}' for column in LEG_CSV_COLUMNS] + ['total_price', 'trip_duration_days']
+
+
+@dataclass(frozen=True, slots=True)
+class FlightRecord:
+	"""Plain, uninstrumented leg: what providers return, bulk reads produce and the combination step reads
+
+	Cheap to build and to pickle, so legs can go to other processes; DatabaseService turns them into rows in bulk.
+	"""
+
+	id: int | None
+	search_date: date
+	departure_airport: str
+	arrival_airport: str
+	departure_at: datetime
+	arrival_at: datetime
+	price: float | None
+	duration_minutes: int | None
+	stops: int
+	self_transfer: bool
+	companies: tuple[str, ...]
+
+	@property
+	def total_hours(self) -> float | None:
+		return self.duration_minutes / 60 if self.duration_minutes is not None else None
+
+	@property
+	def connections(self) -> str:
+		return format_connections(self.stops, self.self_transfer)
+
+	def fingerprint(self) -> int:
+		return leg_fingerprint(
+			self.departure_airport,
+			self.arrival_airport,
+			self.departure_at,
+			self.arrival_at,
+			self.duration_minutes,
+			self.stops,
+			self.self_transfer,
+			self.companies,
+		)
+
+	def csv_cells(self) -> list:
+		"""The LEG_CSV_COLUMNS of a combinations CSV row, formatted once per leg instead of once per pair"""
+		return [
+			self.id if self.id is not None else '',
+			self.search_date.strftime('%Y-%m-%d %H:%M:%S') if self.search_date else '',
+			self.departure_airport,
+			self.arrival_airport,
+			self.departure_at.strftime('%Y-%m-%d'),
+			self.arrival_at.strftime('%Y-%m-%d'),
+			self.departure_at.strftime('%H:%M'),
+			self.arrival_at.strftime('%H:%M'),
+			self.price or 0,
+			self.total_hours or 0,
+			', '.join(self.companies),
+			self.connections,
+		]
+
+
+def combination_row(dep_flight: FlightRecord, arr_flight: FlightRecord, dep_cells: list | None = None, arr_cells: list | None = None) -> list:
+	"""One COMBINATION_CSV_HEADERS row for an outbound/return pair"""
+	trip_duration = (arr_flight.departure_at.date() - dep_flight.arrival_at.date()).days
+	total_price = (dep_flight.price or 0) + (arr_flight.price or 0)
+
+	return (dep_cells or dep_flight.csv_cells()) + (arr_cells or arr_flight.csv_cells()) + [total_price, trip_duration]
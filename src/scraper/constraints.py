@@ -0,0 +1,78 @@
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime, time
+
+TimeWindow = tuple[time, time]
+
+
+def parse_time_window(value: str) -> TimeWindow:
+	"""'06:00-22:00' -> (06:00, 22:00)"""
+	start, _, end = value.partition('-')
+	window = (datetime.strptime(start.strip(), '%H:%M').time(), datetime.strptime(end.strip(), '%H:%M').time())
+	if window[0] > window[1]:
+		raise ValueError(f'Time window {value} wraps past midnight')
+	return window
+
+
+@dataclass(frozen=True)
+class SearchConstraints:
+	"""What a search should return, sent to momondo as result filters and checked again on every parsed card
+
+	airline_codes go into the URL (momondo filters on IATA codes); airlines are matched against the operator names printed on
+	the cards. A leg passes the airline check when any of its operators is listed. None or empty leaves a filter out.
+	"""
+
+	max_stops: int | None = None
+	airlines: tuple[str, ...] = ()
+	airline_codes: tuple[str, ...] = ()
+	departure_window: TimeWindow | None = None
+	arrival_window: TimeWindow | None = None
+	max_duration_minutes: int | None = None
+	exclude_self_transfer: bool = False
+
+	def fs_parameter(self) -> str:
+		"""Value of momondo's fs= query parameter: ';'-separated filters in the Kayak-family URL syntax"""
+		filters = ['fdDir=false']
+		if self.max_stops is not None:
+			filters.append(f'stops=~{self.max_stops}')
+		if self.airline_codes:
+			filters.append(f'airlines={",".join(self.airline_codes)}')
+		if self.departure_window:
+			filters.append(f'takeoff={self.departure_window[0]:%H%M},{self.departure_window[1]:%H%M}')
+		if self.arrival_window:
+			filters.append(f'landing={self.arrival_window[0]:%H%M},{self.arrival_window[1]:%H%M}')
+		if self.max_duration_minutes is not None:
+			filters.append(f'legdur=-{self.max_duration_minutes}')
+		if self.exclude_self_transfer:
+			filters.append('virtualinterline=-virtualinterline')
+		return ';'.join(filters)
+
+	def cache_key(self) -> str:
+		"""Identifies which legs a search under these constraints returns, to tell stored results of different searches apart"""
+		airlines = ','.join(sorted(airline.casefold() for airline in self.airlines))
+		return f'{self.fs_parameter()};names={airlines}' if airlines else self.fs_parameter()
+
+	def allows(
+		self,
+		departure_at: datetime,
+		arrival_at: datetime,
+		duration_minutes: int | None,
+		stops: int,
+		self_transfer: bool,
+		companies: Sequence[str],
+	) -> bool:
+		if self.max_stops is not None and stops > self.max_stops:
+			return False
+		if self.exclude_self_transfer and self_transfer:
+			return False
+		if self.max_duration_minutes is not None and duration_minutes is not None and duration_minutes > self.max_duration_minutes:
+			return False
+		if self.departure_window and not self.departure_window[0] <= departure_at.time() <= self.departure_window[1]:
+			return False
+		if self.arrival_window and not self.arrival_window[0] <= arrival_at.time() <= self.arrival_window[1]:
+			return False
+		if self.airlines:
+			wanted = {airline.casefold() for airline in self.airlines}
+			if not any(company.casefold() in wanted for company in companies):
+				return False
+		return True
@@ -0,0 +1,106 @@
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from src.models.records import FlightRecord
+from src.scraper.provider import FlightProvider
+from src.scraper.selection import SelectionPolicy, pareto_legs
+from src.scraper.stats import OUTCOME_BLOCKED, OUTCOME_EMPTY, OUTCOME_OK, QueryStats, classify_exception
+from src.utils.logger import count, get_logger, span
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class ProviderResult:
+	provider: str
+	flights: list[FlightRecord]
+	stats: QueryStats
+	error: Exception | None = None
+
+
+def merge_legs(results: Sequence[list[FlightRecord]]) -> list[FlightRecord]:
+	"""Union of several providers' legs, one per canonical leg fingerprint, at the cheapest price any of them offered"""
+	merged: dict[int, FlightRecord] = {}
+	for flights in results:
+		for flight in flights:
+			fingerprint = flight.fingerprint()
+			kept = merged.get(fingerprint)
+			if kept is None or (flight.price is not None and (kept.price is None or flight.price < kept.price)):
+				merged[fingerprint] = flight
+	return list(merged.values())
+
+
+class FanOutScraper:
+	"""Runs each search on several providers at once and merges their legs
+
+	Every provider with a queries_per_hour limit waits on its own token bucket, so a slow or strict site paces only itself. A
+	provider that fails or is blocked is logged and left out; the search only fails when every provider did. Legs found by
+	more than one provider are kept once, and the merged set goes through the selection policy again, as the union of
+	several frontiers is not a frontier itself.
+	"""
+
+	def __init__(self, providers: Sequence[FlightProvider], selection: SelectionPolicy | None = None) -> None:
+		if not providers:
+			raise ValueError('FanOutScraper needs at least one provider')
+		self.providers = list(providers)
+		self.selection = selection or SelectionPolicy()
+		self._pool = ThreadPoolExecutor(max_workers=len(self.providers), thread_name_prefix='provider')
+
+	@property
+	def humanize(self) -> bool:
+		# TripAgencyService pauses between searches for the providers that pace themselves like a person
+		return any(provider.humanize for provider in self.providers)
+
+	def _query(self, provider: FlightProvider, departure: str, arrival: str, date: str, adults: int) -> ProviderResult:
+		stats = QueryStats()
+		with span('provider', provider=provider.name, departure=departure, arrival=arrival, date=date) as fields:
+			try:
+				flights = provider.get_flights(departure=departure, arrival=arrival, date=date, adults=adults, stats=stats)
+			except Exception as e:
+				stats.outcome = classify_exception(e)
+				stats.error = str(e)
+				fields['outcome'] = stats.outcome
+				count(f'provider_{provider.name}_{stats.outcome}')
+				logger.warning('%s failed on %s-%s %s: %s', provider.name, departure, arrival, date, e)
+				return ProviderResult(provider.name, [], stats, e)
+			fields.update(outcome=stats.outcome, flights=len(flights))
+
+		count(f'provider_{provider.name}_{stats.outcome}')
+		return ProviderResult(provider.name, flights, stats)
+
+	def search(self, departure: str, arrival: str, date: str, adults: int = 1) -> list[ProviderResult]:
+		"""Every provider's own result for a search, in provider order"""
+		futures = [self._pool.submit(self._query, provider, departure, arrival, date, adults) for provider in self.providers]
+		return [future.result() for future in futures]
+
+	def get_flights(self, departure: str, arrival: str, date: str, adults: int = 1, stats: QueryStats | None = None) -> list[FlightRecord]:
+		stats = stats or QueryStats()
+		results = self.search(departure, arrival, date, adults)
+
+		answered = [result for result in results if result.error is None]
+		if not answered:
+			raise results[0].error or RuntimeError(f'No provider answered {departure}-{arrival} {date}')
+
+		# Providers run side by side, so the slowest one sets how long each phase of the search took
+		for result in answered:
+			for phase, duration_ms in result.stats.phases.items():
+				stats.phases[phase] = max(stats.phases.get(phase, 0.0), duration_ms)
+
+		with stats.phase('parse'):
+			merged = merge_legs([result.flights for result in answered])
+			count('legs_deduplicated', sum(len(result.flights) for result in answered) - len(merged))
+			selected = pareto_legs(merged, self.selection)
+
+		stats.card_count = sum(result.stats.card_count for result in answered)
+		stats.flight_count = len(selected)
+		if not selected:
+			stats.outcome = OUTCOME_BLOCKED if all(result.stats.outcome == OUTCOME_BLOCKED for result in answered) else OUTCOME_EMPTY
+		else:
+			stats.outcome = OUTCOME_OK
+		return selected
+
+	def close(self) -> None:
+		self._pool.shutdown(wait=False, cancel_futures=True)
+		for provider in self.providers:
+			provider.close()
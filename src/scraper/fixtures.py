@@ -0,0 +1,97 @@
+import json
+import os
+import random
+import time
+from collections.abc import Iterable, Sequence
+from datetime import date, datetime
+
+from src.models.records import FlightRecord
+from src.scraper.provider import FlightProvider, SearchQuery
+from src.scraper.stats import QueryStats
+
+
+def fixture_path(directory: str, query: SearchQuery) -> str:
+	"""File a search's legs are kept under: <directory>/<DEP>-<ARR>-<date>.json"""
+	return os.path.join(directory, f'{query.departure}-{query.arrival}-{query.date}.json')
+
+
+def write_fixture(directory: str, query: SearchQuery, flights: Iterable[FlightRecord]) -> None:
+	"""Save legs in the format FixtureProvider serves, e.g. to turn a recorded momondo run into a second fake site"""
+	os.makedirs(directory, exist_ok=True)
+	legs = [
+		{
+			'departure_at': flight.departure_at.isoformat(),
+			'arrival_at': flight.arrival_at.isoformat(),
+			'price': flight.price,
+			'duration_minutes': flight.duration_minutes,
+			'stops': flight.stops,
+			'self_transfer': flight.self_transfer,
+			'companies': list(flight.companies),
+		}
+		for flight in flights
+	]
+	with open(fixture_path(directory, query), 'w', encoding='utf-8') as fixture:
+		json.dump(legs, fixture, indent=1)
+
+
+class FixtureProvider(FlightProvider):
+	"""Fake site serving legs from JSON fixtures, for exercising the fan-out and the pipeline offline
+
+	A search without a fixture comes back empty. latency_seconds (with up to latency_jitter on top) stands in for the time a
+	real site takes, and price_jitter scales every price by up to that fraction either way, so two fixture providers over
+	the same files disagree on prices like two real sites would.
+	"""
+
+	def __init__(
+		self,
+		fixture_dir: str,
+		name: str = 'fixture',
+		latency_seconds: float = 0.0,
+		latency_jitter: float = 0.0,
+		price_jitter: float = 0.0,
+		seed: int | None = None,
+		**kwargs,
+	) -> None:
+		super().__init__(**kwargs)
+		if not os.path.isdir(fixture_dir):
+			raise FileNotFoundError(f'Fixture directory {fixture_dir} not found')
+		self.fixture_dir = fixture_dir
+		self.name = name
+		self.latency_seconds = latency_seconds
+		self.latency_jitter = latency_jitter
+		self.price_jitter = price_jitter
+		self._rng = random.Random(seed)
+
+	def fetch(self, query: SearchQuery, stats: QueryStats) -> str:
+		with stats.phase('extract'):
+			if self.latency_seconds or self.latency_jitter:
+				time.sleep(self.latency_seconds + self._rng.uniform(0, self.latency_jitter))
+			try:
+				with open(fixture_path(self.fixture_dir, query), encoding='utf-8') as fixture:
+					return fixture.read()
+			except FileNotFoundError:
+				return ''
+
+	def extract(self, page: str) -> Sequence[dict]:
+		return json.loads(page) if page else []
+
+	def looks_blocked(self, page: str) -> bool:
+		return False
+
+	def normalize(self, card: dict, query: SearchQuery) -> FlightRecord | None:
+		price = card.get('price')
+		if price is not None and self.price_jitter:
+			price = round(price * (1 + self._rng.uniform(-self.price_jitter, self.price_jitter)))
+		return FlightRecord(
+			id=None,
+			departure_airport=query.departure,
+			arrival_airport=query.arrival,
+			search_date=date.today(),
+			departure_at=datetime.fromisoformat(card['departure_at']),
+			arrival_at=datetime.fromisoformat(card['arrival_at']),
+			price=price,
+			duration_minutes=card.get('duration_minutes'),
+			stops=card.get('stops', 0),
+			self_transfer=card.get('self_transfer', False),
+			companies=tuple(card.get('companies', ())),
+		)
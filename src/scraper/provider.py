@@ -0,0 +1,133 @@
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Protocol
+
+from src.models.records import FlightRecord
+from src.scraper.constraints import SearchConstraints
+from src.scraper.selection import SelectionPolicy, pareto_legs
+from src.scraper.stats import OUTCOME_BLOCKED, OUTCOME_EMPTY, QueryStats, looks_blocked
+from src.utils.logger import count, get_logger
+from src.utils.rate_limit import QueryBudget
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+	departure: str
+	arrival: str
+	date: str
+	adults: int = 1
+
+	@property
+	def day(self) -> datetime:
+		return datetime.strptime(self.date, '%Y-%m-%d')
+
+
+class FlightSource(Protocol):
+	"""What TripAgencyService scrapes through: a single provider or several fanned out"""
+
+	@property
+	def humanize(self) -> bool: ...
+
+	def get_flights(self, departure: str, arrival: str, date: str, adults: int = 1, stats: QueryStats | None = None) -> list[FlightRecord]: ...
+
+	def close(self) -> None: ...
+
+
+class FlightProvider(ABC):
+	"""A flight search site: fetch a result page, extract its result cards and normalize each card into a FlightRecord
+
+	Subclasses implement the three steps; get_flights runs them, drops the legs the search constraints rule out and keeps
+	the selection policy's frontier. queries_per_hour is how fast the site may be queried, alone or fanned out together with
+	others (None for no limit); get_flights waits for its own token bucket before fetching.
+	"""
+
+	name = 'provider'
+
+	def __init__(
+		self,
+		humanize: bool = False,
+		selection: SelectionPolicy | None = None,
+		constraints: SearchConstraints | None = None,
+		queries_per_hour: float | None = None,
+	) -> None:
+		self.humanize = humanize
+		self.selection = selection or SelectionPolicy()
+		self.constraints = constraints or SearchConstraints()
+		self.queries_per_hour = queries_per_hour
+
+	@property
+	def queries_per_hour(self) -> float | None:
+		return self._queries_per_hour
+
+	@queries_per_hour.setter
+	def queries_per_hour(self, queries_per_hour: float | None) -> None:
+		self._queries_per_hour = queries_per_hour
+		self._budget = QueryBudget(queries_per_hour) if queries_per_hour else None
+
+	@abstractmethod
+	def fetch(self, query: SearchQuery, stats: QueryStats) -> str: ...
+
+	@abstractmethod
+	def extract(self, page: str) -> Sequence[Any]:
+		"""The result cards of a fetched page, in whatever form normalize reads"""
+
+	@abstractmethod
+	def normalize(self, card: Any, query: SearchQuery) -> FlightRecord | None:
+		"""One card as a leg; None skips cards that are not flights (ads, placeholders)"""
+
+	def looks_blocked(self, page: str) -> bool:
+		return looks_blocked(page)
+
+	def close(self) -> None:
+		"""Release what the provider holds between searches; the momondo and fixture providers hold nothing"""
+		return None
+
+	def parse(self, page: str, query: SearchQuery, stats: QueryStats | None = None) -> list[FlightRecord]:
+		cards = self.extract(page)
+		count('cards_parsed', len(cards))
+		if stats:
+			stats.card_count = len(cards)
+
+		flights: list[FlightRecord] = []
+		for card in cards:
+			try:
+				flight = self.normalize(card, query)
+			except Exception as e:
+				logger.warning('Error parsing %s card: %s (%s)', self.name, e, type(e).__name__)
+				count('cards_failed')
+				continue
+			if flight is None:
+				continue
+
+			# Sites apply the filters they were sent; this catches the ones they ignore or relax
+			if not self.constraints.allows(flight.departure_at, flight.arrival_at, flight.duration_minutes, flight.stops, flight.self_transfer, flight.companies):
+				count('cards_rejected')
+				continue
+			flights.append(flight)
+
+		count('flights_parsed', len(flights))
+		return flights
+
+	def get_flights(self, departure: str, arrival: str, date: str, adults: int = 1, stats: QueryStats | None = None) -> list[FlightRecord]:
+		stats = stats or QueryStats()
+		query = SearchQuery(departure, arrival, date, adults)
+
+		if self._budget and self._budget.acquire():
+			count(f'provider_{self.name}_throttled')
+		page = self.fetch(query, stats)
+
+		with stats.phase('parse'):
+			flights = self.parse(page, query, stats=stats)
+			# Keep the legs worth combining: the price/duration/stops frontier of the page
+			filtered = pareto_legs(flights, self.selection)
+
+		stats.flight_count = len(filtered)
+		count('flights_kept', len(filtered))
+		if not stats.card_count:
+			stats.outcome = OUTCOME_BLOCKED if self.looks_blocked(page) else OUTCOME_EMPTY
+
+		return filtered
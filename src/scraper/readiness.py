@@ -0,0 +1,108 @@
+import random
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from src.utils.logger import count, get_logger
+
+if TYPE_CHECKING:
+	from playwright.sync_api import Page
+
+logger = get_logger(__name__)
+
+CONSENT_SELECTORS = ("text='Aceitar tudo'", "text='Accept all'", "[data-testid='accept-all']", '.cookie-accept', '#cookie-accept')
+
+# Installs a MutationObserver on first call that timestamps every change of the card count, then reports which signal made the page ready
+READINESS_PREDICATE = """
+({cardSelector, progressbarSelector, settleMs, minCards}) => {
+	if (!window.__flightsReadiness) {
+		const state = {cards: document.querySelectorAll(cardSelector).length, changedAt: performance.now()};
+		new MutationObserver(() => {
+			const cards = document.querySelectorAll(cardSelector).length;
+			if (cards !== state.cards) {
+				state.cards = cards;
+				state.changedAt = performance.now();
+			}
+		}).observe(document.documentElement, {childList: true, subtree: true});
+		window.__flightsReadiness = state;
+	}
+	const state = window.__flightsReadiness;
+	const progressbar = document.querySelector(progressbarSelector);
+	if (progressbar && progressbar.getAttribute('aria-hidden') === 'true') {
+		return 'progressbar';
+	}
+	if (state.cards >= minCards && performance.now() - state.changedAt >= settleMs) {
+		return 'settled';
+	}
+	return false;
+}
+"""
+
+
+@dataclass(frozen=True)
+class ReadinessConfig:
+	"""When a result page counts as loaded, and how much human-like interaction a query may spend while it loads
+
+	The page is ready when momondo hides its progressbar or when at least min_cards result cards are present and their
+	count has not changed for settle_ms, whichever comes first. A shorter settle_ms returns sooner but may cut off
+	results momondo is still streaming in.
+	"""
+
+	card_selector: str = 'div.nrc6-inner'
+	progressbar_selector: str = 'div[role="progressbar"]'
+	settle_ms: int = 1500
+	min_cards: int = 1
+	timeout_ms: int = 60000
+	poll_ms: int = 100
+	# Mouse moves and scrolls are only made while the page is still loading, and never for longer than this
+	interaction_budget_ms: int = 3000
+	moves_per_round: int = 15
+
+
+def accept_consent(page: 'Page', humanize: bool) -> bool:
+	"""Click a cookie banner's accept button if one is showing right now; costs nothing when there is none"""
+	for selector in CONSENT_SELECTORS:
+		try:
+			locator = page.locator(selector)
+			for index in range(locator.count()):
+				if locator.nth(index).is_visible():
+					if humanize:
+						time.sleep(random.uniform(0.2, 0.6))
+					locator.nth(index).click()
+					count('consent_accepted')
+					return True
+		except Exception as e:
+			logger.warning('Error handling cookie consent: %s', e)
+	return False
+
+
+def _interact(page: 'Page', config: ReadinessConfig, deadline: float) -> None:
+	"""One round of small mouse moves and a scroll, with a pause cut short at the deadline"""
+	x = random.uniform(100.0, 600.0)
+	y = random.uniform(100.0, 400.0)
+	for _ in range(config.moves_per_round):
+		page.mouse.move(x + random.choice([1, -1, 0]), y + random.choice([1, -1, 0]))
+	page.mouse.wheel(random.uniform(-100.0, 100.0), random.uniform(-200.0, 200.0))
+	time.sleep(max(0.0, min(random.uniform(0.05, 0.5), deadline - time.monotonic())))
+
+
+def wait_until_ready(page: 'Page', config: ReadinessConfig, humanize: bool = True) -> str:
+	"""Block until the result page is ready and return the signal that fired ('progressbar' or 'settled')"""
+	arg = {'cardSelector': config.card_selector, 'progressbarSelector': config.progressbar_selector, 'settleMs': config.settle_ms, 'minCards': config.min_cards}
+	start = time.monotonic()
+
+	# Interaction fills time that is spent waiting anyway: checked between rounds, it never delays a ready page
+	if humanize and config.interaction_budget_ms > 0:
+		deadline = start + config.interaction_budget_ms / 1000
+		while time.monotonic() < deadline:
+			signal = page.evaluate(READINESS_PREDICATE, arg)
+			if signal:
+				count(f'ready_{signal}')
+				return signal
+			_interact(page, config, deadline)
+			count('interaction_rounds')
+
+	remaining_ms = max(config.poll_ms, config.timeout_ms - (time.monotonic() - start) * 1000)
+	signal = page.wait_for_function(READINESS_PREDICATE, arg=arg, polling=config.poll_ms, timeout=remaining_ms).json_value()
+	count(f'ready_{signal}')
+	return signal
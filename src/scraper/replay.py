@@ -0,0 +1,49 @@
+import os
+import re
+
+from src.scraper.play import Scraper
+from src.scraper.stats import QueryStats
+
+SEARCH_PATH = re.compile(r'/flight-search/(?P<departure>[A-Z]{3})-(?P<arrival>[A-Z]{3})/(?P<date>\d{4}-\d{2}-\d{2})/')
+
+
+def recorded_page_path(directory: str, url: str) -> str:
+	"""File a search page is recorded under: <directory>/<DEP>-<ARR>-<date>.html"""
+	match = SEARCH_PATH.search(url)
+	if not match:
+		raise ValueError(f'Not a flight-search URL: {url}')
+	return os.path.join(directory, f'{match["departure"]}-{match["arrival"]}-{match["date"]}.html')
+
+
+class RecordingScraper(Scraper):
+	"""Live scraper that also saves every result page, so the run can be replayed offline"""
+
+	def __init__(self, record_dir: str, **kwargs) -> None:
+		super().__init__(**kwargs)
+		self.record_dir = record_dir
+		os.makedirs(record_dir, exist_ok=True)
+
+	def fetch_momondo_html(self, url: str, stats: QueryStats | None = None) -> str:
+		html = super().fetch_momondo_html(url, stats=stats)
+		with open(recorded_page_path(self.record_dir, url), 'w', encoding='utf-8') as page:
+			page.write(html)
+		return html
+
+
+class ReplayScraper(Scraper):
+	"""Serves recorded result pages instead of driving a browser; searches without a recording come back empty"""
+
+	def __init__(self, replay_dir: str, **kwargs) -> None:
+		super().__init__(humanize=False, **kwargs)
+		if not os.path.isdir(replay_dir):
+			raise FileNotFoundError(f'Replay directory {replay_dir} not found')
+		self.replay_dir = replay_dir
+
+	def fetch_momondo_html(self, url: str, stats: QueryStats | None = None) -> str:
+		stats = stats or QueryStats()
+		with stats.phase('extract'):
+			try:
+				with open(recorded_page_path(self.replay_dir, url), encoding='utf-8') as page:
+					return page.read()
+			except FileNotFoundError:
+				return ''
@@ -0,0 +1,89 @@
+import math
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Protocol, TypeVar
+
+
+class Leg(Protocol):
+	@property
+	def price(self) -> float | None: ...
+
+	@property
+	def duration_minutes(self) -> int | None: ...
+
+	@property
+	def stops(self) -> int: ...
+
+
+LegT = TypeVar('LegT', bound=Leg)
+
+
+@dataclass(frozen=True)
+class SelectionPolicy:
+	"""Which parsed legs of a search are kept for combining
+
+	The default keeps every leg no other leg beats on price, duration and stops at once. price_epsilon (relative) and
+	duration_epsilon_minutes treat legs that close as equal, thinning crowded frontiers, and max_legs caps what is left.
+	Hard limits such as a maximum number of stops belong to SearchConstraints, which drops legs before selection.
+	"""
+
+	price_epsilon: float = 0.0
+	duration_epsilon_minutes: int = 0
+	max_legs: int | None = None
+
+
+EXACT = SelectionPolicy()
+
+
+def _box(leg: Leg, policy: SelectionPolicy) -> tuple[float, float, int]:
+	"""Objective vector of a leg, snapped to the epsilon grid when the policy has one; missing values rank last"""
+	price = leg.price if leg.price is not None else math.inf
+	duration = float(leg.duration_minutes) if leg.duration_minutes is not None else math.inf
+
+	if policy.price_epsilon > 0 and 0 < price < math.inf:
+		price = math.floor(math.log(price) / math.log1p(policy.price_epsilon))
+	if policy.duration_epsilon_minutes > 0 and duration < math.inf:
+		duration = duration // policy.duration_epsilon_minutes
+
+	return price, duration, leg.stops or 0
+
+
+def pareto_legs(legs: Sequence[LegT], policy: SelectionPolicy | None = None) -> list[LegT]:
+	"""Non-dominated legs on (price, duration, stops), cheapest first, in O(n log n)
+
+	Legs are visited cheapest first, so a leg is dominated exactly when an already kept leg with no more stops is at least
+	as fast. Stop counts are small, so the fastest kept duration per stop count is all the state the scan needs.
+	With epsilons, legs are compared on their grid cells and the cheapest leg of each surviving cell is kept.
+	"""
+	policy = policy or EXACT
+
+	gridded = policy.price_epsilon > 0 or policy.duration_epsilon_minutes > 0
+
+	# Within a grid cell the exact values break ties, so the cheapest leg of the cell is visited first
+	ordered = []
+	for index, leg in enumerate(legs):
+		exact = _box(leg, EXACT)
+		ordered.append((_box(leg, policy) if gridded else exact, exact, index))
+	ordered.sort()
+
+	fastest_by_stops: dict[int, float] = {}
+	frontier: list[LegT] = []
+	for (_, duration, stops), _, index in ordered:
+		leg = legs[index]
+		if any(fastest <= duration for kept_stops, fastest in fastest_by_stops.items() if kept_stops <= stops):
+			continue
+		frontier.append(leg)
+		fastest_by_stops[stops] = duration
+
+	if policy.max_legs is not None and len(frontier) > policy.max_legs:
+		frontier = _spread(frontier, policy.max_legs)
+
+	return frontier
+
+
+def _spread(frontier: list[LegT], size: int) -> list[LegT]:
+	"""Evenly spaced legs along the cheapest-first frontier, always keeping both ends of its price range"""
+	if size <= 1:
+		return frontier[:size]
+	step = (len(frontier) - 1) / (size - 1)
+	return [frontier[round(index * step)] for index in range(size)]
@@ -0,0 +1,264 @@
+import json
+import os
+import random
+import shutil
+import socket
+import threading
+import time
+import uuid
+from collections.abc import Generator
+from contextlib import contextmanager, suppress
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING
+
+from src.utils.logger import count, get_logger
+
+try:
+	import fcntl
+except ImportError:
+	# Without flock (Windows) only the threads of one process coordinate; give each process its own --browser-state there
+	fcntl = None  # type: ignore[assignment]
+
+if TYPE_CHECKING:
+	from playwright.sync_api import BrowserContext, BrowserType
+
+logger = get_logger(__name__)
+
+BROWSER_STATE_DIR = 'browser_state'
+
+
+def _process_alive(pid: int) -> bool:
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except OSError:
+		# Exists, but belongs to another user
+		return True
+	return True
+
+
+@dataclass(frozen=True)
+class SessionConfig:
+	"""Where browser state survives between queries, and when the scraper starts over with a new identity
+
+	An identity is a user agent and viewport with its cookies (storage_state.json) and Chrome profiles, whose disk cache keeps
+	momondo's static assets. None turns a rotation trigger off.
+	"""
+
+	directory: str = BROWSER_STATE_DIR
+	rotate_after_queries: int | None = 50
+	rotate_after_seconds: float | None = 6 * 3600
+	rotate_on_block: bool = True
+	cache_size_mb: int = 256
+
+
+@dataclass
+class Identity:
+	id: str
+	user_agent: str
+	viewport: dict[str, int]
+	created_at: float
+	queries: int = 0
+	consented: bool = False
+	blocked: bool = False
+
+
+class BrowserSession:
+	"""Persistent browser identity shared by every query of a scraper, and by other processes using the same directory
+
+	Each concurrent query gets its own profile slot (Chrome locks a profile to one browser), created per host and process and
+	reused afterwards. A new slot starts from the identity's saved cookies, so the consent banner is only ever clicked once.
+	Processes coordinate through a lock file next to identity.json and a lease file per slot in use: the last query on a
+	retired identity, in whichever process, deletes it.
+	"""
+
+	def __init__(self, config: SessionConfig, user_agents: list[str], viewports: list[dict[str, int]]) -> None:
+		self.config = config
+		self.user_agents = user_agents
+		self.viewports = viewports
+		self._lock = threading.Lock()
+		self._free_slots: dict[str, list[str]] = {}
+		self._host = socket.gethostname()
+		self._slot_owner = f'{self._host}-{os.getpid()}'
+		self._slot_count = 0
+		os.makedirs(config.directory, exist_ok=True)
+
+	@property
+	def _identity_file(self) -> str:
+		return os.path.join(self.config.directory, 'identity.json')
+
+	@property
+	def _identities_dir(self) -> str:
+		return os.path.join(self.config.directory, 'identities')
+
+	def _identity_dir(self, identity: Identity | str) -> str:
+		return os.path.join(self._identities_dir, identity if isinstance(identity, str) else identity.id)
+
+	def _storage_state_file(self, identity: Identity) -> str:
+		return os.path.join(self._identity_dir(identity), 'storage_state.json')
+
+	def _lease_file(self, identity: Identity, slot: str) -> str:
+		return os.path.join(self._identity_dir(identity), 'leases', os.path.basename(slot))
+
+	@contextmanager
+	def _locked(self) -> Generator[None, None, None]:
+		"""Held around every read-modify-write of the shared state, by threads of this process and by other processes"""
+		with self._lock, open(os.path.join(self.config.directory, 'identity.lock'), 'a') as lock_file:
+			if fcntl:
+				fcntl.flock(lock_file, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				if fcntl:
+					fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+	def _read_identity(self) -> Identity | None:
+		try:
+			with open(self._identity_file, encoding='utf-8') as identity_file:
+				return Identity(**json.load(identity_file))
+		except (OSError, ValueError, TypeError):
+			return None
+
+	def _write_identity(self, identity: Identity) -> None:
+		# Written to a temporary file and renamed, so readers never see half of it
+		temporary = f'{self._identity_file}.{self._slot_owner}.tmp'
+		with open(temporary, 'w', encoding='utf-8') as identity_file:
+			json.dump(asdict(identity), identity_file)
+		os.replace(temporary, self._identity_file)
+
+	def _expired(self, identity: Identity) -> str | None:
+		if self.config.rotate_on_block and identity.blocked:
+			return 'blocked'
+		if self.config.rotate_after_queries is not None and identity.queries >= self.config.rotate_after_queries:
+			return 'queries'
+		if self.config.rotate_after_seconds is not None and time.time() - identity.created_at >= self.config.rotate_after_seconds:
+			return 'age'
+		return None
+
+	def _in_use(self, identity_id: str) -> bool:
+		"""Whether any process still runs a query on the identity; leases of dead processes on this host are dropped"""
+		leases = os.path.join(self._identity_dir(identity_id), 'leases')
+		try:
+			names = os.listdir(leases)
+		except OSError:
+			return False
+
+		in_use = False
+		for name in names:
+			try:
+				with open(os.path.join(leases, name), encoding='utf-8') as lease_file:
+					lease = json.load(lease_file)
+			except (OSError, ValueError):
+				continue
+			if lease.get('host') == self._host and not _process_alive(lease.get('pid', 0)):
+				with suppress(OSError):
+					os.remove(os.path.join(leases, name))
+				continue
+			in_use = True
+		return in_use
+
+	def _remove_retired(self, current: Identity) -> None:
+		"""Delete every identity but the current one that no query uses any more, including ones left by crashed processes"""
+		with suppress(OSError):
+			for identity_id in os.listdir(self._identities_dir):
+				if identity_id != current.id and not self._in_use(identity_id):
+					self._free_slots.pop(identity_id, None)
+					shutil.rmtree(self._identity_dir(identity_id), ignore_errors=True)
+
+	def _current_identity(self) -> Identity:
+		identity = self._read_identity()
+		reason = self._expired(identity) if identity else 'new'
+		if identity and not reason:
+			return identity
+
+		identity = Identity(id=uuid.uuid4().hex[:12], user_agent=random.choice(self.user_agents), viewport=random.choice(self.viewports), created_at=time.time())
+		os.makedirs(self._identity_dir(identity), exist_ok=True)
+		self._write_identity(identity)
+		count('browser_identities')
+		logger.info('Browser identity %s started (%s)', identity.id, reason)
+
+		# Retired identities still in use are deleted by the last of their queries, in _return_slot
+		self._remove_retired(identity)
+		return identity
+
+	def current_identity(self) -> Identity:
+		"""The identity to use for the next query, rotated first when it is due"""
+		with self._locked():
+			return self._current_identity()
+
+	def _update_identity(self, identity: Identity, **changes) -> None:
+		with self._locked():
+			stored = self._read_identity()
+			if stored is None or stored.id != identity.id:
+				return
+			for name, value in changes.items():
+				setattr(stored, name, value(stored) if callable(value) else value)
+			self._write_identity(stored)
+
+	def _checkout_slot(self) -> tuple[Identity, str, bool]:
+		"""The current identity and a profile slot of it, leased so no other process deletes the identity meanwhile"""
+		with self._locked():
+			identity = self._current_identity()
+			free = self._free_slots.get(identity.id)
+			if free:
+				slot, created = free.pop(), False
+			else:
+				self._slot_count += 1
+				slot, created = os.path.join(self._identity_dir(identity), 'profiles', f'{self._slot_owner}-{self._slot_count}'), True
+				os.makedirs(slot, exist_ok=True)
+
+			lease = self._lease_file(identity, slot)
+			os.makedirs(os.path.dirname(lease), exist_ok=True)
+			with open(lease, 'w', encoding='utf-8') as lease_file:
+				json.dump({'host': self._host, 'pid': os.getpid()}, lease_file)
+		return identity, slot, created
+
+	def _return_slot(self, identity: Identity, slot: str) -> None:
+		with self._locked():
+			with suppress(OSError):
+				os.remove(self._lease_file(identity, slot))
+
+			stored = self._read_identity()
+			if stored is not None and stored.id == identity.id:
+				self._free_slots.setdefault(identity.id, []).append(slot)
+				return
+
+			self._free_slots.pop(identity.id, None)
+			if self._in_use(identity.id):
+				shutil.rmtree(slot, ignore_errors=True)
+				return
+			shutil.rmtree(self._identity_dir(identity), ignore_errors=True)
+
+	@contextmanager
+	def context(self, browser_type: 'BrowserType', headless: bool, args: list[str]) -> Generator[tuple['BrowserContext', Identity], None, None]:
+		"""A browser context on a persistent profile of the current identity, seeded with its saved cookies when the profile is new"""
+		identity, slot, created = self._checkout_slot()
+		try:
+			context = browser_type.launch_persistent_context(
+				slot,
+				headless=headless,
+				args=[*args, f'--disk-cache-size={self.config.cache_size_mb * 1024 * 1024}'],
+				user_agent=identity.user_agent,
+				viewport={'width': identity.viewport['width'], 'height': identity.viewport['height']},
+			)
+			try:
+				state_file = self._storage_state_file(identity)
+				if created and os.path.exists(state_file):
+					with open(state_file, encoding='utf-8') as state:
+						context.add_cookies(json.load(state).get('cookies', []))
+					count('browser_state_restored')
+				yield context, identity
+			finally:
+				context.close()
+		finally:
+			self._return_slot(identity, slot)
+
+	def save_consent(self, context: 'BrowserContext', identity: Identity) -> None:
+		"""Keep the cookies of an accepted consent banner for every later profile of this identity"""
+		context.storage_state(path=self._storage_state_file(identity))
+		self._update_identity(identity, consented=True)
+		count('browser_state_saved')
+
+	def finished_query(self, identity: Identity, blocked: bool) -> None:
+		self._update_identity(identity, queries=lambda stored: stored.queries + 1, blocked=lambda stored: stored.blocked or blocked)
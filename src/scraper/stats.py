@@ -0,0 +1,52 @@
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from src.utils.logger import span
+
+PHASES = ('launch', 'navigation', 'wait', 'extract', 'parse', 'persist')
+
+OUTCOME_OK = 'ok'
+OUTCOME_EMPTY = 'empty'
+OUTCOME_BLOCKED = 'blocked'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_ERROR = 'error'
+OUTCOME_CACHED = 'cached'
+
+# Markers of momondo's bot-check interstitial, which renders without any result cards
+BLOCK_PAGE_MARKERS = ('captcha', 'are you a person', 'é uma pessoa', 'unusual traffic')
+
+
+@dataclass
+class QueryStats:
+	"""Timings (milliseconds per phase) and outcome of one search query"""
+
+	phases: dict[str, float] = field(default_factory=dict)
+	card_count: int = 0
+	flight_count: int = 0
+	outcome: str = OUTCOME_OK
+	error: str | None = None
+
+	@contextmanager
+	def phase(self, name: str) -> Generator[None, None, None]:
+		start = time.perf_counter()
+		try:
+			with span(name):
+				yield
+		finally:
+			self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+	@property
+	def total_ms(self) -> float:
+		return sum(self.phases.values())
+
+
+def looks_blocked(html: str) -> bool:
+	lowered = html.lower()
+	return any(marker in lowered for marker in BLOCK_PAGE_MARKERS)
+
+
+def classify_exception(error: Exception) -> str:
+	# Playwright's TimeoutError does not subclass the builtin one, so match on the name
+	return OUTCOME_TIMEOUT if isinstance(error, TimeoutError) or type(error).__name__ == 'TimeoutError' else OUTCOME_ERROR
@@ -0,0 +1,97 @@
+import csv
+import os
+from datetime import datetime
+
+from src.models.records import FlightRecord
+from src.services.outputs import OUTPUTS_DIR
+
+AGGREGATES_DIR = os.path.join(OUTPUTS_DIR, 'aggregates')
+BEST_DEALS_FILE = 'best_deals.csv'
+PRICE_CALENDAR_FILE = 'price_calendar.csv'
+
+BEST_DEALS_HEADERS = [
+	'departure_airport',
+	'arrival_airport',
+	'departure_date',
+	'return_date',
+	'stay_days',
+	'total_price',
+	'dep_price',
+	'arr_price',
+	'dep_companies',
+	'arr_companies',
+	'trip_duration_days',
+	'source_file',
+]
+
+DealKey = tuple[str, str, str, int]
+
+
+class BestDeals:
+	"""Cheapest round trip per (route, departure date, stay), collected while combination files are written"""
+
+	def __init__(self) -> None:
+		self._deals: dict[DealKey, list] = {}
+
+	def add(self, dep_flights: list[FlightRecord], arr_flights: list[FlightRecord], departure_date: datetime, return_date: datetime, source_file: str) -> None:
+		# The viewer hides self-transfer itineraries, so they never make a best deal either; unpriced legs have no total
+		dep_prices = [(flight.price, flight) for flight in dep_flights if flight.price is not None and not flight.self_transfer]
+		arr_prices = [(flight.price, flight) for flight in arr_flights if flight.price is not None and not flight.self_transfer]
+		if not dep_prices or not arr_prices:
+			return
+
+		# Leg prices are independent, so the cheapest pair is the cheapest outbound plus the cheapest return
+		dep_price, dep_flight = min(dep_prices, key=lambda priced: priced[0])
+		arr_price, arr_flight = min(arr_prices, key=lambda priced: priced[0])
+		stay_days = (return_date - departure_date).days
+
+		key = (dep_flight.departure_airport, dep_flight.arrival_airport, departure_date.strftime('%Y-%m-%d'), stay_days)
+		self._deals[key] = [
+			*key[:3],
+			return_date.strftime('%Y-%m-%d'),
+			stay_days,
+			dep_price + arr_price,
+			dep_price,
+			arr_price,
+			', '.join(dep_flight.companies),
+			', '.join(arr_flight.companies),
+			(arr_flight.departure_at.date() - dep_flight.arrival_at.date()).days,
+			source_file,
+		]
+
+	def _merge_existing(self, path: str) -> dict[DealKey, list]:
+		"""Deals from earlier runs, overridden by this run's keys"""
+		merged: dict[DealKey, list] = {}
+		if os.path.exists(path):
+			with open(path, newline='') as existing:
+				reader = csv.reader(existing)
+				if next(reader, None) == BEST_DEALS_HEADERS:
+					for row in reader:
+						merged[(row[0], row[1], row[2], int(row[4]))] = row
+		merged.update(self._deals)
+		return merged
+
+	def write(self, directory: str = AGGREGATES_DIR) -> None:
+		"""Write best_deals.csv and a departure date x stay length price_calendar.csv"""
+		if not self._deals:
+			return
+
+		os.makedirs(directory, exist_ok=True)
+		best_deals_path = os.path.join(directory, BEST_DEALS_FILE)
+		deals = sorted(self._merge_existing(best_deals_path).values(), key=lambda row: (row[0], row[1], row[2], int(row[4])))
+
+		with open(best_deals_path, 'w', newline='') as off:
+			writer = csv.writer(off)
+			writer.writerow(BEST_DEALS_HEADERS)
+			writer.writerows(deals)
+
+		stays = sorted({int(row[4]) for row in deals})
+		calendar: dict[tuple[str, str, str], dict[int, str]] = {}
+		for row in deals:
+			calendar.setdefault((row[0], row[1], row[2]), {})[int(row[4])] = row[5]
+
+		with open(os.path.join(directory, PRICE_CALENDAR_FILE), 'w', newline='') as off:
+			writer = csv.writer(off)
+			writer.writerow(['departure_airport', 'arrival_airport', 'departure_date', *[f'stay_{stay}' for stay in stays]])
+			for (dep_air, arr_air, departure_date), prices in calendar.items():
+				writer.writerow([dep_air, arr_air, departure_date, *[prices.get(stay, '') for stay in stays]])
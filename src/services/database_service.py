@@ -1,13 +1,42 @@
-from collections.abc import Generator
+import itertools
+import statistics
+from collections.abc import Generator, Iterable, Sequence
 from contextlib import contextmanager
-from datetime import date
+from dataclasses import dataclass, replace
+from datetime import date, datetime, time, timedelta
 from pathlib import Path
 
-from sqlalchemy import Engine, create_engine, func, inspect, select
+from sqlalchemy import Engine, Integer, and_, bindparam, case, cast, create_engine, delete, event, func, insert, inspect, or_, select, tuple_, update
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import Session, aliased, sessionmaker
 
-from src.models.database import Base, Flight
+from src.models.database import (
+	TASK_DONE,
+	TASK_FAILED,
+	TASK_LEASED,
+	TASK_PENDING,
+	Airline,
+	Airport,
+	Base,
+	Flight,
+	FlightAirline,
+	FlightPriceRollup,
+	ScrapeQuery,
+	ScrapeRun,
+	ScrapeTask,
+	TripPrice,
+)
+from src.models.migrations import add_flight_validity_interval, add_scrape_query_constraints, migrate_legacy_flight_table
+from src.models.records import FlightRecord
+from src.scraper.stats import OUTCOME_BLOCKED, OUTCOME_CACHED, OUTCOME_EMPTY, OUTCOME_ERROR, OUTCOME_OK, OUTCOME_TIMEOUT, PHASES, QueryStats
+from src.services.freshness import price_volatility
+from src.utils.logger import percentile
+
+DEPARTURE_AIRPORT = aliased(Airport, name='departure_airport')
+ARRIVAL_AIRPORT = aliased(Airport, name='arrival_airport')
+
+# Seconds a SQLite connection waits for another process's write lock, so several workers can share one database file
+SQLITE_BUSY_TIMEOUT = 30
 
 
 class DatabaseException(Exception):
@@ -16,6 +45,84 @@ class DatabaseException(Exception):
 	pass
 
 
+@dataclass(frozen=True)
+class RetentionPolicy:
+	"""How long to keep history for travel dates that are already in the past (None keeps it forever)"""
+
+	past_travel_days: int | None = 30
+	rollup_past_travel_days: int | None = None
+
+
+@dataclass
+class CompactionResult:
+	merged_rows: int = 0
+	expired_rows: int = 0
+	expired_rollups: int = 0
+
+
+@dataclass
+class RouteLatency:
+	departure_airport: str
+	arrival_airport: str
+	queries: int
+	failures: int
+	p50_ms: float
+	p95_ms: float
+	mean_cards: float
+
+
+@dataclass
+class RouteHistory:
+	last_scraped_at: datetime | None
+	volatility: float | None
+
+
+# (origin, destination, departure date, stay days) of a round trip
+TripKey = tuple[str, str, date, int]
+
+
+@dataclass(frozen=True)
+class TripPriceChange:
+	"""A round trip whose total moved, with the totals before the change"""
+
+	key: TripKey
+	previous_total: float | None
+	lowest_total: float | None
+	total_price: float
+	outbound_price: float
+	return_price: float
+
+
+@dataclass(frozen=True)
+class LeasedTask:
+	"""A queued search claimed by a worker until lease_expires_at, unless heartbeats extend it"""
+
+	id: int
+	plan: str
+	departure_airport: str
+	arrival_airport: str
+	travel_date: date
+	attempts: int
+	lease_expires_at: datetime
+
+
+@dataclass(frozen=True)
+class TripQuery:
+	"""Round-trip search pushed down to SQL; None leaves a predicate out"""
+
+	departure_airport: str | None = None
+	arrival_airport: str | None = None
+	stay_days: tuple[int, ...] = (9, 10, 11)
+	min_total_price: float | None = None
+	max_total_price: float | None = None
+	min_trip_days: int | None = None
+	max_trip_days: int | None = None
+	airlines: tuple[str, ...] = ()
+	self_transfer: bool = False
+	seen_on: date | None = None
+	limit: int | None = 20000
+
+
 class DatabaseService:
 	def __init__(self, database_url: str, echo: bool = True) -> None:
 		self.database_url = database_url
@@ -31,22 +138,16 @@ class DatabaseService:
 		exists = Path(db_path).exists()
 		return exists
 
-	def _tables_exist(self) -> bool:
+	def _missing_tables(self) -> set[str]:
+		required_tables = set(Base.metadata.tables.keys())
 		try:
 			if not self._engine:
-				return False
+				return required_tables
 
 			inspector = inspect(self._engine)
-			existing_tables = inspector.get_table_names()
-
-			required_tables = set(Base.metadata.tables.keys())
-			existing_tables_set = set(existing_tables)
-
-			missing_tables = required_tables - existing_tables_set
-
-			return bool(not missing_tables)
+			return required_tables - set(inspector.get_table_names())
 		except Exception:
-			return False
+			return required_tables
 
 	def _initialize_database(self) -> None:
 		try:
@@ -57,21 +158,41 @@ class DatabaseService:
 				echo=self.echo,
 				pool_pre_ping=True,
 				pool_recycle=3600,
+				connect_args={'timeout': SQLITE_BUSY_TIMEOUT} if self.database_url.startswith('sqlite') else {},
 			)
 
+			if self.database_url.startswith('sqlite'):
+				event.listen(self._engine, 'connect', self._enable_sqlite_foreign_keys)
+
 			self._session_factory = sessionmaker(
 				autocommit=False,
 				autoflush=False,
 				bind=self._engine,
 			)
 
-			if db_exists and self._tables_exist():
+			migrated = migrate_legacy_flight_table(self._engine) if db_exists else 0
+			if db_exists:
+				add_flight_validity_interval(self._engine)
+				add_scrape_query_constraints(self._engine)
+
+			missing_tables = self._missing_tables()
+			if db_exists and not missing_tables and not migrated:
 				return
 
+			# Upgrades only add the tables that are new; rollups are rebuilt when their table is new or the legs were just migrated
 			Base.metadata.create_all(self._engine)
+
+			if db_exists and (migrated or FlightPriceRollup.__tablename__ in missing_tables):
+				self.rebuild_price_rollups()
 		except SQLAlchemyError as e:
 			raise DatabaseException(f'Database initialization failed: {e}') from e
 
+	@staticmethod
+	def _enable_sqlite_foreign_keys(dbapi_connection, connection_record) -> None:
+		cursor = dbapi_connection.cursor()
+		cursor.execute('PRAGMA foreign_keys=ON')
+		cursor.close()
+
 	@contextmanager
 	def get_session(self) -> Generator[Session, None, None]:
 		if not self._session_factory:
@@ -96,78 +217,892 @@ class DatabaseService:
 		except Exception:
 			return False
 
-	def get_search_by_date(self, target_date: date) -> list[Flight]:
+	def _select_records(self, session: Session, *criteria) -> list[FlightRecord]:
+		"""Core-level read of legs matching criteria, returned as FlightRecord instead of ORM instances"""
+		stmt = (
+			select(
+				Flight.id,
+				Flight.search_date,
+				DEPARTURE_AIRPORT.code,
+				ARRIVAL_AIRPORT.code,
+				Flight.departure_at,
+				Flight.arrival_at,
+				Flight.price,
+				Flight.duration_minutes,
+				Flight.stops,
+				Flight.self_transfer,
+			)
+			.join(DEPARTURE_AIRPORT, Flight.departure_airport_id == DEPARTURE_AIRPORT.id)
+			.join(ARRIVAL_AIRPORT, Flight.arrival_airport_id == ARRIVAL_AIRPORT.id)
+			.where(*criteria)
+		)
+		rows = session.execute(stmt).all()
+		if not rows:
+			return []
+
+		links = (
+			select(FlightAirline.flight_id, Airline.name)
+			.join(Airline, FlightAirline.airline_id == Airline.id)
+			.where(FlightAirline.flight_id.in_(stmt.with_only_columns(Flight.id)))
+			.order_by(FlightAirline.flight_id, FlightAirline.position)
+		)
+		companies: dict[int, list[str]] = {}
+		for flight_id, name in session.execute(links):
+			companies.setdefault(flight_id, []).append(name)
+
+		return [
+			FlightRecord(
+				id=flight_id,
+				search_date=search_date,
+				departure_airport=departure_airport,
+				arrival_airport=arrival_airport,
+				departure_at=departure_at,
+				arrival_at=arrival_at,
+				price=price,
+				duration_minutes=duration_minutes,
+				stops=stops or 0,
+				self_transfer=bool(self_transfer),
+				companies=tuple(companies.get(flight_id, ())),
+			)
+			for flight_id, search_date, departure_airport, arrival_airport, departure_at, arrival_at, price, duration_minutes, stops, self_transfer in rows
+		]
+
+	def get_search_by_date(self, target_date: date) -> list[FlightRecord]:
 		try:
 			with self.get_session() as session:
-				stmt = select(Flight).where(func.date(Flight.search_date) == target_date)
-				result = session.execute(stmt).scalars().all()
-
-				session.expunge_all()
-				return list(result)
+				return self._select_records(session, Flight.seen_on(target_date))
 		except SQLAlchemyError as e:
 			raise DatabaseException(f'Failed to retrieve result for {target_date}: {e}') from e
 
-	def get_flight_from_to_date(self, dep_air: str, arr_air: str, dep_dt: date, search_date: date) -> list[Flight]:
+	def get_flight_from_to_date(self, dep_air: str, arr_air: str, dep_dt: date, search_date: date, airlines: list[str] | None = None) -> list[FlightRecord]:
+		"""Legs of a route departing on dep_dt, optionally restricted to legs operated by any of the given airlines"""
+		criteria = [
+			DEPARTURE_AIRPORT.code == dep_air,
+			ARRIVAL_AIRPORT.code == arr_air,
+			Flight.by_departure_date(dep_dt),
+			Flight.seen_on(search_date),
+		]
+
+		if airlines:
+			airline_ids = select(Airline.id).where(Airline.name.in_(airlines))
+			criteria.append(Flight.id.in_(select(FlightAirline.flight_id).where(FlightAirline.airline_id.in_(airline_ids))))
+
 		try:
 			with self.get_session() as session:
-				stmt = select(Flight).where(
-					func.date(Flight.departure_date == dep_dt),
-					func.date(Flight.search_date == search_date),
-					Flight.departure_airport == dep_air,
-					Flight.arrival_airport == arr_air,
-				)
-				results = session.execute(stmt).scalars().all()
-
-				return list(results)
+				return self._select_records(session, *criteria)
 		except SQLAlchemyError as e:
 			raise DatabaseException(f'Failed to retrieve results: {e}') from e
 
-	def flight_exists(self, flight: Flight) -> bool:
+	def flight_exists(self, flight: FlightRecord) -> bool:
 		"""Check if a flight with the same unique fields already exists in the database"""
 		try:
 			with self.get_session() as session:
-				stmt = select(Flight).where(
-					Flight.search_date == flight.search_date,
-					Flight.arrival_airport == flight.arrival_airport,
-					Flight.departure_airport == flight.departure_airport,
-					Flight.departure_date == flight.departure_date,
-					Flight.arrival_date == flight.arrival_date,
-					Flight.departure_time == flight.departure_time,
-					Flight.arrival_time == flight.arrival_time,
-					Flight.total_hours == flight.total_hours,
-					Flight.companies == flight.companies,
-					Flight.connections == flight.connections,
+				stmt = select(Flight.id).where(
+					Flight.fingerprint == flight.fingerprint(),
+					Flight.seen_on(flight.search_date),
 				)
 				result = session.execute(stmt).first()
 				return result is not None
 		except SQLAlchemyError as e:
 			raise DatabaseException(f'Failed to check if flight exists: {e}') from e
 
-	def save_flights(self, flights: list[Flight]) -> None:
-		"""Save a list of flights to the database"""
+	def _intern_dimensions(self, session: Session, flights: Sequence[FlightRecord]) -> tuple[dict[str, int], dict[str, int]]:
+		"""Ids of the airports and airlines the flights refer to, inserting the ones not seen before"""
+		codes = {flight.departure_airport for flight in flights} | {flight.arrival_airport for flight in flights}
+		names = {name for flight in flights for name in flight.companies}
+
+		airports = {code: id_ for code, id_ in session.execute(select(Airport.code, Airport.id).where(Airport.code.in_(codes)))}
+		missing_codes = sorted(codes - airports.keys())
+		if missing_codes:
+			stmt = insert(Airport).returning(Airport.code, Airport.id, sort_by_parameter_order=True)
+			airports.update({code: id_ for code, id_ in session.execute(stmt, [{'code': code} for code in missing_codes])})
+
+		airlines = {name: id_ for name, id_ in session.execute(select(Airline.name, Airline.id).where(Airline.name.in_(names)))}
+		missing_names = sorted(names - airlines.keys())
+		if missing_names:
+			stmt = insert(Airline).returning(Airline.name, Airline.id, sort_by_parameter_order=True)
+			airlines.update({name: id_ for name, id_ in session.execute(stmt, [{'name': name} for name in missing_names])})
+
+		return airports, airlines
+
+	def save_flights(self, flights: Sequence[FlightRecord]) -> None:
+		"""Save a list of flights to the database
+
+		Rows are written with bulk Core inserts straight from the records, with no ORM object per leg.
+		"""
 		if not flights:
 			return
 
 		try:
 			with self.get_session() as session:
-				session.add_all(flights)
+				self._insert_flights(session, flights)
 		except IntegrityError as e:
 			raise DatabaseException(f'Duplicate flight data: {e}') from e
 		except SQLAlchemyError as e:
 			raise DatabaseException(f'Failed to save flights: {e}') from e
 
-	def save_unique_flights(self, flights: list[Flight]) -> None:
-		"""Save only unique flights to the database, returning count of flights saved"""
+	def _insert_flights(self, session: Session, flights: Sequence[FlightRecord], last_seen: Sequence[date] | None = None) -> None:
+		"""Bulk insert legs, each valid up to its last_seen day (its own search date unless given) and refresh their rollups"""
+		airports, airlines = self._intern_dimensions(session, flights)
+		rows = [
+			{
+				'search_date': flight.search_date,
+				'departure_airport_id': airports[flight.departure_airport],
+				'arrival_airport_id': airports[flight.arrival_airport],
+				'departure_at': flight.departure_at,
+				'arrival_at': flight.arrival_at,
+				'price': flight.price,
+				'duration_minutes': flight.duration_minutes,
+				'stops': flight.stops,
+				'self_transfer': flight.self_transfer,
+				'fingerprint': flight.fingerprint(),
+				'last_seen': seen_until,
+			}
+			for flight, seen_until in zip(flights, last_seen or [flight.search_date for flight in flights], strict=True)
+		]
+		stmt = insert(Flight).returning(Flight.id, sort_by_parameter_order=True)
+		flight_ids = session.scalars(stmt, rows).all()
+
+		links = [
+			{'flight_id': flight_id, 'position': position, 'airline_id': airlines[name]}
+			for flight_id, flight in zip(flight_ids, flights, strict=True)
+			for position, name in enumerate(flight.companies)
+		]
+		if links:
+			session.execute(insert(FlightAirline), links)
+
+		rollup_keys = {(airports[flight.departure_airport], airports[flight.arrival_airport], flight.departure_at.date(), flight.search_date) for flight in flights}
+		self._refresh_price_rollups(session, rollup_keys)
+
+	def save_unique_flights(self, flights: Sequence[FlightRecord], update_prices: bool = False) -> None:
+		"""Save only flights not stored yet for their search date, looked up through the route index
+
+		The fingerprint leaves the price out, so a leg scraped again on a day a stored row is valid for, compacted intervals
+		included, is a duplicate; update_prices makes such a re-scrape overwrite the stored price with the newer one instead
+		of dropping it, splitting a compacted interval around that day.
+		"""
 		if not flights:
 			return
 
-		unique_flights = []
+		by_day: dict[date, dict[int, FlightRecord]] = {}
 		for flight in flights:
-			if not self.flight_exists(flight):
-				unique_flights.append(flight)
+			by_day.setdefault(flight.search_date, {}).setdefault(flight.fingerprint(), flight)
+
+		try:
+			with self.get_session() as session:
+				for search_date, candidates in sorted(by_day.items()):
+					self._save_unique_day(session, search_date, candidates, update_prices)
+		except IntegrityError as e:
+			raise DatabaseException(f'Duplicate flight data: {e}') from e
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to save flights: {e}') from e
+
+	def _save_unique_day(self, session: Session, search_date: date, candidates: dict[int, FlightRecord], update_prices: bool) -> None:
+		"""save_unique_flights for the legs of one search date, keyed by fingerprint, so each stored interval is split at most once"""
+		codes = {flight.departure_airport for flight in candidates.values()} | {flight.arrival_airport for flight in candidates.values()}
+		airports = {code: id_ for code, id_ in session.execute(select(Airport.code, Airport.id).where(Airport.code.in_(codes)))}
+		routes = {
+			(airports[flight.departure_airport], airports[flight.arrival_airport], flight.departure_at)
+			for flight in candidates.values()
+			if flight.departure_airport in airports and flight.arrival_airport in airports
+		}
+
+		existing = {}
+		if routes:
+			stmt = select(Flight.id, Flight.fingerprint, Flight.search_date, Flight.last_seen, Flight.price, Flight.departure_airport_id, Flight.arrival_airport_id, Flight.departure_at).where(
+				tuple_(Flight.departure_airport_id, Flight.arrival_airport_id, Flight.departure_at).in_(list(routes)),
+				Flight.fingerprint.in_(list(candidates)),
+				Flight.seen_on(search_date),
+			)
+			existing = {row.fingerprint: row for row in session.execute(stmt)}
+
+		new_legs = [flight for fingerprint, flight in candidates.items() if fingerprint not in existing]
+		new_last_seen = [search_date] * len(new_legs)
+
+		if update_prices:
+			day = timedelta(days=1)
+			repriced = [(row, candidates[fingerprint]) for fingerprint, row in existing.items() if candidates[fingerprint].price != row.price]
+
+			# A single-day row takes the new price; an interval loses the repriced day, with what comes after it stored again at the old price
+			updates = []
+			rollup_keys = set()
+			for row, flight in repriced:
+				if row.search_date == row.last_seen:
+					updates.append({'id': row.id, 'price': flight.price})
+					rollup_keys.add((row.departure_airport_id, row.arrival_airport_id, row.departure_at.date(), search_date))
+					continue
+				if row.search_date == search_date:
+					updates.append({'id': row.id, 'search_date': search_date + day})
+				else:
+					updates.append({'id': row.id, 'last_seen': search_date - day})
+					if search_date < row.last_seen:
+						new_legs.append(replace(flight, search_date=search_date + day, price=row.price))
+						new_last_seen.append(row.last_seen)
+				new_legs.append(flight)
+				new_last_seen.append(search_date)
+			if updates:
+				session.execute(update(Flight), updates)
+				self._refresh_price_rollups(session, rollup_keys)
+		if new_legs:
+			self._insert_flights(session, new_legs, new_last_seen)
+
+	@staticmethod
+	def _rollup_row(key: tuple[int, int, date, date], prices: list[float], durations: list[int]) -> dict:
+		departure_airport_id, arrival_airport_id, travel_date, search_date = key
+		return {
+			'departure_airport_id': departure_airport_id,
+			'arrival_airport_id': arrival_airport_id,
+			'travel_date': travel_date,
+			'search_date': search_date,
+			'min_price': min(prices) if prices else None,
+			'median_price': statistics.median(prices) if prices else None,
+			'min_duration_minutes': min(durations) if durations else None,
+			'offer_count': len(prices),
+		}
+
+	def _refresh_price_rollups(self, session: Session, keys: Iterable[tuple[int, int, date, date]]) -> None:
+		"""Recompute the rollups touched by a save, reading only their legs through the route index
+
+		Legs count on every day of their validity interval, the same as in rebuild_price_rollups.
+		"""
+		for key in keys:
+			departure_airport_id, arrival_airport_id, travel_date, search_date = key
+			stmt = select(Flight.price, Flight.duration_minutes).where(
+				Flight.departure_airport_id == departure_airport_id,
+				Flight.arrival_airport_id == arrival_airport_id,
+				Flight.by_departure_date(travel_date),
+				Flight.seen_on(search_date),
+			)
+			rows = session.execute(stmt).all()
+
+			prices = [price for price, _ in rows if price is not None]
+			durations = [duration for _, duration in rows if duration is not None]
+			session.merge(FlightPriceRollup(**self._rollup_row(key, prices, durations)))
+
+	def rebuild_price_rollups(self, batch_size: int = 5000) -> None:
+		"""Recompute the rollups of every stored leg in one ordered pass
+
+		A compacted leg counts on every search day of its validity interval. Rollups whose legs are gone (kept past the leg
+		retention by RetentionPolicy.rollup_past_travel_days) are left as they are.
+		"""
+		try:
+			with self.get_session() as session:
+				stmt = (
+					select(
+						Flight.departure_airport_id,
+						Flight.arrival_airport_id,
+						Flight.search_date,
+						Flight.last_seen,
+						Flight.departure_at,
+						Flight.price,
+						Flight.duration_minutes,
+					)
+					.order_by(Flight.departure_airport_id, Flight.arrival_airport_id, Flight.departure_at)
+					.execution_options(yield_per=batch_size)
+				)
+
+				rows: list[dict] = []
+
+				def flush() -> None:
+					keys = [(row['departure_airport_id'], row['arrival_airport_id'], row['travel_date'], row['search_date']) for row in rows]
+					session.execute(
+						delete(FlightPriceRollup).where(
+							tuple_(FlightPriceRollup.departure_airport_id, FlightPriceRollup.arrival_airport_id, FlightPriceRollup.travel_date, FlightPriceRollup.search_date).in_(keys)
+						)
+					)
+					session.execute(insert(FlightPriceRollup), rows)
+					rows.clear()
+
+				grouped = itertools.groupby(session.execute(stmt), key=lambda row: (row.departure_airport_id, row.arrival_airport_id, row.departure_at.date()))
+				for (departure_airport_id, arrival_airport_id, travel_date), legs in grouped:
+					by_search_date: dict[date, list] = {}
+					for leg in legs:
+						for offset in range((leg.last_seen - leg.search_date).days + 1):
+							by_search_date.setdefault(leg.search_date + timedelta(days=offset), []).append(leg)
+
+					for search_date, seen in sorted(by_search_date.items()):
+						prices = [leg.price for leg in seen if leg.price is not None]
+						durations = [leg.duration_minutes for leg in seen if leg.duration_minutes is not None]
+						rows.append(self._rollup_row((departure_airport_id, arrival_airport_id, travel_date, search_date), prices, durations))
+
+					if len(rows) >= batch_size:
+						flush()
+
+				if rows:
+					flush()
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to rebuild price rollups: {e}') from e
+
+	def _route_rollups(self, dep_air: str, arr_air: str):
+		return (
+			select(FlightPriceRollup)
+			.join(DEPARTURE_AIRPORT, FlightPriceRollup.departure_airport_id == DEPARTURE_AIRPORT.id)
+			.join(ARRIVAL_AIRPORT, FlightPriceRollup.arrival_airport_id == ARRIVAL_AIRPORT.id)
+			.where(DEPARTURE_AIRPORT.code == dep_air, ARRIVAL_AIRPORT.code == arr_air)
+		)
+
+	def get_price_history(self, dep_air: str, arr_air: str, travel_date: date) -> list[FlightPriceRollup]:
+		"""How the price of a route on a travel date moved across scrapes, oldest first"""
+		try:
+			with self.get_session() as session:
+				stmt = self._route_rollups(dep_air, arr_air).where(FlightPriceRollup.travel_date == travel_date).order_by(FlightPriceRollup.search_date)
+				results = session.execute(stmt).scalars().all()
+
+				session.expunge_all()
+				return list(results)
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to retrieve price history: {e}') from e
+
+	def get_price_calendar(self, dep_air: str, arr_air: str, first_travel_date: date, last_travel_date: date) -> dict[date, dict[date, float | None]]:
+		"""Cheapest price per travel date (rows) and search date (columns) for a route"""
+		try:
+			with self.get_session() as session:
+				stmt = (
+					self._route_rollups(dep_air, arr_air)
+					.where(FlightPriceRollup.travel_date.between(first_travel_date, last_travel_date))
+					.order_by(FlightPriceRollup.travel_date, FlightPriceRollup.search_date)
+				)
+
+				calendar: dict[date, dict[date, float | None]] = {}
+				for rollup in session.execute(stmt).scalars():
+					calendar.setdefault(rollup.travel_date, {})[rollup.search_date] = rollup.min_price
+
+				return calendar
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to retrieve price calendar: {e}') from e
+
+	def _merge_unchanged_offers(self, session: Session, batch_size: int) -> int:
+		"""Collapse back-to-back observations of a leg at an unchanged price into the first row's validity interval
+
+		A run only continues while each observation starts at most a day after the run was last seen, so a leg missing from
+		the scrapes in between is not made to look offered on the days it was not seen.
+		"""
+		stmt = select(Flight.id, Flight.fingerprint, Flight.search_date, Flight.last_seen, Flight.price).order_by(Flight.fingerprint, Flight.search_date).execution_options(yield_per=batch_size)
+
+		extensions: list[dict] = []
+		redundant: list[int] = []
+
+		def flush() -> None:
+			if extensions:
+				session.execute(update(Flight), extensions)
+				extensions.clear()
+			if redundant:
+				session.execute(delete(Flight).where(Flight.id.in_(redundant)))
+				redundant.clear()
+
+		merged = 0
+		for _, observations in itertools.groupby(session.execute(stmt), key=lambda row: row.fingerprint):
+			# Each run is [first row, last day seen, rows folded into it]
+			runs: list[list] = []
+			for row in observations:
+				run = runs[-1] if runs else None
+				if run and row.price == run[0].price and row.search_date <= run[1] + timedelta(days=1):
+					run[1] = max(run[1], row.last_seen)
+					run[2].append(row.id)
+				else:
+					runs.append([row, row.last_seen, []])
+
+			for first, last_seen, repeats in runs:
+				if not repeats:
+					continue
+				if last_seen != first.last_seen:
+					extensions.append({'id': first.id, 'last_seen': last_seen})
+				redundant.extend(repeats)
+				merged += len(repeats)
+
+			if len(redundant) >= batch_size:
+				flush()
+
+		flush()
+		return merged
+
+	def compact_history(self, policy: RetentionPolicy | None = None, vacuum: bool = True, batch_size: int = 5000) -> CompactionResult:
+		"""Merge unchanged offers into validity intervals, drop history past the retention policy and reclaim space"""
+		policy = policy or RetentionPolicy()
+		result = CompactionResult()
+		today = date.today()
+
+		try:
+			with self.get_session() as session:
+				result.merged_rows = self._merge_unchanged_offers(session, batch_size)
+
+				if policy.past_travel_days is not None:
+					cutoff = datetime.combine(today - timedelta(days=policy.past_travel_days), time.min)
+					result.expired_rows = session.execute(delete(Flight).where(Flight.departure_at < cutoff)).rowcount
+					session.execute(delete(TripPrice).where(TripPrice.departure_date < cutoff.date()))
+
+				if policy.rollup_past_travel_days is not None:
+					rollup_cutoff = today - timedelta(days=policy.rollup_past_travel_days)
+					result.expired_rollups = session.execute(delete(FlightPriceRollup).where(FlightPriceRollup.travel_date < rollup_cutoff)).rowcount
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to compact flight history: {e}') from e
+
+		if vacuum:
+			self.vacuum()
+
+		return result
+
+	def vacuum(self) -> None:
+		"""Rebuild the database file and refresh planner statistics"""
+		if not self._engine:
+			raise DatabaseException('Database not initialized')
+
+		try:
+			with self._engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+				if self._engine.dialect.name == 'sqlite':
+					conn.exec_driver_sql('VACUUM')
+				conn.exec_driver_sql('ANALYZE')
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to vacuum database: {e}') from e
+
+	def start_scrape_run(self) -> int:
+		try:
+			with self.get_session() as session:
+				run = ScrapeRun(started_at=datetime.now(), status='running')
+				session.add(run)
+				session.flush()
+				return run.id
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to start scrape run: {e}') from e
+
+	def finish_scrape_run(self, run_id: int, status: str = 'finished') -> None:
+		try:
+			with self.get_session() as session:
+				query_count = session.scalar(select(func.count()).select_from(ScrapeQuery).where(ScrapeQuery.run_id == run_id))
+				session.execute(update(ScrapeRun).where(ScrapeRun.id == run_id).values(finished_at=datetime.now(), status=status, query_count=query_count or 0))
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to finish scrape run {run_id}: {e}') from e
+
+	def record_scrape_query(
+		self,
+		run_id: int,
+		dep_air: str,
+		arr_air: str,
+		travel_date: date,
+		started_at: datetime,
+		stats: QueryStats,
+		constraints: str | None = None,
+	) -> None:
+		try:
+			with self.get_session() as session:
+				session.add(
+					ScrapeQuery(
+						run_id=run_id,
+						departure_airport=dep_air,
+						arrival_airport=arr_air,
+						travel_date=travel_date,
+						started_at=started_at,
+						total_ms=stats.total_ms,
+						card_count=stats.card_count,
+						flight_count=stats.flight_count,
+						outcome=stats.outcome,
+						error=stats.error,
+						constraints=constraints,
+						**{f'{phase}_ms': stats.phases.get(phase) for phase in PHASES},
+					)
+				)
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to record scrape query: {e}') from e
+
+	def get_scrape_constraints(self, dep_air: str, arr_air: str, travel_date: date, search_date: date) -> set[str | None]:
+		"""Constraint keys of the searches that fetched a route and travel date on a search date (None for unrecorded ones)"""
+		start = datetime.combine(search_date, time.min)
+		stmt = (
+			select(ScrapeQuery.constraints)
+			.where(
+				ScrapeQuery.departure_airport == dep_air,
+				ScrapeQuery.arrival_airport == arr_air,
+				ScrapeQuery.started_at >= start,
+				ScrapeQuery.started_at < start + timedelta(days=1),
+				ScrapeQuery.travel_date == travel_date,
+				ScrapeQuery.outcome.in_([OUTCOME_OK, OUTCOME_EMPTY]),
+			)
+			.distinct()
+		)
+
+		try:
+			with self.get_session() as session:
+				return set(session.scalars(stmt))
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to read scrape constraints: {e}') from e
+
+	def get_scrape_latency_summary(self, since: datetime | None = None, outcomes: list[str] | None = None) -> list[RouteLatency]:
+		"""p50/p95 end-to-end query latency per route, over queries that actually hit the network"""
+		failure_outcomes = {OUTCOME_BLOCKED, OUTCOME_ERROR, OUTCOME_TIMEOUT}
+		stmt = select(ScrapeQuery.departure_airport, ScrapeQuery.arrival_airport, ScrapeQuery.total_ms, ScrapeQuery.card_count, ScrapeQuery.outcome).order_by(
+			ScrapeQuery.departure_airport, ScrapeQuery.arrival_airport
+		)
+		if since is not None:
+			stmt = stmt.where(ScrapeQuery.started_at >= since)
+		stmt = stmt.where(ScrapeQuery.outcome.in_(outcomes)) if outcomes else stmt.where(ScrapeQuery.outcome != OUTCOME_CACHED)
+
+		try:
+			with self.get_session() as session:
+				rows = session.execute(stmt).all()
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to summarize scrape latency: {e}') from e
+
+		summary = []
+		for (dep_air, arr_air), queries in itertools.groupby(rows, key=lambda row: (row.departure_airport, row.arrival_airport)):
+			queries_list = list(queries)
+			latencies = sorted(query.total_ms for query in queries_list)
+			summary.append(
+				RouteLatency(
+					departure_airport=dep_air,
+					arrival_airport=arr_air,
+					queries=len(queries_list),
+					failures=sum(1 for query in queries_list if query.outcome in failure_outcomes),
+					p50_ms=percentile(latencies, 0.50),
+					p95_ms=percentile(latencies, 0.95),
+					mean_cards=statistics.fmean(query.card_count for query in queries_list),
+				)
+			)
+
+		return summary
+
+	def enqueue_scrape_tasks(self, plan: str, tasks: Iterable[tuple[str, str, date]]) -> int:
+		"""Queue the plan's (origin, destination, travel date) searches that are not queued yet, returning how many were added"""
+		wanted = set(tasks)
+		try:
+			with self.get_session() as session:
+				stmt = select(ScrapeTask.departure_airport, ScrapeTask.arrival_airport, ScrapeTask.travel_date).where(ScrapeTask.plan == plan)
+				queued = {tuple(row) for row in session.execute(stmt)}
+				created_at = datetime.now()
+				rows = [
+					{'plan': plan, 'departure_airport': dep_air, 'arrival_airport': arr_air, 'travel_date': travel_date, 'status': TASK_PENDING, 'attempts': 0, 'created_at': created_at}
+					for dep_air, arr_air, travel_date in sorted(wanted - queued)
+				]
+				if rows:
+					session.execute(insert(ScrapeTask), rows)
+				return len(rows)
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to enqueue scrape tasks for {plan}: {e}') from e
+
+	@staticmethod
+	def _claimable(plan: str, now: datetime, max_attempts: int):
+		return and_(
+			ScrapeTask.plan == plan,
+			ScrapeTask.attempts < max_attempts,
+			or_(ScrapeTask.status == TASK_PENDING, and_(ScrapeTask.status == TASK_LEASED, ScrapeTask.lease_expires_at < now)),
+		)
+
+	def claim_scrape_task(self, plan: str, worker_id: str, lease: timedelta, max_attempts: int = 3, retries: int = 5) -> LeasedTask | None:
+		"""Lease the earliest claimable task of a plan: pending, or leased by a worker whose lease expired"""
+		for _ in range(retries):
+			now = datetime.now()
+			claimable = self._claimable(plan, now, max_attempts)
+			try:
+				with self.get_session() as session:
+					# Tasks whose workers kept dying on them are given up instead of being leased forever
+					session.execute(
+						update(ScrapeTask)
+						.where(ScrapeTask.plan == plan, ScrapeTask.status == TASK_LEASED, ScrapeTask.lease_expires_at < now, ScrapeTask.attempts >= max_attempts)
+						.values(status=TASK_FAILED, error='Lease expired on the last attempt', finished_at=now)
+					)
+					task = session.execute(
+						select(ScrapeTask.id, ScrapeTask.departure_airport, ScrapeTask.arrival_airport, ScrapeTask.travel_date, ScrapeTask.attempts)
+						.where(claimable)
+						.order_by(ScrapeTask.travel_date, ScrapeTask.id)
+						.limit(1)
+					).first()
+					if task is None:
+						return None
+
+					# Compare-and-set: repeating the claimable predicate lets only one of several racing workers win the task
+					claimed = session.execute(
+						update(ScrapeTask)
+						.where(ScrapeTask.id == task.id, claimable)
+						.values(status=TASK_LEASED, lease_owner=worker_id, lease_expires_at=now + lease, heartbeat_at=now, attempts=ScrapeTask.attempts + 1)
+					).rowcount
+			except SQLAlchemyError as e:
+				raise DatabaseException(f'Failed to claim a scrape task of {plan}: {e}') from e
+
+			if claimed:
+				return LeasedTask(
+					id=task.id,
+					plan=plan,
+					departure_airport=task.departure_airport,
+					arrival_airport=task.arrival_airport,
+					travel_date=task.travel_date,
+					attempts=task.attempts + 1,
+					lease_expires_at=now + lease,
+				)
+
+		return None
+
+	def _update_leased_task(self, task_id: int, worker_id: str, **values) -> bool:
+		"""Update a task only while worker_id still holds its lease; False means the lease expired and was taken over"""
+		try:
+			with self.get_session() as session:
+				stmt = update(ScrapeTask).where(ScrapeTask.id == task_id, ScrapeTask.status == TASK_LEASED, ScrapeTask.lease_owner == worker_id).values(**values)
+				return session.execute(stmt).rowcount == 1
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to update scrape task {task_id}: {e}') from e
 
-		if unique_flights:
-			self.save_flights(unique_flights)
+	def heartbeat_scrape_task(self, task_id: int, worker_id: str, lease: timedelta) -> bool:
+		now = datetime.now()
+		return self._update_leased_task(task_id, worker_id, heartbeat_at=now, lease_expires_at=now + lease)
+
+	def complete_scrape_task(self, task_id: int, worker_id: str, outcome: str) -> bool:
+		return self._update_leased_task(task_id, worker_id, status=TASK_DONE, outcome=outcome, finished_at=datetime.now(), lease_expires_at=None)
+
+	def fail_scrape_task(self, task_id: int, worker_id: str, error: str, outcome: str, retry: bool = True) -> bool:
+		"""Give a task back to the queue for another attempt, or mark it failed for good"""
+		if retry:
+			return self._update_leased_task(task_id, worker_id, status=TASK_PENDING, outcome=outcome, error=error, lease_owner=None, lease_expires_at=None)
+		return self._update_leased_task(task_id, worker_id, status=TASK_FAILED, outcome=outcome, error=error, finished_at=datetime.now(), lease_expires_at=None)
+
+	def get_scrape_task_counts(self, plan: str) -> dict[str, int]:
+		"""Tasks of a plan per status"""
+		stmt = select(ScrapeTask.status, func.count()).where(ScrapeTask.plan == plan).group_by(ScrapeTask.status)
+		try:
+			with self.get_session() as session:
+				counts = dict.fromkeys((TASK_PENDING, TASK_LEASED, TASK_DONE, TASK_FAILED), 0)
+				counts.update({status: task_count for status, task_count in session.execute(stmt)})
+				return counts
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to count scrape tasks of {plan}: {e}') from e
+
+	def get_route_history(self, first_travel_date: date) -> dict[tuple[str, str, date], RouteHistory]:
+		"""When each (origin, destination, travel date) was last fetched from momondo and how much its cheapest price moves"""
+		queries = (
+			select(ScrapeQuery.departure_airport, ScrapeQuery.arrival_airport, ScrapeQuery.travel_date, func.max(ScrapeQuery.started_at))
+			.where(ScrapeQuery.outcome.in_([OUTCOME_OK, OUTCOME_EMPTY]), ScrapeQuery.travel_date >= first_travel_date)
+			.group_by(ScrapeQuery.departure_airport, ScrapeQuery.arrival_airport, ScrapeQuery.travel_date)
+		)
+		rollups = (
+			select(DEPARTURE_AIRPORT.code, ARRIVAL_AIRPORT.code, FlightPriceRollup.travel_date, FlightPriceRollup.search_date, FlightPriceRollup.min_price)
+			.join(DEPARTURE_AIRPORT, FlightPriceRollup.departure_airport_id == DEPARTURE_AIRPORT.id)
+			.join(ARRIVAL_AIRPORT, FlightPriceRollup.arrival_airport_id == ARRIVAL_AIRPORT.id)
+			.where(FlightPriceRollup.travel_date >= first_travel_date)
+			.order_by(DEPARTURE_AIRPORT.code, ARRIVAL_AIRPORT.code, FlightPriceRollup.travel_date, FlightPriceRollup.search_date)
+		)
+
+		try:
+			with self.get_session() as session:
+				history: dict[tuple[str, str, date], RouteHistory] = {}
+				for key, scrapes in itertools.groupby(session.execute(rollups), key=lambda row: (row[0], row[1], row[2])):
+					scrapes_list = list(scrapes)
+					history[key] = RouteHistory(
+						# Legs stored before scrape queries were audited still date the scrape, to the day
+						last_scraped_at=datetime.combine(scrapes_list[-1].search_date, time.min),
+						volatility=price_volatility([scrape.min_price for scrape in scrapes_list if scrape.min_price is not None]),
+					)
+				for dep_air, arr_air, travel_date, started_at in session.execute(queries):
+					entry = history.setdefault((dep_air, arr_air, travel_date), RouteHistory(last_scraped_at=None, volatility=None))
+					entry.last_scraped_at = max(filter(None, [entry.last_scraped_at, started_at]))
+				return history
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to read route history: {e}') from e
+
+	def get_latest_flights(self, dep_air: str, arr_air: str, dep_dt: date) -> tuple[date | None, list[FlightRecord]]:
+		"""Legs of a route and departure date from the most recent scrape that saw any, with that scrape's date"""
+		route = [DEPARTURE_AIRPORT.code == dep_air, ARRIVAL_AIRPORT.code == arr_air, Flight.by_departure_date(dep_dt)]
+		latest = (
+			select(func.max(Flight.last_seen))
+			.join(DEPARTURE_AIRPORT, Flight.departure_airport_id == DEPARTURE_AIRPORT.id)
+			.join(ARRIVAL_AIRPORT, Flight.arrival_airport_id == ARRIVAL_AIRPORT.id)
+			.where(*route)
+		)
+		try:
+			with self.get_session() as session:
+				seen_on = session.scalar(latest)
+				if seen_on is None:
+					return None, []
+				return seen_on, self._select_records(session, *route, Flight.seen_on(seen_on))
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to retrieve latest results: {e}') from e
+
+	@staticmethod
+	def _set_trip_leg_price(leg_column, other_column):
+		"""UPDATE of one side of a round trip, totalled in SQL against the other side as currently stored"""
+		trip_price = TripPrice.__table__.c
+		total = bindparam('price') + other_column
+		lower = and_(other_column.is_not(None), or_(trip_price.lowest_total_price.is_(None), total < trip_price.lowest_total_price))
+		return (
+			update(TripPrice.__table__)
+			.where(
+				trip_price.departure_airport_id == bindparam('key_departure_airport_id'),
+				trip_price.arrival_airport_id == bindparam('key_arrival_airport_id'),
+				trip_price.departure_date == bindparam('key_departure_date'),
+				trip_price.stay_days == bindparam('key_stay_days'),
+			)
+			.values(
+				{
+					leg_column: bindparam('price'),
+					trip_price.total_price: total,
+					trip_price.lowest_total_price: case((lower, total), else_=trip_price.lowest_total_price),
+					trip_price.updated_at: bindparam('now'),
+				}
+			)
+		)
+
+	def _apply_trip_prices(self, session: Session, outbound_prices: dict[TripKey, float], return_prices: dict[TripKey, float]) -> list[TripPriceChange]:
+		keys = outbound_prices.keys() | return_prices.keys()
+		now = datetime.now()
+
+		codes = {code for dep_air, arr_air, _, _ in keys for code in (dep_air, arr_air)}
+		airport_ids = {code: airport_id for code, airport_id in session.execute(select(Airport.code, Airport.id).where(Airport.code.in_(codes)))}
+		ids = {key: (airport_ids[key[0]], airport_ids[key[1]], key[2], key[3]) for key in keys if key[0] in airport_ids and key[1] in airport_ids}
+
+		if not ids:
+			return []
+
+		# Touching the trips first takes the write lock (SQLite) or their row locks before they are read, so concurrent workers
+		# apply their prices one after another and each compares against the totals the previous one left
+		columns = (TripPrice.departure_airport_id, TripPrice.arrival_airport_id, TripPrice.departure_date, TripPrice.stay_days)
+		session.execute(update(TripPrice).where(tuple_(*columns).in_(list(ids.values()))).values(updated_at=now))
+		stored = {
+			(row.departure_airport_id, row.arrival_airport_id, row.departure_date, row.stay_days): row for row in session.scalars(select(TripPrice).where(tuple_(*columns).in_(list(ids.values()))))
+		}
+
+		missing = [row_id for row_id in ids.values() if row_id not in stored]
+		if missing:
+			session.execute(
+				insert(TripPrice),
+				[{'departure_airport_id': row_id[0], 'arrival_airport_id': row_id[1], 'departure_date': row_id[2], 'stay_days': row_id[3], 'updated_at': now} for row_id in missing],
+			)
+
+		changes: list[TripPriceChange] = []
+		for key, row_id in ids.items():
+			row = stored.get(row_id)
+			outbound_price = outbound_prices.get(key, row.outbound_price if row else None)
+			return_price = return_prices.get(key, row.return_price if row else None)
+			previous_total = row.total_price if row else None
+			if outbound_price is not None and return_price is not None and outbound_price + return_price != previous_total:
+				changes.append(TripPriceChange(key, previous_total, row.lowest_total_price if row else None, outbound_price + return_price, outbound_price, return_price))
+
+		trip_price = TripPrice.__table__.c
+		for prices, leg_column, other_column in ((outbound_prices, trip_price.outbound_price, trip_price.return_price), (return_prices, trip_price.return_price, trip_price.outbound_price)):
+			parameters = [
+				{
+					'key_departure_airport_id': ids[key][0],
+					'key_arrival_airport_id': ids[key][1],
+					'key_departure_date': ids[key][2],
+					'key_stay_days': ids[key][3],
+					'price': price,
+					'now': now,
+				}
+				for key, price in prices.items()
+				if key in ids
+			]
+			if parameters:
+				session.execute(self._set_trip_leg_price(leg_column, other_column), parameters)
+		return changes
+
+	def update_trip_prices(self, outbound_prices: dict[TripKey, float], return_prices: dict[TripKey, float], retries: int = 3) -> list[TripPriceChange]:
+		"""Set the cheapest outbound and return leg of the given round trips and return those whose total changed
+
+		Only the listed trips are read and written, by primary key, so the cost follows the number of legs just scraped and not
+		the stored history. The trips are locked before they are read, so workers pricing both legs of a trip at once neither
+		lose each other's price nor report a change against a total that was already replaced.
+		"""
+		if not outbound_prices and not return_prices:
+			return []
+
+		for attempt in range(retries):
+			try:
+				with self.get_session() as session:
+					return self._apply_trip_prices(session, outbound_prices, return_prices)
+			except DatabaseException as e:
+				# Another worker created one of the new trips first; the next attempt updates its row instead
+				if isinstance(e.__cause__, IntegrityError) and attempt + 1 < retries:
+					continue
+				raise
+		return []
+
+	def get_airline_names(self) -> list[str]:
+		try:
+			with self.get_session() as session:
+				return list(session.scalars(select(Airline.name).order_by(Airline.name)))
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to list airlines: {e}') from e
+
+	def get_latest_search_date(self) -> date | None:
+		try:
+			with self.get_session() as session:
+				return session.scalar(select(func.max(Flight.last_seen)))
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to read latest search date: {e}') from e
+
+	def _trip_pairs(self, session: Session, query: TripQuery):
+		"""Outbound/return id pairs with total price and trip length, every TripQuery field applied as a predicate"""
+		outbound = aliased(Flight, name='outbound')
+		inbound = aliased(Flight, name='inbound')
+		origin = aliased(Airport, name='origin')
+		destination = aliased(Airport, name='destination')
+
+		seen_on = query.seen_on or session.scalar(select(func.max(Flight.last_seen)))
+		total_price = (func.coalesce(outbound.price, 0) + func.coalesce(inbound.price, 0)).label('total_price')
+		trip_days = cast(func.julianday(func.date(inbound.departure_at)) - func.julianday(func.date(outbound.arrival_at)), Integer).label('trip_days')
+		outbound_day = func.date(outbound.departure_at)
+		stay_windows = [and_(inbound.departure_at >= func.datetime(outbound_day, f'+{stay} days'), inbound.departure_at < func.datetime(outbound_day, f'+{stay + 1} days')) for stay in query.stay_days]
+
+		stmt = (
+			select(outbound.id.label('outbound_id'), inbound.id.label('inbound_id'), total_price, trip_days)
+			.join(origin, outbound.departure_airport_id == origin.id)
+			.join(destination, outbound.arrival_airport_id == destination.id)
+			.join(
+				inbound,
+				and_(
+					inbound.departure_airport_id == outbound.arrival_airport_id,
+					inbound.arrival_airport_id == outbound.departure_airport_id,
+					or_(*stay_windows),
+				),
+			)
+			.where(outbound.seen_on(seen_on), inbound.seen_on(seen_on))
+		)
+
+		if query.departure_airport:
+			stmt = stmt.where(origin.code == query.departure_airport)
+		if query.arrival_airport:
+			stmt = stmt.where(destination.code == query.arrival_airport)
+		if query.min_total_price is not None:
+			stmt = stmt.where(total_price >= query.min_total_price)
+		if query.max_total_price is not None:
+			stmt = stmt.where(total_price <= query.max_total_price)
+		if query.min_trip_days is not None:
+			stmt = stmt.where(trip_days >= query.min_trip_days)
+		if query.max_trip_days is not None:
+			stmt = stmt.where(trip_days <= query.max_trip_days)
+		if not query.self_transfer:
+			stmt = stmt.where(outbound.self_transfer.is_(False), inbound.self_transfer.is_(False))
+		if query.airlines:
+			operated = select(FlightAirline.flight_id).join(Airline, FlightAirline.airline_id == Airline.id).where(Airline.name.in_(query.airlines))
+			stmt = stmt.where(or_(outbound.id.in_(operated), inbound.id.in_(operated)))
+
+		return stmt
+
+	def get_trip_bounds(self, query: TripQuery) -> tuple[float, float, int, int] | None:
+		"""(min price, max price, min days, max days) over the trips matching query, for sizing filter widgets"""
+		try:
+			with self.get_session() as session:
+				pairs = self._trip_pairs(session, query).subquery()
+				row = session.execute(select(func.min(pairs.c.total_price), func.max(pairs.c.total_price), func.min(pairs.c.trip_days), func.max(pairs.c.trip_days))).one()
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to compute trip bounds: {e}') from e
+
+		if row[0] is None:
+			return None
+		return float(row[0]), float(row[1]), int(row[2]), int(row[3])
+
+	def get_trip_combinations(self, query: TripQuery) -> list[tuple[FlightRecord, FlightRecord]]:
+		"""Cheapest-first outbound/return pairs matching query; only matching legs are read"""
+		try:
+			with self.get_session() as session:
+				stmt = self._trip_pairs(session, query).order_by('total_price')
+				if query.limit:
+					stmt = stmt.limit(query.limit)
+				pairs = session.execute(stmt).all()
+				if not pairs:
+					return []
+
+				leg_ids = {pair.outbound_id for pair in pairs} | {pair.inbound_id for pair in pairs}
+				legs = {record.id: record for record in self._select_records(session, Flight.id.in_(leg_ids))}
+
+				return [(legs[pair.outbound_id], legs[pair.inbound_id]) for pair in pairs]
+		except SQLAlchemyError as e:
+			raise DatabaseException(f'Failed to query trip combinations: {e}') from e
 
 	def close(self) -> None:
 		if self._engine:
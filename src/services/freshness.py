@@ -0,0 +1,32 @@
+import itertools
+from dataclasses import dataclass
+from datetime import timedelta
+
+
+def price_volatility(min_prices: list[float]) -> float | None:
+	"""Mean relative change of a route's cheapest price between consecutive scrapes; None without two scrapes to compare"""
+	changes = [abs(current - previous) / previous for previous, current in itertools.pairwise(min_prices) if previous]
+	return sum(changes) / len(changes) if changes else None
+
+
+@dataclass(frozen=True)
+class FreshnessPolicy:
+	"""How long a scraped (origin, destination, date) result stays fresh
+
+	The base lifetime shrinks as departure gets closer (ttl_tiers maps 'at most this many days out' to hours) and is then
+	scaled by how much the route's cheapest price usually moves between scrapes: a route moving twice as much as
+	reference_volatility is refreshed twice as often, within max_volatility_factor either way.
+	"""
+
+	ttl_tiers: tuple[tuple[int, float], ...] = ((3, 3.0), (7, 6.0), (14, 12.0), (30, 24.0), (60, 48.0), (120, 96.0))
+	far_ttl_hours: float = 168.0
+	reference_volatility: float = 0.05
+	max_volatility_factor: float = 4.0
+	min_ttl_hours: float = 1.0
+
+	def ttl(self, days_to_departure: int, volatility: float | None) -> timedelta:
+		hours = next((tier_hours for tier_days, tier_hours in self.ttl_tiers if days_to_departure <= tier_days), self.far_ttl_hours)
+		if volatility is not None:
+			factor = self.reference_volatility / volatility if volatility > 0 else self.max_volatility_factor
+			hours *= min(self.max_volatility_factor, max(1 / self.max_volatility_factor, factor))
+		return timedelta(hours=max(self.min_ttl_hours, hours))
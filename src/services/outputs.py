@@ -0,0 +1,13 @@
+import json
+import os
+from datetime import datetime
+
+OUTPUTS_DIR = 'outputs'
+MANIFEST_FILE = 'manifest.jsonl'
+
+
+def record_output(filename: str, rows: int, outputs_dir: str = OUTPUTS_DIR) -> None:
+	"""Append a written combinations file to the manifest the viewer polls as its change marker"""
+	entry = {'file': filename, 'rows': rows, 'written_at': datetime.now().isoformat(timespec='seconds')}
+	with open(os.path.join(outputs_dir, MANIFEST_FILE), 'a') as manifest:
+		manifest.write(json.dumps(entry) + '\n')
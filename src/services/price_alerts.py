@@ -0,0 +1,170 @@
+import json
+import sys
+import urllib.request
+from collections.abc import Iterable, Sequence
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from typing import Protocol
+
+from src.models.records import FlightRecord
+from src.services.database_service import DatabaseService, TripKey, TripPriceChange
+from src.utils.logger import count, get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class AlertPolicy:
+	"""When a round trip got cheap enough to tell someone
+
+	A drop counts once the total fell by at least min_drop_fraction and min_drop_amount since the previous total, or once it
+	reaches target_price for the first time. The first total of a trip only sets the baseline.
+	"""
+
+	min_drop_fraction: float = 0.05
+	min_drop_amount: float = 0.0
+	target_price: float | None = None
+
+	def crossed(self, previous_total: float | None, total_price: float) -> bool:
+		if previous_total is None:
+			return False
+		if self.target_price is not None and total_price <= self.target_price < previous_total:
+			return True
+		drop = previous_total - total_price
+		return drop > 0 and drop >= self.min_drop_amount and drop >= previous_total * self.min_drop_fraction
+
+
+@dataclass(frozen=True)
+class PriceDrop:
+	departure_airport: str
+	arrival_airport: str
+	departure_date: date
+	return_date: date
+	stay_days: int
+	previous_total: float
+	total_price: float
+	outbound_price: float
+	return_price: float
+	lowest_before: float | None
+	detected_at: datetime
+
+	@property
+	def all_time_low(self) -> bool:
+		return self.lowest_before is None or self.total_price < self.lowest_before
+
+	def message(self) -> str:
+		low = ', lowest seen' if self.all_time_low else ''
+		return (
+			f'{self.departure_airport}-{self.arrival_airport} {self.departure_date:%Y-%m-%d} to {self.return_date:%Y-%m-%d} ({self.stay_days} days): '
+			f'{self.previous_total:.2f} -> {self.total_price:.2f}{low}'
+		)
+
+	def as_json(self) -> str:
+		return json.dumps({**asdict(self), 'all_time_low': self.all_time_low}, default=lambda value: value.isoformat())
+
+
+class PriceDropSink(Protocol):
+	def send(self, drop: PriceDrop) -> None: ...
+
+
+class StdoutSink:
+	def send(self, drop: PriceDrop) -> None:
+		print(f'Price drop: {drop.message()}', file=sys.stdout, flush=True)
+
+
+class FileSink:
+	"""Appends one JSON line per drop, for a tail -f or another process to pick up"""
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+
+	def send(self, drop: PriceDrop) -> None:
+		with open(self.path, 'a', encoding='utf-8') as alerts:
+			alerts.write(drop.as_json() + '\n')
+
+
+class WebhookSink:
+	"""POSTs each drop as JSON, e.g. to a local chat bridge or notification relay"""
+
+	def __init__(self, url: str, timeout: float = 5.0) -> None:
+		self.url = url
+		self.timeout = timeout
+
+	def send(self, drop: PriceDrop) -> None:
+		request = urllib.request.Request(self.url, data=drop.as_json().encode(), headers={'Content-Type': 'application/json'}, method='POST')
+		with urllib.request.urlopen(request, timeout=self.timeout):
+			pass
+
+
+def sink_from_spec(spec: str) -> PriceDropSink:
+	"""'stdout', an http(s) URL for a webhook, or a file path to append JSON lines to"""
+	if spec == 'stdout':
+		return StdoutSink()
+	if spec.startswith(('http://', 'https://')):
+		return WebhookSink(spec)
+	return FileSink(spec)
+
+
+class PriceDropDetector:
+	"""Folds every freshly scraped search into the stored round-trip totals and notifies the sinks of drops
+
+	A leg leaving one of the trip origins is the outbound of a trip for every stay, a leg arriving at one is its return; only
+	those trips are looked up, by primary key, so checking costs O(legs scraped) however long the history is. Self-transfer
+	legs are left out, as in the best deals.
+	"""
+
+	def __init__(self, origins: Iterable[str], stays: Iterable[int], policy: AlertPolicy | None = None, sinks: Sequence[PriceDropSink] = ()) -> None:
+		self.origins = frozenset(origins)
+		self.stays = tuple(sorted(set(stays)))
+		self.policy = policy or AlertPolicy()
+		self.sinks = list(sinks)
+
+	def _trip_prices(self, dep_air: str, arr_air: str, travel_date: date, price: float) -> tuple[dict[TripKey, float], dict[TripKey, float]]:
+		outbound: dict[TripKey, float] = {}
+		inbound: dict[TripKey, float] = {}
+		for stay_days in self.stays:
+			if dep_air in self.origins:
+				outbound[(dep_air, arr_air, travel_date, stay_days)] = price
+			if arr_air in self.origins:
+				inbound[(arr_air, dep_air, travel_date - timedelta(days=stay_days), stay_days)] = price
+		return outbound, inbound
+
+	def _drop(self, change: TripPriceChange, detected_at: datetime) -> PriceDrop | None:
+		if change.previous_total is None or not self.policy.crossed(change.previous_total, change.total_price):
+			return None
+		dep_air, arr_air, departure_date, stay_days = change.key
+		return PriceDrop(
+			departure_airport=dep_air,
+			arrival_airport=arr_air,
+			departure_date=departure_date,
+			return_date=departure_date + timedelta(days=stay_days),
+			stay_days=stay_days,
+			previous_total=change.previous_total,
+			total_price=change.total_price,
+			outbound_price=change.outbound_price,
+			return_price=change.return_price,
+			lowest_before=change.lowest_total,
+			detected_at=detected_at,
+		)
+
+	def observe(self, database_service: DatabaseService, dep_air: str, arr_air: str, travel_date: date, flights: Sequence[FlightRecord]) -> list[PriceDrop]:
+		"""Update the trips using this search's cheapest leg and send the drops it caused"""
+		prices = [flight.price for flight in flights if flight.price is not None and not flight.self_transfer]
+		if not prices:
+			return []
+
+		outbound, inbound = self._trip_prices(dep_air, arr_air, travel_date, min(prices))
+		changes = database_service.update_trip_prices(outbound, inbound)
+
+		detected_at = datetime.now()
+		drops = [drop for drop in (self._drop(change, detected_at) for change in changes) if drop]
+		for drop in drops:
+			count('price_drops')
+			logger.info('Price drop %s', drop.message())
+			for sink in self.sinks:
+				try:
+					sink.send(drop)
+				except Exception as e:
+					count('price_drop_sink_errors')
+					logger.warning('Price drop sink %s failed: %s', type(sink).__name__, e)
+		return drops
@@ -0,0 +1,114 @@
+import heapq
+import math
+import time
+from collections.abc import Callable
+from datetime import date, datetime, timedelta
+
+from src.services.database_service import DatabaseService
+from src.services.freshness import FreshnessPolicy
+from src.services.trip_agency_service import TripAgencyService
+from src.utils.logger import count, get_logger
+from src.utils.rate_limit import QueryBudget
+
+logger = get_logger(__name__)
+
+SearchKey = tuple[str, str, date]
+# (-overdue ratio, days to departure, key): the most overdue search first, the sooner departure on ties
+StaleEntry = tuple[float, int, SearchKey]
+
+
+class RefreshDaemon:
+	"""Keeps a set of searches fresh, spending a per-hour query budget on the searches most overdue under the freshness policy
+
+	Each search's lifetime comes from FreshnessPolicy (days to departure and price volatility); when it was last fetched comes
+	from the scrape_queries audit. Stale searches wait in a heap ordered by how far past their lifetime they are, which is
+	rebuilt every replan_interval so results of other scrapers and new history are taken into account.
+	"""
+
+	def __init__(
+		self,
+		trip_agent: TripAgencyService,
+		database_service: DatabaseService,
+		searches: list[SearchKey],
+		policy: FreshnessPolicy | None = None,
+		queries_per_hour: float = 60,
+		replan_interval: timedelta = timedelta(minutes=15),
+		sleep: Callable[[float], None] = time.sleep,
+	) -> None:
+		self.trip_agent = trip_agent
+		self.database_service = database_service
+		self.searches = sorted(set(searches))
+		self.policy = policy or FreshnessPolicy()
+		self.budget = QueryBudget(queries_per_hour)
+		self.replan_interval = replan_interval
+		self._sleep = sleep
+
+	def plan(self, now: datetime) -> tuple[list[StaleEntry], float | None]:
+		"""Heap of stale searches, and the seconds until the next fresh one goes stale (None when nothing is left to watch)"""
+		history = self.database_service.get_route_history(now.date())
+		stale: list[StaleEntry] = []
+		next_stale_in: float | None = None
+
+		for key in self.searches:
+			days_to_departure = (key[2] - now.date()).days
+			if days_to_departure < 0:
+				continue
+
+			route = history.get(key)
+			if route is None or route.last_scraped_at is None:
+				stale.append((-math.inf, days_to_departure, key))
+				continue
+
+			ttl = self.policy.ttl(days_to_departure, route.volatility)
+			age = now - route.last_scraped_at
+			if age >= ttl:
+				stale.append((-(age / ttl), days_to_departure, key))
+			else:
+				expires_in = (ttl - age).total_seconds()
+				next_stale_in = expires_in if next_stale_in is None else min(next_stale_in, expires_in)
+
+		heapq.heapify(stale)
+		return stale, next_stale_in
+
+	def _refresh(self, key: SearchKey) -> None:
+		dep_air, arr_air, travel_date = key
+		try:
+			flights, stats = self.trip_agent.fetch_route(dep_air, arr_air, datetime.combine(travel_date, datetime.min.time()), force=True)
+		except Exception as e:
+			count('refresh_failed')
+			logger.warning('Refresh of %s-%s %s failed: %s', dep_air, arr_air, travel_date, e)
+			return
+		count('refreshed')
+		logger.info('Refreshed %s-%s %s: %d flights (%s)', dep_air, arr_air, travel_date, len(flights), stats.outcome)
+
+	def run(self, max_queries: int | None = None, once: bool = False) -> int:
+		"""Refresh stale searches until max_queries were spent, forever, or with once until the current stale set is done"""
+		spent = 0
+
+		while max_queries is None or spent < max_queries:
+			stale, next_stale_in = self.plan(datetime.now())
+			if not stale:
+				if once:
+					break
+				idle = self.replan_interval.total_seconds() if next_stale_in is None else min(next_stale_in, self.replan_interval.total_seconds())
+				logger.info('Nothing stale, next check in %.0f s', idle)
+				self._sleep(idle)
+				continue
+
+			logger.info('%d of %d searches are stale', len(stale), len(self.searches))
+			replan_at = math.inf if once else time.monotonic() + self.replan_interval.total_seconds()
+			with self.trip_agent.tracked_run():
+				while stale and time.monotonic() < replan_at and (max_queries is None or spent < max_queries):
+					wait = self.budget.wait_seconds()
+					if wait > 0:
+						self._sleep(min(wait, max(0.0, replan_at - time.monotonic())))
+						continue
+					self.budget.take()
+					_, _, key = heapq.heappop(stale)
+					self._refresh(key)
+					spent += 1
+
+			if once and not stale:
+				break
+
+		return spent
@@ -0,0 +1,129 @@
+import os
+import socket
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from src.models.database import TASK_LEASED, TASK_PENDING
+from src.scraper.stats import classify_exception
+from src.services.database_service import DatabaseService, LeasedTask
+from src.services.trip_agency_service import TripAgencyService
+from src.utils.logger import count, get_logger
+
+logger = get_logger(__name__)
+
+
+def default_worker_id() -> str:
+	return f'{socket.gethostname()}:{os.getpid()}'
+
+
+@dataclass
+class WorkerResult:
+	done: int = 0
+	retried: int = 0
+	failed: int = 0
+	lost_leases: int = 0
+
+
+class ScrapeWorker:
+	"""Claims (origin, destination, date) tasks of a plan from the database queue, scrapes and persists them until the plan is drained
+
+	Any number of workers, in one process or on several hosts, can share a plan. A worker that dies stops heartbeating, its lease
+	expires and another worker takes the task over; saves are deduplicated on the leg fingerprint, so a repeated search is harmless.
+	"""
+
+	def __init__(
+		self,
+		trip_agent: TripAgencyService,
+		database_service: DatabaseService,
+		plan: str,
+		worker_id: str | None = None,
+		lease: timedelta = timedelta(minutes=5),
+		max_attempts: int = 3,
+		poll_interval: float = 5.0,
+	) -> None:
+		self.trip_agent = trip_agent
+		self.database_service = database_service
+		self.plan = plan
+		self.worker_id = worker_id or default_worker_id()
+		self.lease = lease
+		self.max_attempts = max_attempts
+		self.poll_interval = poll_interval
+
+	@contextmanager
+	def _heartbeat(self, task: LeasedTask) -> Generator[threading.Event, None, None]:
+		"""Extend the lease in the background while the task runs; the yielded event is set once the lease is lost"""
+		stop = threading.Event()
+		lost = threading.Event()
+
+		def beat() -> None:
+			while not stop.wait(self.lease.total_seconds() / 3):
+				try:
+					alive = self.database_service.heartbeat_scrape_task(task.id, self.worker_id, self.lease)
+				except Exception as e:
+					logger.warning('Heartbeat of task %d failed: %s', task.id, e)
+					continue
+				if not alive:
+					lost.set()
+					return
+
+		thread = threading.Thread(target=beat, name=f'heartbeat-{task.id}', daemon=True)
+		thread.start()
+		try:
+			yield lost
+		finally:
+			stop.set()
+			thread.join()
+
+	def _run_task(self, task: LeasedTask, result: WorkerResult) -> None:
+		route = f'{task.departure_airport}-{task.arrival_airport} {task.travel_date}'
+		with self._heartbeat(task) as lost:
+			try:
+				flights, stats = self.trip_agent.fetch_route(task.departure_airport, task.arrival_airport, datetime.combine(task.travel_date, datetime.min.time()))
+			except Exception as e:
+				retry = task.attempts < self.max_attempts
+				if self.database_service.fail_scrape_task(task.id, self.worker_id, str(e), classify_exception(e), retry=retry):
+					result.retried += retry
+					result.failed += not retry
+				logger.warning('Task %s failed on attempt %d/%d: %s', route, task.attempts, self.max_attempts, e)
+				return
+			except BaseException:
+				# Interrupted: hand the task straight back instead of waiting for the lease to expire
+				self.database_service.fail_scrape_task(task.id, self.worker_id, 'Worker interrupted', 'interrupted', retry=task.attempts < self.max_attempts)
+				raise
+
+		if lost.is_set() or not self.database_service.complete_scrape_task(task.id, self.worker_id, stats.outcome):
+			# Another worker took the task over; its legs are saved all the same
+			result.lost_leases += 1
+			count('tasks_lost_lease')
+			logger.warning('Lease on %s expired before it finished', route)
+			return
+
+		result.done += 1
+		count('tasks_done')
+		logger.info('Task %s done: %d flights (%s)', route, len(flights), stats.outcome)
+
+	def run(self, max_tasks: int | None = None) -> WorkerResult:
+		"""Work until the plan has nothing pending or leased to anyone else, or max_tasks were claimed"""
+		result = WorkerResult()
+		claimed = 0
+
+		with self.trip_agent.tracked_run():
+			while max_tasks is None or claimed < max_tasks:
+				task = self.database_service.claim_scrape_task(self.plan, self.worker_id, self.lease, self.max_attempts)
+				if task is None:
+					counts = self.database_service.get_scrape_task_counts(self.plan)
+					if not counts[TASK_PENDING] and not counts[TASK_LEASED]:
+						break
+					# Wait for other workers to finish, or for a dead worker's lease to expire
+					time.sleep(self.poll_interval)
+					continue
+
+				claimed += 1
+				self._run_task(task, result)
+
+		logger.info('Worker %s finished plan %s: %d done, %d retried, %d failed, %d leases lost', self.worker_id, self.plan, result.done, result.retried, result.failed, result.lost_leases)
+		return result
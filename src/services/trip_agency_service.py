@@ -3,58 +3,239 @@ import csv
 import os
 import random
 import time
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING
 
-from src.models.database import Flight
-from src.scraper.play import Scraper
-from src.services.database_service import DatabaseException, DatabaseService
+from src.models.records import COMBINATION_CSV_HEADERS, FlightRecord, combination_row
+from src.scraper.constraints import SearchConstraints
+from src.scraper.stats import OUTCOME_CACHED, QueryStats, classify_exception
+from src.services.aggregates import BestDeals
+from src.services.database_service import DatabaseException, DatabaseService, RouteHistory
+from src.services.freshness import FreshnessPolicy
+from src.services.outputs import OUTPUTS_DIR, record_output
+from src.services.price_alerts import PriceDropDetector
+from src.utils.logger import count, get_logger, log_run_summary, metrics, span
+
+if TYPE_CHECKING:
+	from src.scraper.provider import FlightSource
+
+logger = get_logger(__name__)
+
+
+def trip_dates(wanted_stay_time: list[int], possible_start_trip_dates: list[datetime], last_vacation_day: datetime) -> tuple[list[datetime], list[datetime]]:
+	"""Outbound dates and every return date a wanted stay can end on"""
+	valid_starting_points = list(filter(lambda x: x <= last_vacation_day, possible_start_trip_dates))
+
+	min_stay = min(wanted_stay_time)
+	max_stay = max(wanted_stay_time)
+	first_day = min(possible_start_trip_dates)
+	last_day = max(possible_start_trip_dates)
+	first_arrival_day = first_day + timedelta(days=min_stay)
+	last_arrival_day = min(last_vacation_day, last_day + timedelta(days=max_stay))
+
+	num_days = (last_arrival_day - first_arrival_day).days + 1
+
+	valid_return_dates = [first_arrival_day + timedelta(days=x) for x in range(num_days)]
+
+	return valid_starting_points, valid_return_dates
+
+
+def plan_searches(
+	possible_trip_starting_points: list[str],
+	possible_trip_destinations: list[str],
+	wanted_stay_time: list[int],
+	possible_start_trip_dates: list[datetime],
+	last_vacation_day: datetime,
+) -> list[tuple[str, str, datetime]]:
+	"""Every (origin, destination, date) search find_daily_flight_combinations runs, outbound legs first"""
+	valid_starting_points, valid_return_dates = trip_dates(wanted_stay_time, possible_start_trip_dates, last_vacation_day)
+	outbound = [(dep, arr, day) for dep in possible_trip_starting_points for arr in possible_trip_destinations for day in valid_starting_points]
+	inbound = [(dep, arr, day) for dep in possible_trip_destinations for arr in possible_trip_starting_points for day in valid_return_dates]
+	return outbound + inbound
 
 
 class TripAgencyService:
-	def __init__(self, scraper: Scraper, database_service: DatabaseService | None = None) -> None:
-		self._scraper: Scraper = scraper
+	def __init__(
+		self,
+		scraper: 'FlightSource | None',
+		database_service: DatabaseService | None = None,
+		search_date: date | None = None,
+		freshness: FreshnessPolicy | None = None,
+		price_alerts: PriceDropDetector | None = None,
+		constraints: SearchConstraints | None = None,
+	) -> None:
+		# Without a scraper only stored legs are combined, for rebuilding outputs from the database offline
+		self._scraper: FlightSource | None = scraper
 		self._db_service: DatabaseService | None = database_service
+		self._search_date: date | None = search_date
+		# With a freshness policy, legs from an earlier scrape are reused while that scrape is still fresh for the route
+		self._freshness: FreshnessPolicy | None = freshness
+		self._route_history: dict[tuple[str, str, date], RouteHistory] | None = None
+		# Every scraped search updates the stored round-trip totals, reporting drops to the detector's sinks
+		self._price_alerts: PriceDropDetector | None = price_alerts
+		# The scraper's search constraints; stored legs are reused only when they were scraped under the same ones
+		self._constraints: SearchConstraints | None = constraints
+		self._run_id: int | None = None
+
+	def _record_query(self, dep: str, arr: str, travel_date: datetime, started_at: datetime, stats: QueryStats) -> None:
+		count(f'queries_{stats.outcome}')
+		if self._db_service and self._run_id is not None:
+			with contextlib.suppress(DatabaseException):
+				constraints = self._constraints.cache_key() if self._constraints else None
+				self._db_service.record_scrape_query(self._run_id, dep, arr, travel_date.date(), started_at, stats, constraints=constraints)
+
+	def _reusable(self, st_point: str, trip_dest: str, dp_date: datetime, seen_on: date, flights: list[FlightRecord]) -> list[FlightRecord]:
+		"""Stored legs as a search under this run's constraints would return them, or none if they were scraped under others
+
+		Legs a search recorded under other constraints are a different subset of the page, too narrow or too wide, so they
+		are scraped again. Legs with no recorded constraints are narrowed down to the ones the constraints allow.
+		"""
+		if not self._constraints or not flights or not self._db_service:
+			return flights
+
+		recorded = self._db_service.get_scrape_constraints(st_point, trip_dest, dp_date.date(), seen_on)
+		if recorded and None not in recorded and self._constraints.cache_key() not in recorded:
+			count('cache_constraint_misses')
+			return []
+
+		allows = self._constraints.allows
+		return [flight for flight in flights if allows(flight.departure_at, flight.arrival_at, flight.duration_minutes, flight.stops, flight.self_transfer, flight.companies)]
+
+	def _lookup_route(self, st_point: str, trip_dest: str, dp_date: datetime) -> list[FlightRecord]:
+		if not self._db_service:
+			return []
+
+		today = self._search_date or date.today()
+		with span('db_lookup'), contextlib.suppress(DatabaseException):
+			flights = self._reusable(st_point, trip_dest, dp_date, today, self._db_service.get_flight_from_to_date(dep_air=st_point, arr_air=trip_dest, dep_dt=dp_date, search_date=today))
+			if flights or not self._freshness:
+				return flights
+
+			seen_on, flights = self._db_service.get_latest_flights(st_point, trip_dest, dp_date)
+			if seen_on is None:
+				return []
+			flights = self._reusable(st_point, trip_dest, dp_date, seen_on, flights)
+			if not flights:
+				return []
+
+			if self._route_history is None:
+				self._route_history = self._db_service.get_route_history(today)
+			history = self._route_history.get((st_point, trip_dest, dp_date.date()))
+			scraped_at = history.last_scraped_at if history and history.last_scraped_at else datetime.combine(seen_on, datetime.min.time())
+			ttl = self._freshness.ttl((dp_date.date() - today).days, history.volatility if history else None)
+			if scraped_at + ttl >= datetime.now():
+				count('cache_fresh_hits')
+				return flights
+		return []
+
+	def fetch_route(self, st_point: str, trip_dest: str, dp_date: datetime, force: bool = False) -> tuple[list[FlightRecord], QueryStats]:
+		"""Legs of one (origin, destination, date) search: stored ones when the database has them, otherwise scraped and persisted
+
+		force skips the lookup and scrapes again, overwriting prices stored earlier the same day.
+		"""
+		started_at = datetime.now()
+		dep_flights_combination = [] if force else self._lookup_route(st_point, trip_dest, dp_date)
+
+		if dep_flights_combination:
+			count('cache_hits')
+			stats = QueryStats(flight_count=len(dep_flights_combination), outcome=OUTCOME_CACHED)
+			self._record_query(st_point, trip_dest, dp_date, started_at, stats)
+			return dep_flights_combination, stats
+
+		count('cache_misses')
+		stats = QueryStats()
+		if self._scraper is None:
+			return dep_flights_combination, stats
+
+		with span('scrape', departure=st_point, arrival=trip_dest, date=dp_date.strftime('%Y-%m-%d')) as fields:
+			try:
+				dep_flights_combination = self._scraper.get_flights(departure=st_point, arrival=trip_dest, date=dp_date.strftime('%Y-%m-%d'), stats=stats)
+			except Exception as e:
+				stats.outcome = classify_exception(e)
+				stats.error = str(e)
+				fields['outcome'] = stats.outcome
+				self._record_query(st_point, trip_dest, dp_date, started_at, stats)
+				raise
+			fields.update(outcome=stats.outcome, cards=stats.card_count, flights=stats.flight_count)
+
+		if self._db_service:
+			with stats.phase('persist'), contextlib.suppress(DatabaseException):
+				self._db_service.save_unique_flights(dep_flights_combination, update_prices=force)
+			if self._price_alerts:
+				with span('price_alerts'), contextlib.suppress(DatabaseException):
+					self._price_alerts.observe(self._db_service, st_point, trip_dest, dp_date.date(), dep_flights_combination)
+
+		self._record_query(st_point, trip_dest, dp_date, started_at, stats)
+
+		# Try to mimic the human behavior
+		if self._scraper.humanize:
+			time.sleep(random.uniform(0.05, 5.5))
+
+		return dep_flights_combination, stats
 
 	def _get_flights_dict(
 		self,
 		dep: list[str],
 		arr: list[str],
 		dt: list[datetime],
-	) -> dict[tuple[str, str, datetime], list[Flight]]:
-		res: dict[tuple[str, str, datetime], list[Flight]] = dict()
-
-		today = date.today()
+		on_result: Callable[[tuple[str, str, datetime], list[FlightRecord]], None] | None = None,
+	) -> dict[tuple[str, str, datetime], list[FlightRecord]]:
+		res: dict[tuple[str, str, datetime], list[FlightRecord]] = dict()
 
 		for st_point in dep:
 			for trip_dest in arr:
 				for dp_date in dt:
-					dep_flights_combination = []
+					entry = (st_point, trip_dest, dp_date)
+					res[entry], _ = self.fetch_route(st_point, trip_dest, dp_date)
 
-					if self._db_service:
-						with contextlib.suppress(DatabaseException):
-							dep_flights_combination = self._db_service.get_flight_from_to_date(
-								dep_air=st_point,
-								arr_air=trip_dest,
-								dep_dt=dp_date,
-								search_date=today,
-							)
+					if on_result:
+						on_result(entry, res[entry])
 
-					if not dep_flights_combination:
-						dep_flights_combination = self._scraper.get_flights(departure=st_point, arrival=trip_dest, date=dp_date.strftime('%Y-%m-%d'))
+		return res
 
-						# Try to mimic the human behavior
-						time.sleep(random.uniform(0.05, 5.5))
+	@contextmanager
+	def tracked_run(self) -> Generator[None, None, None]:
+		"""Bracket a scrape run: fresh metrics, a scrape_runs row when there is a database, and the summary logged at the end"""
+		metrics.reset()
+		if self._db_service:
+			with contextlib.suppress(DatabaseException):
+				self._run_id = self._db_service.start_scrape_run()
 
-						if self._db_service:
-							with contextlib.suppress(DatabaseException):
-								self._db_service.save_unique_flights(dep_flights_combination)
+		try:
+			with span('run'):
+				yield
+		except BaseException:
+			self._finish_run('failed')
+			raise
+		self._finish_run('finished')
 
-					entry = (st_point, trip_dest, dp_date)
-					res[entry] = dep_flights_combination
+	def find_daily_flight_combinations(
+		self,
+		possible_trip_starting_points: list[str],
+		possible_trip_destinations: list[str],
+		wanted_stay_time: list[int],
+		possible_start_trip_dates: list[datetime],
+		last_vacation_day: datetime,
+	) -> None:
+		with self.tracked_run():
+			self._find_daily_flight_combinations(
+				possible_trip_starting_points,
+				possible_trip_destinations,
+				wanted_stay_time,
+				possible_start_trip_dates,
+				last_vacation_day,
+			)
 
-		return res
+	def _finish_run(self, status: str) -> None:
+		if self._db_service and self._run_id is not None:
+			with contextlib.suppress(DatabaseException):
+				self._db_service.finish_scrape_run(self._run_id, status)
+		self._run_id = None
+		log_run_summary(logger)
 
-	def find_daily_flight_combinations(
+	def _find_daily_flight_combinations(
 		self,
 		possible_trip_starting_points: list[str],
 		possible_trip_destinations: list[str],
@@ -62,111 +243,63 @@ class TripAgencyService:
 		possible_start_trip_dates: list[datetime],
 		last_vacation_day: datetime,
 	) -> None:
-		valid_starting_points = list(filter(lambda x: x <= last_vacation_day, possible_start_trip_dates))
+		valid_starting_points, valid_return_dates = trip_dates(wanted_stay_time, possible_start_trip_dates, last_vacation_day)
 		departure_flights = self._get_flights_dict(
 			dep=possible_trip_starting_points,
 			arr=possible_trip_destinations,
 			dt=valid_starting_points,
 		)
 
-		min_stay = min(wanted_stay_time)
-		max_stay = max(wanted_stay_time)
-		first_day = min(possible_start_trip_dates)
-		last_day = max(possible_start_trip_dates)
-		first_arrival_day = first_day + timedelta(days=min_stay)
-		last_arrival_day = min(last_vacation_day, last_day + timedelta(days=max_stay))
+		best_deals = BestDeals()
 
-		num_days = (last_arrival_day - first_arrival_day).days + 1
+		def write_return_date(key: tuple[str, str, datetime], arr_flights: list[FlightRecord]) -> None:
+			# Pair each return date with its outbound dates as soon as it is fetched, so the viewer can follow the run
+			arr_flight_dp, arr_flight_arr, arr_date = key
+			for stay_days in wanted_stay_time:
+				dep_flight_dt = arr_date - timedelta(days=stay_days)
+				dep_flights = departure_flights.get((arr_flight_arr, arr_flight_dp, dep_flight_dt), [])
+				self._write_combinations(arr_flight_arr, arr_flight_dp, dep_flight_dt, arr_date, dep_flights, arr_flights, best_deals)
 
-		valid_return_dates = [first_arrival_day + timedelta(days=x) for x in range(num_days)]
-
-		arrival_flights = self._get_flights_dict(
+		self._get_flights_dict(
 			dep=possible_trip_destinations,
 			arr=possible_trip_starting_points,
 			dt=valid_return_dates,
+			on_result=write_return_date,
 		)
 
-		for (dep_flight_dp, dep_flight_arr, dep_flight_dt), dep_flights in departure_flights.items():
-			arr_dates = [dep_flight_dt + timedelta(days=stay_days) for stay_days in wanted_stay_time]
-			for arr_date in arr_dates:
-				key = (dep_flight_arr, dep_flight_dp, arr_date)
-				arr_flights = arrival_flights.get(key, [])
-
-				filename = f'dep_{dep_flight_dp}_{dep_flight_arr}_{dep_flight_dt.strftime("%Y-%m-%d")}__arr_{dep_flight_arr}_{dep_flight_dp}_{arr_date.strftime("%Y-%m-%d")}.csv'
-				all_combinations = []
-				for dep_flt in dep_flights:
-					for arr_flt in arr_flights:
-						all_combinations.append((dep_flt, arr_flt))
-
-				if not all_combinations:
-					continue
-
-				os.makedirs('outputs', exist_ok=True)
-				with open(f'outputs/{filename}', 'w', newline='') as off:
-					writer = csv.writer(off)
-
-					# Write CSV headers
-					headers = [
-						'dep_id',
-						'dep_search_date',
-						'dep_departure_airport',
-						'dep_arrival_airport',
-						'dep_departure_date',
-						'dep_arrival_date',
-						'dep_departure_time',
-						'dep_arrival_time',
-						'dep_price',
-						'dep_total_hours',
-						'dep_companies',
-						'dep_connections',
-						'arr_id',
-						'arr_search_date',
-						'arr_departure_airport',
-						'arr_arrival_airport',
-						'arr_departure_date',
-						'arr_arrival_date',
-						'arr_departure_time',
-						'arr_arrival_time',
-						'arr_price',
-						'arr_total_hours',
-						'arr_companies',
-						'arr_connections',
-						'total_price',
-						'trip_duration_days',
-					]
-					writer.writerow(headers)
-
-					# Write flight combination data
-					for dep_flight, arr_flight in all_combinations:
-						trip_duration = (arr_flight.departure_date.date() - dep_flight.arrival_date.date()).days
-						total_price = (dep_flight.price or 0) + (arr_flight.price or 0)
-
-						row = [
-							dep_flight.id if hasattr(dep_flight, 'id') else '',
-							dep_flight.search_date.strftime('%Y-%m-%d %H:%M:%S') if dep_flight.search_date else '',
-							dep_flight.departure_airport,
-							dep_flight.arrival_airport,
-							dep_flight.departure_date.strftime('%Y-%m-%d') if dep_flight.departure_date else '',
-							dep_flight.arrival_date.strftime('%Y-%m-%d') if dep_flight.arrival_date else '',
-							dep_flight.departure_time.strftime('%H:%M') if dep_flight.departure_time else '',
-							dep_flight.arrival_time.strftime('%H:%M') if dep_flight.arrival_time else '',
-							dep_flight.price or 0,
-							dep_flight.total_hours or 0,
-							', '.join(dep_flight.companies) if dep_flight.companies else '',
-							dep_flight.connections or '',
-							arr_flight.id if hasattr(arr_flight, 'id') else '',
-							arr_flight.search_date.strftime('%Y-%m-%d %H:%M:%S') if arr_flight.search_date else '',
-							arr_flight.departure_airport,
-							arr_flight.arrival_airport,
-							arr_flight.departure_date.strftime('%Y-%m-%d') if arr_flight.departure_date else '',
-							arr_flight.arrival_date.strftime('%Y-%m-%d') if arr_flight.arrival_date else '',
-							arr_flight.departure_time.strftime('%H:%M') if arr_flight.departure_time else '',
-							arr_flight.arrival_time.strftime('%H:%M') if arr_flight.arrival_time else '',
-							arr_flight.price or 0,
-							arr_flight.total_hours or 0,
-							', '.join(arr_flight.companies) if arr_flight.companies else '',
-							arr_flight.connections or '',
-							total_price,
-							trip_duration,
-						]
-						writer.writerow(row)
+		with span('aggregates'):
+			best_deals.write()
+
+	def _write_combinations(
+		self,
+		dep_flight_dp: str,
+		dep_flight_arr: str,
+		dep_flight_dt: datetime,
+		arr_date: datetime,
+		dep_flights: list[FlightRecord],
+		arr_flights: list[FlightRecord],
+		best_deals: BestDeals,
+	) -> None:
+		filename = f'dep_{dep_flight_dp}_{dep_flight_arr}_{dep_flight_dt.strftime("%Y-%m-%d")}__arr_{dep_flight_arr}_{dep_flight_dp}_{arr_date.strftime("%Y-%m-%d")}.csv'
+		if not dep_flights or not arr_flights:
+			return
+
+		rows = len(dep_flights) * len(arr_flights)
+		os.makedirs(OUTPUTS_DIR, exist_ok=True)
+		with span('combine', file=filename, rows=rows), open(os.path.join(OUTPUTS_DIR, filename), 'w', newline='') as off:
+			writer = csv.writer(off)
+
+			writer.writerow(COMBINATION_CSV_HEADERS)
+
+			# Format each leg once, then emit every outbound/return pair
+			dep_rows = [(flight, flight.csv_cells()) for flight in dep_flights]
+			arr_rows = [(flight, flight.csv_cells()) for flight in arr_flights]
+
+			for dep_flight, dep_cells in dep_rows:
+				for arr_flight, arr_cells in arr_rows:
+					writer.writerow(combination_row(dep_flight, arr_flight, dep_cells, arr_cells))
+
+		count('files_written')
+		count('rows_written', rows)
+		record_output(filename, rows)
+		best_deals.add(dep_flights, arr_flights, dep_flight_dt, arr_date, filename)
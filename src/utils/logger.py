@@ -1,7 +1,35 @@
+import json
 import logging
+import math
+import threading
+import time
+from collections.abc import Callable, Generator
+from contextlib import AbstractContextManager, ExitStack, contextmanager
+from datetime import datetime
 
+# Attributes every LogRecord has; anything else on a record came in through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
 
-def setup_logging(level: int = logging.INFO) -> None:
+_span_logger = logging.getLogger('flights.trace')
+
+
+class JsonLinesFormatter(logging.Formatter):
+	"""One JSON object per record, with `extra=` fields as top-level keys"""
+
+	def format(self, record: logging.LogRecord) -> str:
+		entry = {
+			'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+			'level': record.levelname,
+			'logger': record.name,
+			'message': record.getMessage(),
+		}
+		entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+		if record.exc_info:
+			entry['exception'] = self.formatException(record.exc_info)
+		return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup_logging(level: int = logging.INFO, json_lines: bool = False, log_file: str | None = None) -> None:
 	"""Configure root logger once with handlers/formatters."""
 	root_logger = logging.getLogger()
 	root_logger.setLevel(level)
@@ -10,12 +38,111 @@ def setup_logging(level: int = logging.INFO) -> None:
 		ch = logging.StreamHandler()
 		ch.setLevel(level)
 
-		formatter = logging.Formatter('[%(name)s] %(levelname)s: %(message)s')
+		formatter = JsonLinesFormatter() if json_lines else logging.Formatter('[%(name)s] %(levelname)s: %(message)s')
 		ch.setFormatter(formatter)
 
 		root_logger.addHandler(ch)
 
+		if log_file:
+			fh = logging.FileHandler(log_file, encoding='utf-8')
+			fh.setLevel(level)
+			fh.setFormatter(JsonLinesFormatter())
+			root_logger.addHandler(fh)
+
 
 def get_logger(name: str) -> logging.Logger:
 	"""Get a logger with the specified name."""
 	return logging.getLogger(name)
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+	"""Nearest-rank percentile of an already sorted list: the smallest value with at least fraction of the values at or below it"""
+	if not sorted_values:
+		return 0.0
+	rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+	return sorted_values[rank]
+
+
+class RunMetrics:
+	"""Span durations and counters of one run, shared by every thread"""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self.spans: dict[str, list[float]] = {}
+		self.counters: dict[str, int] = {}
+
+	def reset(self) -> None:
+		with self._lock:
+			self.spans = {}
+			self.counters = {}
+
+	def add_span(self, name: str, duration_ms: float) -> None:
+		with self._lock:
+			self.spans.setdefault(name, []).append(duration_ms)
+
+	def count(self, name: str, value: int = 1) -> None:
+		with self._lock:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	def totals(self) -> dict:
+		"""Total milliseconds per span and the counters, for structured log fields"""
+		with self._lock:
+			return {'spans': {name: round(sum(durations), 2) for name, durations in self.spans.items()}, 'counters': dict(self.counters)}
+
+	def summary(self) -> str:
+		"""Plain-text table of span timings (by total time) followed by the counters"""
+		with self._lock:
+			spans = {name: sorted(durations) for name, durations in self.spans.items()}
+			counters = dict(self.counters)
+
+		lines = [f'{"span":<24} {"count":>7} {"total s":>10} {"mean ms":>10} {"p95 ms":>10} {"max ms":>10}']
+		for name, durations in sorted(spans.items(), key=lambda item: -sum(item[1])):
+			p95 = percentile(durations, 0.95)
+			lines.append(f'{name:<24} {len(durations):>7} {sum(durations) / 1000:>10.2f} {sum(durations) / len(durations):>10.1f} {p95:>10.1f} {durations[-1]:>10.1f}')
+		if counters:
+			lines.append('')
+			lines.extend(f'{name:<24} {value:>7}' for name, value in sorted(counters.items()))
+		return '\n'.join(lines)
+
+
+metrics = RunMetrics()
+
+# Context managers entered around every span, e.g. the stage-scoped profilers of src/utils/profiling.py
+SpanHook = Callable[[str], AbstractContextManager]
+_span_hooks: list[SpanHook] = []
+
+
+def add_span_hook(hook: SpanHook) -> None:
+	_span_hooks.append(hook)
+
+
+def remove_span_hook(hook: SpanHook) -> None:
+	if hook in _span_hooks:
+		_span_hooks.remove(hook)
+
+
+@contextmanager
+def span(name: str, **fields) -> Generator[dict, None, None]:
+	"""Time a stage, record it in `metrics` and log it as a `span` event; fields added to the yielded dict are logged with it"""
+	start = time.perf_counter()
+	status = 'ok'
+	try:
+		with ExitStack() as hooks:
+			for hook in list(_span_hooks):
+				hooks.enter_context(hook(name))
+			yield fields
+	except BaseException:
+		status = 'error'
+		raise
+	finally:
+		duration_ms = (time.perf_counter() - start) * 1000
+		metrics.add_span(name, duration_ms)
+		_span_logger.info('%s %.1f ms', name, duration_ms, extra={'span': name, 'duration_ms': round(duration_ms, 2), 'status': status, **fields})
+
+
+def count(name: str, value: int = 1) -> None:
+	metrics.count(name, value)
+
+
+def log_run_summary(logger: logging.Logger | None = None) -> None:
+	(logger or _span_logger).info('run summary\n%s', metrics.summary(), extra=metrics.totals())
@@ -0,0 +1,151 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import tracemalloc
+from collections.abc import Generator
+from contextlib import contextmanager
+from datetime import datetime
+from types import FrameType, TracebackType
+
+from src.utils.logger import add_span_hook, get_logger, remove_span_hook
+
+logger = get_logger(__name__)
+
+RUNS_DIR = 'runs'
+
+
+def new_run_dir(base_dir: str = RUNS_DIR) -> str:
+	path = os.path.join(base_dir, datetime.now().strftime('%Y%m%d-%H%M%S'))
+	os.makedirs(path, exist_ok=True)
+	return path
+
+
+class RunProfiler:
+	"""cProfile and tracemalloc over a whole run, or only inside the named logger spans, written to a run directory
+
+	cProfile only sees the thread that enables it, so every thread (fan-out provider workers included) gets its own
+	profile and they are merged when written. profile.pstats loads in snakeviz, tuna or flameprof (flamegraph);
+	profile.txt and memory.txt are readable as is.
+	"""
+
+	def __init__(self, run_dir: str, cpu: bool = True, memory: bool = False, stages: tuple[str, ...] = (), top: int = 30) -> None:
+		self.run_dir = run_dir
+		self.cpu = cpu
+		self.memory = memory
+		self.stages = frozenset(stages)
+		self.top = top
+		self._lock = threading.Lock()
+		self._local = threading.local()
+		self._profiles: list[cProfile.Profile] = []
+		self._open_stages = 0
+		self._stage_peaks: dict[str, int] = {}
+
+	def _thread_profile(self) -> cProfile.Profile:
+		profile = getattr(self._local, 'profile', None)
+		if profile is None:
+			profile = self._local.profile = cProfile.Profile()
+			with self._lock:
+				self._profiles.append(profile)
+		return profile
+
+	def _profile_new_thread(self, frame: FrameType, event: str, arg: object) -> None:
+		# Installed with threading.setprofile, so it runs once in each thread started during the run; enabling cProfile replaces it
+		self._thread_profile().enable()
+
+	@contextmanager
+	def _stage_hook(self, name: str) -> Generator[None, None, None]:
+		if name not in self.stages:
+			yield
+			return
+
+		# Nested selected stages keep the outermost one of their thread profiling
+		depth = getattr(self._local, 'depth', 0)
+		self._local.depth = depth + 1
+		if depth == 0 and self.cpu:
+			self._thread_profile().enable()
+		if self.memory:
+			# The traced peak is process wide: only reset it when no selected stage is open, so an inner or concurrent
+			# stage reports the peak since the outer one began rather than wiping it
+			with self._lock:
+				if not self._open_stages:
+					tracemalloc.reset_peak()
+				self._open_stages += 1
+			baseline = tracemalloc.get_traced_memory()[0]
+		try:
+			yield
+		finally:
+			if self.memory:
+				peak = tracemalloc.get_traced_memory()[1] - baseline
+				with self._lock:
+					self._open_stages -= 1
+					self._stage_peaks[name] = max(self._stage_peaks.get(name, 0), peak)
+			if depth == 0 and self.cpu:
+				self._thread_profile().disable()
+			self._local.depth = depth
+
+	def __enter__(self) -> 'RunProfiler':
+		os.makedirs(self.run_dir, exist_ok=True)
+		if self.memory:
+			tracemalloc.start(25)
+		if self.stages:
+			add_span_hook(self._stage_hook)
+		elif self.cpu:
+			threading.setprofile(self._profile_new_thread)
+			self._thread_profile().enable()
+		return self
+
+	def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, traceback: TracebackType | None) -> None:
+		if self.stages:
+			remove_span_hook(self._stage_hook)
+		elif self.cpu:
+			threading.setprofile(None)
+			self._thread_profile().disable()
+
+		# Written even when the run failed, that is often the run worth looking at
+		if self.memory:
+			self._write_memory_profile()
+			tracemalloc.stop()
+		if self.cpu and not self._profiles:
+			# pstats cannot load a profile that was never enabled
+			logger.warning('No CPU profile written, no selected stage ran (%s)', ', '.join(sorted(self.stages)))
+		elif self.cpu:
+			self._write_cpu_profile(self._profiles)
+		if self.memory or self._profiles:
+			logger.info('Profile written to %s', self.run_dir)
+
+	def _write_cpu_profile(self, profiles: list[cProfile.Profile]) -> None:
+		report = io.StringIO()
+		stats = pstats.Stats(*profiles, stream=report)
+		stats.dump_stats(os.path.join(self.run_dir, 'profile.pstats'))
+
+		stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+		stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+		with open(os.path.join(self.run_dir, 'profile.txt'), 'w') as out:
+			out.write(report.getvalue())
+
+	def _write_memory_profile(self) -> None:
+		snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')])
+		current, peak = tracemalloc.get_traced_memory()
+
+		lines = [f'current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB', '', f'Top {self.top} allocation sites still alive at the end of the run:']
+		lines.extend(str(stat) for stat in snapshot.statistics('lineno')[: self.top])
+		if self._stage_peaks:
+			lines.extend(['', 'Peak allocation inside each profiled stage:'])
+			lines.extend(f'{name:<24} {peak / 1024:>12.1f} KiB' for name, peak in sorted(self._stage_peaks.items(), key=lambda item: -item[1]))
+
+		with open(os.path.join(self.run_dir, 'memory.txt'), 'w') as out:
+			out.write('\n'.join(lines) + '\n')
+		with open(os.path.join(self.run_dir, 'memory.json'), 'w') as out:
+			json.dump(
+				{
+					'current_bytes': current,
+					'peak_bytes': peak,
+					'stage_peak_bytes': self._stage_peaks,
+					'top': [{'site': str(stat.traceback[0]), 'size_bytes': stat.size, 'count': stat.count} for stat in snapshot.statistics('lineno')[: self.top]],
+				},
+				out,
+				indent=2,
+			)
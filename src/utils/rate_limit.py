@@ -0,0 +1,43 @@
+import threading
+import time
+from collections.abc import Callable
+
+
+class QueryBudget:
+	"""Token bucket refilled at queries_per_hour, holding at most burst queries; safe to share between threads"""
+
+	def __init__(self, queries_per_hour: float, burst: int = 1, clock: Callable[[], float] = time.monotonic) -> None:
+		self.rate = queries_per_hour / 3600
+		self.burst = burst
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._tokens = float(burst)
+		self._updated = clock()
+
+	def _refill(self) -> None:
+		now = self._clock()
+		self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def wait_seconds(self) -> float:
+		with self._lock:
+			self._refill()
+			return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+	def take(self) -> None:
+		with self._lock:
+			self._refill()
+			self._tokens -= 1
+
+	def acquire(self, sleep: Callable[[float], None] = time.sleep) -> float:
+		"""Block until a query is allowed and spend it, returning the seconds waited"""
+		waited = 0.0
+		while True:
+			with self._lock:
+				self._refill()
+				if self._tokens >= 1:
+					self._tokens -= 1
+					return waited
+				wait = (1 - self._tokens) / self.rate
+			sleep(wait)
+			waited += wait
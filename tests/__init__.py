@@ -0,0 +1,35 @@
+import tempfile
+import unittest
+from datetime import date, datetime
+from pathlib import Path
+
+from src.models.records import FlightRecord
+from src.services.database_service import DatabaseService
+
+# One LIS-HND leg; tests vary it with dataclasses.replace
+LEG = FlightRecord(
+	id=None,
+	search_date=date(2030, 1, 1),
+	departure_airport='LIS',
+	arrival_airport='HND',
+	departure_at=datetime(2030, 2, 1, 10, 0),
+	arrival_at=datetime(2030, 2, 2, 8, 0),
+	price=100.0,
+	duration_minutes=1080,
+	stops=1,
+	self_transfer=False,
+	companies=('TAP',),
+)
+
+
+class DatabaseTestCase(unittest.TestCase):
+	"""Gives each test a fresh SQLite DatabaseService in a temporary directory"""
+
+	def setUp(self) -> None:
+		self._tmp = tempfile.TemporaryDirectory()
+		self.url = f'sqlite:///{Path(self._tmp.name) / "flights.db"}'
+		self.db = DatabaseService(self.url, echo=False)
+
+	def tearDown(self) -> None:
+		self.db.close()
+		self._tmp.cleanup()
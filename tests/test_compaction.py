@@ -0,0 +1,70 @@
+import unittest
+from dataclasses import replace
+from datetime import date
+
+from src.models.records import FlightRecord
+from tests import LEG, DatabaseTestCase
+
+
+class CompactHistoryTest(DatabaseTestCase):
+	def _seen_on(self, day: date) -> list[FlightRecord]:
+		return self.db.get_flight_from_to_date('LIS', 'HND', LEG.departure_at.date(), day)
+
+	def test_consecutive_days_merge_into_one_interval(self) -> None:
+		for day in (1, 2, 3):
+			self.db.save_flights([replace(LEG, search_date=date(2030, 1, day))])
+
+		result = self.db.compact_history(vacuum=False)
+
+		self.assertEqual(result.merged_rows, 2)
+		self.assertEqual(len(self._seen_on(date(2030, 1, 2))), 1)
+		self.assertEqual(len(self._seen_on(date(2030, 1, 3))), 1)
+		self.assertEqual(self._seen_on(date(2030, 1, 4)), [])
+
+	def test_gap_between_observations_is_not_merged(self) -> None:
+		self.db.save_flights([replace(LEG, search_date=date(2030, 1, 1))])
+		self.db.save_flights([replace(LEG, search_date=date(2030, 1, 5))])
+
+		result = self.db.compact_history(vacuum=False)
+
+		self.assertEqual(result.merged_rows, 0)
+		self.assertEqual(self._seen_on(date(2030, 1, 3)), [])
+		self.assertEqual(len(self._seen_on(date(2030, 1, 1))), 1)
+		self.assertEqual(len(self._seen_on(date(2030, 1, 5))), 1)
+
+	def test_price_change_starts_a_new_interval(self) -> None:
+		self.db.save_flights([replace(LEG, search_date=date(2030, 1, 1))])
+		self.db.save_flights([replace(LEG, search_date=date(2030, 1, 2), price=90.0)])
+		self.db.save_flights([replace(LEG, search_date=date(2030, 1, 3), price=90.0)])
+
+		result = self.db.compact_history(vacuum=False)
+
+		self.assertEqual(result.merged_rows, 1)
+		self.assertEqual([leg.price for leg in self._seen_on(date(2030, 1, 3))], [90.0])
+		self.assertEqual([leg.price for leg in self._seen_on(date(2030, 1, 1))], [100.0])
+
+	def test_saving_a_compacted_leg_again_is_a_duplicate(self) -> None:
+		for day in (1, 2, 3):
+			self.db.save_flights([replace(LEG, search_date=date(2030, 1, day))])
+		self.db.compact_history(vacuum=False)
+
+		self.db.save_unique_flights([replace(LEG, search_date=date(2030, 1, 2))])
+
+		self.assertEqual(len(self._seen_on(date(2030, 1, 2))), 1)
+
+	def test_repricing_splits_the_compacted_interval(self) -> None:
+		for day in (1, 2, 3):
+			self.db.save_flights([replace(LEG, search_date=date(2030, 1, day))])
+		self.db.compact_history(vacuum=False)
+
+		self.db.save_unique_flights([replace(LEG, search_date=date(2030, 1, 2), price=90.0)], update_prices=True)
+		self.db.save_unique_flights([replace(LEG, search_date=date(2030, 1, 1), price=80.0)], update_prices=True)
+
+		prices = {day: [leg.price for leg in self._seen_on(date(2030, 1, day))] for day in (1, 2, 3)}
+		self.assertEqual(prices, {1: [80.0], 2: [90.0], 3: [100.0]})
+		history = [(rollup.search_date.day, rollup.min_price) for rollup in self.db.get_price_history('LIS', 'HND', LEG.departure_at.date())]
+		self.assertEqual(history, [(1, 80.0), (2, 90.0), (3, 100.0)])
+
+
+if __name__ == '__main__':
+	unittest.main()
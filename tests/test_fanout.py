@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from dataclasses import replace
+from datetime import date, datetime
+
+from src.models.records import FlightRecord
+from src.scraper.fanout import FanOutScraper, merge_legs
+from src.scraper.fixtures import FixtureProvider, write_fixture
+from src.scraper.provider import SearchQuery
+from src.scraper.stats import OUTCOME_OK, QueryStats
+
+QUERY = SearchQuery('LIS', 'HND', '2030-02-01')
+
+DIRECT = FlightRecord(
+	id=None,
+	search_date=date.today(),
+	departure_airport='LIS',
+	arrival_airport='HND',
+	departure_at=datetime(2030, 2, 1, 10, 0),
+	arrival_at=datetime(2030, 2, 2, 6, 0),
+	price=900.0,
+	duration_minutes=1200,
+	stops=0,
+	self_transfer=False,
+	companies=('ANA',),
+)
+ONE_STOP = replace(DIRECT, departure_at=datetime(2030, 2, 1, 7, 0), price=600.0, duration_minutes=1500, stops=1, companies=('TAP', 'ANA'))
+TWO_STOPS = replace(DIRECT, departure_at=datetime(2030, 2, 1, 6, 0), price=500.0, duration_minutes=1800, stops=2, companies=('KLM', 'JAL'))
+
+
+class UnreachableProvider(FixtureProvider):
+	def fetch(self, query: SearchQuery, stats: QueryStats) -> str:
+		raise TimeoutError('site down')
+
+
+class FanOutTest(unittest.TestCase):
+	def setUp(self) -> None:
+		self._tmp = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+		self.first, self.second = (tmp.name for tmp in self._tmp)
+		# Both sites list the direct and the one-stop leg, the second one cheaper for the direct one; only the first has the two-stop leg
+		write_fixture(self.first, QUERY, [DIRECT, ONE_STOP, TWO_STOPS])
+		write_fixture(self.second, QUERY, [replace(DIRECT, price=850.0), ONE_STOP])
+
+	def tearDown(self) -> None:
+		for tmp in self._tmp:
+			tmp.cleanup()
+
+	def test_merge_keeps_one_leg_per_fingerprint_at_the_cheapest_price(self) -> None:
+		merged = merge_legs([[DIRECT, ONE_STOP], [replace(DIRECT, price=850.0), replace(ONE_STOP, price=None)]])
+
+		self.assertEqual(sorted(flight.price for flight in merged if flight.price is not None), [600.0, 850.0])
+		self.assertEqual(len(merged), 2)
+
+	def test_fan_out_merges_both_fixture_providers(self) -> None:
+		scraper = FanOutScraper([FixtureProvider(self.first, name='first'), FixtureProvider(self.second, name='second')])
+		stats = QueryStats()
+		try:
+			flights = scraper.get_flights(QUERY.departure, QUERY.arrival, QUERY.date, stats=stats)
+		finally:
+			scraper.close()
+
+		prices = {flight.stops: flight.price for flight in flights}
+		self.assertEqual(prices, {0: 850.0, 1: 600.0, 2: 500.0})
+		self.assertEqual(stats.outcome, OUTCOME_OK)
+		self.assertEqual(stats.card_count, 5)
+
+	def test_failing_provider_is_left_out(self) -> None:
+		scraper = FanOutScraper([FixtureProvider(self.first, name='first'), UnreachableProvider(self.second, name='down')])
+		try:
+			flights = scraper.get_flights(QUERY.departure, QUERY.arrival, QUERY.date)
+		finally:
+			scraper.close()
+
+		self.assertEqual(sorted(flight.price for flight in flights), [500.0, 600.0, 900.0])
+
+
+if __name__ == '__main__':
+	unittest.main()
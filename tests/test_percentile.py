@@ -0,0 +1,16 @@
+import unittest
+
+from src.utils.logger import percentile
+
+
+class PercentileTest(unittest.TestCase):
+	def test_nearest_rank(self) -> None:
+		self.assertEqual(percentile([1, 2, 3, 4, 5], 0.50), 3)
+		self.assertEqual(percentile(list(range(1, 10)), 0.50), 5)
+		self.assertEqual(percentile(list(range(1, 21)), 0.95), 19)
+		self.assertEqual(percentile([7.0], 0.95), 7.0)
+		self.assertEqual(percentile([], 0.50), 0.0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from dataclasses import replace
+from datetime import date, datetime
+
+from sqlalchemy import create_engine, text
+
+from src.services.database_service import DatabaseService, RetentionPolicy
+from tests import LEG, DatabaseTestCase
+
+
+class PriceRollupTest(DatabaseTestCase):
+	def _history(self, travel_date: date) -> list[tuple[date, float | None, int]]:
+		return [(rollup.search_date, rollup.min_price, rollup.offer_count) for rollup in self.db.get_price_history('LIS', 'HND', travel_date)]
+
+	def _reopen_after_schema_addition(self) -> None:
+		self.db.close()
+		engine = create_engine(self.url)
+		with engine.begin() as conn:
+			conn.execute(text('DROP TABLE trip_price'))
+		engine.dispose()
+		self.db = DatabaseService(self.url, echo=False)
+
+	def test_rebuild_counts_compacted_legs_on_every_day_of_their_interval(self) -> None:
+		for day in (1, 2, 3):
+			self.db.save_flights([replace(LEG, search_date=date(2030, 1, day))])
+		before = self._history(LEG.departure_at.date())
+
+		self.db.compact_history(vacuum=False)
+		self.db.rebuild_price_rollups()
+
+		self.assertEqual(len(before), 3)
+		self.assertEqual(self._history(LEG.departure_at.date()), before)
+
+	def test_saving_after_compaction_counts_the_compacted_interval(self) -> None:
+		for day in (1, 2, 3):
+			self.db.save_flights([replace(LEG, search_date=date(2030, 1, day))])
+		self.db.compact_history(vacuum=False)
+
+		self.db.save_flights([replace(LEG, search_date=date(2030, 1, 3), departure_at=datetime(2030, 2, 1, 18, 0), arrival_at=datetime(2030, 2, 2, 16, 0), price=300.0)])
+		saved = self._history(LEG.departure_at.date())
+		self.db.rebuild_price_rollups()
+
+		self.assertEqual(saved[-1], (date(2030, 1, 3), 100.0, 2))
+		self.assertEqual(self._history(LEG.departure_at.date()), saved)
+
+	def test_rebuild_keeps_rollups_of_expired_legs(self) -> None:
+		past = replace(LEG, search_date=date(2020, 1, 1), departure_at=datetime(2020, 2, 1, 10, 0), arrival_at=datetime(2020, 2, 2, 8, 0))
+		self.db.save_flights([past])
+		self.db.compact_history(RetentionPolicy(past_travel_days=30, rollup_past_travel_days=None), vacuum=False)
+
+		self.db.rebuild_price_rollups()
+
+		self.assertEqual(self._history(date(2020, 2, 1)), [(date(2020, 1, 1), 100.0, 1)])
+
+	def test_adding_a_table_leaves_rollups_alone(self) -> None:
+		for day in (1, 2, 3):
+			self.db.save_flights([replace(LEG, search_date=date(2030, 1, day), price=100.0 - day)])
+		self.db.save_flights([replace(LEG, search_date=date(2030, 1, 4), price=97.0)])
+		self.db.compact_history(vacuum=False)
+		before = self._history(LEG.departure_at.date())
+
+		self._reopen_after_schema_addition()
+
+		self.assertEqual(len(before), 4)
+		self.assertEqual(self._history(LEG.departure_at.date()), before)
+
+
+if __name__ == '__main__':
+	unittest.main()
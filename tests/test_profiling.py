@@ -0,0 +1,58 @@
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.logger import span
+from src.utils.profiling import RunProfiler
+
+
+def square_sum(count: int) -> int:
+	return sum(i * i for i in range(count))
+
+
+def parse_cards(count: int) -> int:
+	with span('parse'):
+		return square_sum(count)
+
+
+class RunProfilerTest(unittest.TestCase):
+	def setUp(self) -> None:
+		self._tmp = tempfile.TemporaryDirectory()
+		self.run_dir = self._tmp.name
+
+	def tearDown(self) -> None:
+		self._tmp.cleanup()
+
+	def _profiled_calls(self, function_name: str) -> int:
+		functions = pstats.Stats(os.path.join(self.run_dir, 'profile.pstats')).get_stats_profile().func_profiles
+		return int(functions[function_name].ncalls) if function_name in functions else 0
+
+	def test_stages_in_pool_threads_are_profiled(self) -> None:
+		with RunProfiler(self.run_dir, stages=('parse',)), ThreadPoolExecutor(3) as pool:
+			list(pool.map(parse_cards, [20000] * 6))
+
+		self.assertEqual(self._profiled_calls('square_sum'), 6)
+		self.assertEqual(self._profiled_calls('parse_cards'), 0)
+
+	def test_whole_run_includes_pool_threads(self) -> None:
+		with RunProfiler(self.run_dir), ThreadPoolExecutor(3) as pool:
+			list(pool.map(parse_cards, [20000] * 6))
+
+		self.assertEqual(self._profiled_calls('parse_cards'), 6)
+
+	def test_nested_stage_keeps_the_outer_peak(self) -> None:
+		with RunProfiler(self.run_dir, cpu=False, memory=True, stages=('scrape', 'parse')), span('scrape'):
+			buffer = bytearray(4 * 1024 * 1024)
+			del buffer
+			parse_cards(10)
+
+		with open(os.path.join(self.run_dir, 'memory.json')) as f:
+			peaks = json.load(f)['stage_peak_bytes']
+		self.assertGreaterEqual(peaks['scrape'], 4 * 1024 * 1024)
+
+
+if __name__ == '__main__':
+	unittest.main()